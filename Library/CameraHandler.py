@@ -1,9 +1,15 @@
-from pathlib import Path
 import logging
+import os
 import threading
 import datetime
+import time
 import cv2
 from Library.Handler import Handler
+from Library.PreviewHandler import make_labels
+from Library.broadcast import tracking_snapshot
+from Library.SettingsHandler import FaceRecognitionSnapshot
+from Library.errors import InvalidUsage
+from Library.profiling import ThreadProfile, sample_stacks
 
 
 class OpencvCamera:
@@ -41,6 +47,110 @@ class OpencvCamera:
             return False
 
 
+class ReplayCamera:
+    """Plays a recorded video file or a folder of pictures back as if it was a camera
+
+    Modes:
+        realtime -- frames are returned at the frame rate of the recording, the frames the processing is too slow
+            for are skipped, like with a live camera
+        fast -- every frame is returned right away
+        step -- every step-th frame is returned right away, the same frames on every run
+    When the recording ends, it starts over if loop is set, otherwise reading fails and the camera loop stops.
+    """
+    modes = ("realtime", "fast", "step")
+    picture_extensions = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+    def __init__(self, path: str, mode: str = "realtime", step: int = 1, loop: bool = False, fps: float = 25.0):
+        if mode not in self.modes:
+            raise ValueError("Unknown replay mode {}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.step = max(1, step)
+        self.loop = loop
+        self.pictures = None
+        self.cam = None
+        if os.path.isdir(path):
+            self.pictures = sorted(os.path.join(path, name) for name in os.listdir(path)
+                                   if name.lower().endswith(self.picture_extensions))
+            self.frame_count = len(self.pictures)
+        else:
+            self.cam = cv2.VideoCapture(path)
+            self.frame_count = int(self.cam.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = self.cam.get(cv2.CAP_PROP_FPS) or fps
+        self.fps = fps
+        # the index of the next frame and the monotonic time the replay (re)started at
+        self.position = 0
+        self.started = None
+        self.frames_read = 0
+        self.frames_skipped = 0
+        self.cam_is_running = self.frame_count > 0 if self.pictures is not None else self.cam.isOpened()
+        if not self.cam_is_running:
+            logging.error("Nothing to replay at {}".format(path))
+
+    def set_resolution(self, res: str) -> bool:
+        # the frames are scaled down to the resolution of the preset by the face handler
+        return True
+
+    def _next_position(self) -> int:
+        """The index of the frame to return next, waiting for it in realtime mode"""
+        if self.mode == "step":
+            return self.position + self.step - 1
+        if self.mode == "fast":
+            return self.position
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now - self.position / self.fps
+        due = self.started + self.position / self.fps
+        if due > now:
+            time.sleep(due - now)
+            return self.position
+        return max(self.position, int((now - self.started) * self.fps))
+
+    def _skip(self, count: int) -> bool:
+        for _ in range(count):
+            if self.cam is not None and not self.cam.grab():
+                return False
+            self.position += 1
+            self.frames_skipped += 1
+        return self.pictures is None or self.position < len(self.pictures)
+
+    def _rewind(self):
+        logging.info("Replay of {} finished after {} frames, starting over".format(self.path, self.frames_read))
+        if self.cam is not None:
+            self.cam.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.position = 0
+        self.started = None
+
+    def _read_frame(self):
+        if self.pictures is None:
+            return self.cam.read()
+        if self.position >= len(self.pictures):
+            return False, None
+        frame = cv2.imread(self.pictures[self.position])
+        return frame is not None, frame
+
+    def read(self):
+        for attempt in range(2):
+            if self._skip(self._next_position() - self.position):
+                ret, frame = self._read_frame()
+                if ret:
+                    self.position += 1
+                    self.frames_read += 1
+                    return ret, frame
+            if not self.loop or attempt:
+                break
+            self._rewind()
+        logging.info("Replay of {} finished after {} frames ({} skipped)".format(
+            self.path, self.frames_read, self.frames_skipped))
+        self.cam_is_running = False
+        return False, None
+
+    def release(self) -> bool:
+        if self.cam is not None:
+            self.cam.release()
+        return True
+
+
 class CameraHandler(Handler):
     cam: OpencvCamera = None
     cam_lock: threading.RLock = threading.RLock()
@@ -50,6 +160,12 @@ class CameraHandler(Handler):
         # loads video with OpenCV
         self.cam_is_running = False
         self.cam_is_processing = False
+        self.last_snapshot = 0.0
+        # the preferred id, URL and resolution the camera was opened with
+        self.camera_source = None
+        # the cProfile session the camera loop has to run under, see profile
+        self.thread_profile: ThreadProfile = None
+        self._profile_lock = threading.Lock()
         logging.info("Camera opened")
 
     def camera_start_processing(self):
@@ -74,11 +190,22 @@ class CameraHandler(Handler):
             if self.app.fh and self.cam_is_running and self.cam_is_processing:
                 self.stop_cam()
                 self.cam_is_processing = False
-                self.app.preview_image = cv2.imread(
-                    str(Path("Static", "empty_pic.png")))
+                self.app.ph.publish_empty()
+                logging.info("Preview annotation: {}".format(self.app.ph.annotation_stats()))
 
             logging.info("Camera scanning stopped")
 
+    def force_rescan(self):
+        """Run the face recognition on the next frame, regardless of the scan frequency"""
+        self.app.force_rescan = True
+
+    def restart_cam(self):
+        """Restart the camera if it is running, e.g. to apply new settings"""
+        with self.cam_lock:
+            if self.cam_is_running:
+                self.stop_cam()
+                self.start_cam()
+
     def camera_process(self):
         """
         Continously calls the process_next_frame() method
@@ -88,25 +215,30 @@ class CameraHandler(Handler):
         error_count = 0
         try:
             while self.cam_is_running:
-                if (ticker > int(self.app.sh.get_face_recognition_settings()["dnn-scan-freq"])
-                    and int(self.app.sh.get_face_recognition_settings()["dnn-scan-freq"]) != -1)\
-                        or self.app.force_rescan:
-                    _, frame, _ = self.app.fh.process_next_frame(
+                settings = self.prepare_next_frame()
+                scan_frequency = settings.dnn_scan_freq
+                if (ticker > scan_frequency and scan_frequency != -1) or self.app.force_rescan:
+                    tracking_data, frame, face_rects = self.app.fh.process_next_frame(
                         True, save_new_faces=True)
                     ticker = 0
                     self.app.force_rescan = False
-
-                    self.app.preview_image = frame
                 else:
-                    _, frame, _ = self.app.fh.process_next_frame(
+                    tracking_data, frame, face_rects = self.app.fh.process_next_frame(
                         save_new_faces=True)
-                    self.app.preview_image = frame
-                    if int(self.app.sh.get_face_recognition_settings()["dnn-scan-freq"]) == -1:
-                        ticker = 0
+                # the preview is annotated and encoded here, when somebody is watching
+                lap = time.perf_counter()
+                self.app.ph.publish(frame, face_rects, make_labels(tracking_data))
+                self.publish_tracking_snapshot(tracking_data)
+                self.app.fh.stage_timers.get(settings.selected_setting).lap("annotation", lap)
+                if scan_frequency == -1:
+                    ticker = 0
                 ticker += 1
                 error_count = 0
         except AssertionError as e:
-            print(e)
+            if self.cam is not None and not self.cam.cam_is_running:
+                self.camera_finished()
+            else:
+                print(e)
         except Exception as e:
             error_count += 1
             if self.cam:
@@ -115,36 +247,141 @@ class CameraHandler(Handler):
             if error_count > 5:
                 self.cam_is_running = False
             raise e
+        finally:
+            # a profile can only be stopped by the thread it runs on
+            if self.thread_profile is not None:
+                self.thread_profile.finish()
+
+    def camera_finished(self):
+        """Stop the processing when the camera stopped on its own, e.g. a replay without loop reached its end
+        Called by the camera thread, so it doesn't wait for the camera lock a stopping thread may hold
+        """
+        self.cam_is_running = False
+        self.cam_is_processing = False
+        self.cam.release()
+        self.app.ph.publish_empty()
+        logging.info("The camera stopped, camera scanning stopped")
+
+    def profile(self, seconds: float, mode: str = "sample", interval: float = 0.005):
+        """Profile the running camera loop for a while
+
+        Arguments:
+            seconds {float} -- How long to profile
+
+        Keyword Arguments:
+            mode {str} -- "sample" for the collapsed stacks of a sampling profiler, the lowest overhead,
+                "cprofile" for a pstats dump and "cprofile-text" for a pstats text report (default: {"sample"})
+            interval {float} -- The sampling interval in seconds (default: {0.005})
+
+        Raises:
+            InvalidUsage: The camera isn't processing, the mode is unknown or another profile is running
+
+        Returns:
+            str or bytes -- The collapsed stacks, the pstats dump or the text report
+        """
+        thread = self.app.camera_thread
+        if thread is None or not thread.is_alive():
+            raise InvalidUsage("The camera is not processing, there is nothing to profile", status_code=409)
+        if mode not in ("sample", "cprofile", "cprofile-text"):
+            raise InvalidUsage("Unknown profiling mode {}".format(mode))
+        if not self._profile_lock.acquire(blocking=False):
+            raise InvalidUsage("Another profile is running", status_code=409)
+        try:
+            if mode == "sample":
+                return sample_stacks(thread.ident, seconds, interval)
+            return self._cprofile(seconds, text=mode == "cprofile-text")
+        finally:
+            self._profile_lock.release()
+
+    def _cprofile(self, seconds: float, text: bool):
+        previous = self.thread_profile
+        if previous is not None and not previous.done.is_set():
+            raise InvalidUsage("The camera loop hasn't stopped the previous profile yet", status_code=409)
+        thread_profile = ThreadProfile(seconds)
+        self.thread_profile = thread_profile
+        # the first frame may take a while, e.g. a DNN pass
+        finished = thread_profile.wait(seconds + 30)
+        if not finished:
+            # the profiler can only be disabled by the camera thread, it does so on its next frame
+            thread_profile.stop()
+            raise InvalidUsage("The camera loop didn't finish the profile in time", status_code=409)
+        self.thread_profile = None
+        return thread_profile.text() if text else thread_profile.pstats_dump()
+
+    def prepare_next_frame(self) -> FaceRecognitionSnapshot:
+        """Apply the changes requested since the last frame, in the camera thread
+
+        Returns:
+            FaceRecognitionSnapshot -- The settings of the next frame
+        """
+        thread_profile = self.thread_profile
+        if thread_profile is not None:
+            thread_profile.tick()
+        settings = self.app.sh.get_face_recognition_snapshot()
+        if settings.camera_source != self.camera_source:
+            # the camera preset was changed, possibly by another process
+            self.reopen_cam(settings)
+        return settings
+
+    def publish_tracking_snapshot(self, tracking_data):
+        """Push the tracking state to the event stream subscribers, at most every EVENT_SNAPSHOT_SECONDS"""
+        now = time.monotonic()
+        if self.app.eb.subscriber_count == 0 \
+                or now - self.last_snapshot < self.app.config.get("EVENT_SNAPSHOT_SECONDS", 2.0):
+            return
+        self.last_snapshot = now
+        self.app.eb.publish("tracking", tracking_snapshot(tracking_data))
 
     def start_cam(self):
         with self.cam_lock:
             if self.cam_is_running:
                 return
 
-            active_camera_setting = self.app.sh.get_camera_setting_by_name(
-                self.app.sh.get_face_recognition_settings()["selected-setting"])
+            self.open_camera(self.app.sh.get_face_recognition_snapshot())
+            self.cam_is_running = self.cam.cam_is_running
 
-            def create_camera():
-                if active_camera_setting["preferred-id"] == -1:
-                    self.cam = OpencvCamera.from_url(
-                        active_camera_setting["URL"])
-                    self.cam_is_running = self.cam.cam_is_running
-                    logging.info("IP camera started")
-                else:
-                    self.cam = OpencvCamera.from_id(
-                        active_camera_setting["preferred-id"])
-                    self.cam_is_running = self.cam.cam_is_running
-                    logging.info("Web camera started")
+    def open_camera(self, settings: FaceRecognitionSnapshot):
+        """Open the camera of a camera preset, setting its resolution
+
+        Arguments:
+            settings {FaceRecognitionSnapshot} -- The settings with the selected camera preset
+        """
+        def create_camera():
+            if settings.preferred_id == -2:
+                self.cam = ReplayCamera(settings.replay_path, settings.replay_mode, settings.replay_step,
+                                        settings.replay_loop, self.app.config.get("REPLAY_FPS", 25.0))
+                logging.info("Replay of {} started ({})".format(settings.replay_path, settings.replay_mode))
+            elif settings.preferred_id == -1:
+                self.cam = OpencvCamera.from_url(
+                    settings.url)
+                logging.info("IP camera started")
+            else:
+                self.cam = OpencvCamera.from_id(
+                    settings.preferred_id)
+                logging.info("Web camera started")
+
+        create_camera()
+        self.cam.set_resolution(settings.resolution)
 
+        # a replay has no resolution to set, and probing it would use up its first frame
+        if not isinstance(self.cam, ReplayCamera) and not self.cam.read()[0]:
+            logging.error("Could not set resolution. The camera might not support changing the resolution. Retrying...")
+            self.cam.release()
             create_camera()
-            self.cam.set_resolution(active_camera_setting["resolution"])
 
-            if not self.cam.read()[0]:
-                logging.error("Could not set resolution. The camera might not support changing the resolution. Retrying...")
-                self.cam.release()
-                create_camera()
+        self.camera_source = settings.camera_source
+        logging.info("Camera object: {}".format(self.cam))
+
+    def reopen_cam(self, settings: FaceRecognitionSnapshot):
+        """Switch to another camera preset from the camera thread, without stopping the thread
 
-            logging.info("Camera object: {}".format(self.cam))
+        Arguments:
+            settings {FaceRecognitionSnapshot} -- The settings with the new camera preset
+        """
+        with self.cam_lock:
+            logging.info("Switching the camera to {}".format(settings.selected_setting))
+            self.cam.release()
+            self.open_camera(settings)
 
     def stop_cam(self):
         with self.cam_lock:
@@ -1,331 +1,976 @@
-from datetime import datetime
-import logging
-from typing import List
-import json
-from pathlib import Path
-from nacl import pwhash
-from peewee import (TextField, DateTimeField, DeferredForeignKey, BooleanField,
-                    SqliteDatabase, prefetch, Model, ForeignKeyField, BlobField, Select)
-
-from Library.Handler import Handler
-
-
-class DBModel(Model):
-    """Base model for peewee models"""
-    _handler = None
-
-    class Meta:
-        database: SqliteDatabase = None
-
-def bulk_update(model: DBModel, item_list: List, field_list: List, value_list: List):
-    """Bulk update the given fields with the given values on the list of items
-
-    Arguments:
-        model {DBModel} -- The model the items belong to
-        item_list {List} -- The list of items to update
-        field_list {List} -- The list of fields to update on the items
-        value_list {List} -- The list of values to assign to their respective fields
-
-    Raises:
-        AssertionError: Incorrect list lengths given
-    """
-    with model._meta.database.atomic():
-        if len(item_list) > 0 and len(field_list) > 0 and len(field_list) == len(value_list):
-            for field, value in zip(field_list, value_list):
-                for item in item_list:
-                    setattr(item, field.name, value)
-            model.bulk_update(item_list, field_list)
-        else:
-            raise AssertionError("Incorrect arguments given")
-
-class Person(DBModel):
-    name = TextField(unique=True)
-    preference = TextField(null=True)
-    first_seen = DateTimeField(null=True)
-    last_seen = DateTimeField(null=True)
-    thumbnail = DeferredForeignKey(
-        'Image', deferrable='INITIALLY DEFERRED', on_delete='SET_NULL', null=True)
-    unknown = BooleanField(default=True)
-
-    def change_name(self, new_name: str):
-        """Change person's name
-
-        Arguments:
-            new_name {str} -- The new name of the person
-        """
-        self.name = new_name
-        with self._meta.database.atomic():
-            self.save()
-        self._invalidate_handler()
-
-    def change_pref(self, new_pref: str):
-        """Change person's preferences
-
-        Arguments:
-        new_pref {str} -- The new preferences of the person
-        """
-        self.preference = new_pref
-        with self._meta.database.atomic():
-            self.save()
-        self._invalidate_handler()
-
-    def merge_with(self, other: 'Person'):
-        """Merge with other person
-
-        Arguments:
-            other {Person} -- The person to merge this person to
-        """
-        with self._meta.database.atomic():
-            encodings = list(self.encodings)
-            images = list(self.images)
-
-            bulk_update(Encoding, encodings, [Encoding.person], [other])
-            bulk_update(Image, images, [Image.person], [other])
-
-            self.remove()
-
-    def convert_to_known(self):
-        """Convert person to known person
-        """
-        self.unknown = False
-        with self._meta.database.atomic():
-            self.save()
-
-    def remove(self):
-        """Remove person from database
-        """
-        with self._meta.database.atomic():
-            self.delete_instance()
-        self._invalidate_handler()
-
-    def remove_image(self, image_name: str):
-        with self._meta.database.atomic():
-            next(i for i in self.images if i.name == image_name).delete_instance()
-        self._invalidate_handler()
-
-    def add_image(self, image_name: str, set_as_thumbnail: bool = False):
-        """Add new image for this person, optionally setting it as the thumbnail
-
-        Arguments:
-            image_name {str} -- The name of the image file to add
-
-        Keyword Arguments:
-            set_as_thumbnail {bool} -- Whether to set the new image as the thumbnail of the person (default: {False})
-        """
-        image = Image()
-        image.name = image_name
-        image.person = self
-        with self._meta.database.atomic():
-            image.save()
-
-            if set_as_thumbnail:
-                self.set_thumbnail(image)
-
-        self._invalidate_handler()
-
-        logging.info("{} image was added for the person {}".format(
-            image_name, self.name))
-
-    def add_encoding(self, encodingbytes: bytes):
-        """Add a new face encoding for the person
-
-        Arguments:
-            encodingbytes {bytes} -- The face encoding to associate with the person
-        """
-        encoding = Encoding()
-        encoding.encoding = encodingbytes
-        encoding.person = self
-        with self._meta.database.atomic():
-            encoding.save()
-
-        self._invalidate_handler()
-
-        logging.info(
-            "A new encoding was added for the person {}".format(self.name))
-
-    def set_thumbnail(self, thumbnail: 'Image'):
-        """Change the person's thumbnail
-
-        Arguments:
-            thumbnail {Image} -- The Image object to set the thumbnail to
-        """
-        self.thumbnail = thumbnail
-        with self._meta.database.atomic():
-            self.save()
-
-    def _invalidate_handler(self):
-        """Invalidate the DatabaseHandler the model is associated with, causing a cache bust
-        """
-        if self._handler is not None:
-            self._handler.invalidate()
-
-
-class Encoding(DBModel):
-    encoding = BlobField(null=True)
-    person = ForeignKeyField(Person, backref='encodings', on_delete='CASCADE')
-
-
-class UserEvent(DBModel):
-    datetime = DateTimeField()
-    event = TextField()
-
-
-class Image(DBModel):
-    name = TextField(unique=True)
-    person = ForeignKeyField(Person, backref='images', on_delete='CASCADE')
-
-    def set_as_thumbnail(self):
-        """Set as the thumbnail for the person of this image
-        """
-        self.person.set_thumbnail(self)
-
-    def change_person(self, to_person: Person):
-        """Change the person of the image
-
-        Arguments:
-            to_person {Person} -- The new owner of the image
-        """
-        self.person = to_person
-        with self._meta.database.atomic():
-            self.save()
-
-
-class User(DBModel):
-    name = TextField(unique=True)
-    password_hash = BlobField()
-
-    def verify(self, password: str) -> bool:
-        """Verify the login attempt from this user
-
-        Arguments:
-            password {str} -- The password of the login attempt
-
-        Returns:
-            bool -- Whether the login was accepted
-        """
-        return pwhash.verify(self.password_hash, password.encode())
-
-    def change_password(self, old_password: str, new_password: str) -> bool:
-        """Change the user's password
-
-        Arguments:
-            old_password {str} -- The old password of the user
-            new_password {str} -- The new password of the user
-
-        Returns:
-            bool -- Whether the password change was succesful
-        """
-        if self.verify(old_password):
-            self.password_hash = pwhash.str(new_password.encode())
-            with self._meta.database.atomic():
-                self.save()
-            return True
-        return False
-
-
-class DatabaseHandler(Handler):
-    TIME_FORMAT = "%Y.%m.%d. %H:%M:%S"
-    _persons_select: Select = None
-    _unknown_persons_select: Select = None
-    _known_persons_select: Select = None
-    _images_select: Select = None
-    _encodings_select: Select = None
-    valid = False
-    database: SqliteDatabase = None
-
-    def __init__(self, app, db_location):
-        super().__init__(app)
-
-        DBModel._handler = self
-        self.database = SqliteDatabase(db_location, pragmas=(('foreign_keys', 'on'),))
-        self.database.connect()
-        self.init_tables([UserEvent, Encoding, Person, Image, User])
-        # db.close()
-        self.refresh()
-
-    def init_tables(self, tables: List[DBModel]):
-        # for some reason, changing the meta database on the DBModel doesn't inherit to the model implementations
-        # so we have to set it on each table manually
-        for table in tables:
-            table._meta.database = self.database
-        self.database.create_tables(tables)
-
-    def add_person(self, name: str, unknown: bool = True, thumbnail: Image = None) -> Person:
-        new_person = Person()
-        new_person.name = name
-        new_person.first_seen = datetime.now()
-        new_person.last_seen = new_person.first_seen
-        new_person.unknown = unknown
-        new_person.thumbnail = thumbnail
-        with self.database.atomic():
-            new_person.save()
-
-        self.refresh()
-
-        logging.info("A new {} person was added with the name {}".format(
-            'unkown' if unknown else 'known', name))
-
-        return new_person
-
-    def get_person_by_name(self, name: str) -> Person:
-        return Person.get(Person.name == name)
-
-    def get_user_by_name(self, name: str) -> User:
-        return User.get(User.name == name)
-
-    def get_image_by_name(self, name: str) -> Image:
-        return Image.get(Image.name == name)
-
-    def get_all_events(self) -> List:
-        return UserEvent.select()
-
-    def log_event(self, text: str):
-        new_event = UserEvent.create(datetime=datetime.now(), event=text)
-        new_event.save()
-
-    def invalidate(self):
-        self.valid = False
-
-    def refresh(self):
-        self._persons_select = Person.select()
-        # peewee doesn't work with an equality check in the format of Person.unknown is False
-        # instead we should use Person.unknown == False
-        self._known_persons_select = Person.select().where(Person.unknown == False)  # NOQA
-        self._unknown_persons_select = Person.select().where(Person.unknown == True)  # NOQA
-        self._images_select = Image.select()
-        self._encodings_select = Encoding.select()
-        self.valid = True
-
-    def get_persons(self) -> List[Person]:
-        """
-        Returns all persons, known and unknown both
-        """
-        logging.info("Getting all persons")
-        if not self.valid:
-            self.refresh()
-        return prefetch(self._persons_select, self._images_select, self._encodings_select)
-
-    def get_known_persons(self) -> List[Person]:
-        logging.info("Getting known persons")
-        if not self.valid:
-            self.refresh()
-        return prefetch(self._known_persons_select, self._images_select, self._encodings_select)
-
-    def get_unknown_persons(self) -> List[Person]:
-        logging.info("Getting unknown persons")
-        if not self.valid:
-            self.refresh()
-        return prefetch(self._unknown_persons_select, self._images_select, self._encodings_select)
-
-    # loads the face_recognition_settings table from the database into a dictionary
-
-    def load_face_recognition_settings(self):
-        with open(Path("Data/FaceRecSettings.json")) as json_file:
-            sett = json.load(json_file)
-        return sett
-
-    # loads the notification_settings table from the database into a dictionary
-    def load_notification_settings(self):
-        with open(Path("Data/NotificationSettings.json")) as json_file:
-            sett = json.load(json_file)
-        return sett
+import atexit
+from datetime import datetime, timedelta
+import logging
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Tuple, Callable
+from nacl import pwhash
+from peewee import (TextField, DateTimeField, DeferredForeignKey, BooleanField, BigIntegerField, IntegerField,
+                    DateField, FloatField, SqliteDatabase, prefetch, Model, ForeignKeyField, BlobField, Select, JOIN,
+                    fn, EXCLUDED, SQL)
+from playhouse.migrate import SqliteMigrator, migrate
+
+from Library.Handler import Handler
+from Library.DatabaseWriter import DatabaseWriter
+from Library.metrics import TimedSqliteDatabase
+
+
+class DBModel(Model):
+    """Base model for peewee models"""
+    _handler = None
+
+    class Meta:
+        database: SqliteDatabase = None
+
+    def _invalidate_handler(self):
+        """Invalidate the DatabaseHandler the model is associated with, causing a cache bust
+        """
+        if self._handler is not None:
+            self._handler.invalidate()
+
+def bulk_update(model: DBModel, item_list: List, field_list: List, value_list: List):
+    """Bulk update the given fields with the given values on the list of items
+
+    Arguments:
+        model {DBModel} -- The model the items belong to
+        item_list {List} -- The list of items to update
+        field_list {List} -- The list of fields to update on the items
+        value_list {List} -- The list of values to assign to their respective fields
+
+    Raises:
+        AssertionError: Incorrect list lengths given
+    """
+    with model._meta.database.atomic():
+        if len(item_list) > 0 and len(field_list) > 0 and len(field_list) == len(value_list):
+            for field, value in zip(field_list, value_list):
+                for item in item_list:
+                    setattr(item, field.name, value)
+            model.bulk_update(item_list, field_list)
+        else:
+            raise AssertionError("Incorrect arguments given")
+
+def chunks(items: List, size: int = 500):
+    """Split a list into parts of at most size items, e.g. to stay under the SQLite limit of bound parameters"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class Person(DBModel):
+    name = TextField(unique=True)
+    preference = TextField(null=True)
+    first_seen = DateTimeField(null=True)
+    last_seen = DateTimeField(null=True, index=True)
+    thumbnail = DeferredForeignKey(
+        'Image', deferrable='INITIALLY DEFERRED', on_delete='SET_NULL', null=True)
+    unknown = BooleanField(default=True, index=True)
+
+    def change_name(self, new_name: str):
+        """Change person's name
+
+        Arguments:
+            new_name {str} -- The new name of the person
+        """
+        self.name = new_name
+        with self._meta.database.atomic():
+            self.save()
+        self._invalidate_handler()
+
+    def change_pref(self, new_pref: str):
+        """Change person's preferences
+
+        Arguments:
+        new_pref {str} -- The new preferences of the person
+        """
+        self.preference = new_pref
+        with self._meta.database.atomic():
+            self.save()
+        self._invalidate_handler()
+
+    def merge_with(self, other: 'Person'):
+        """Merge with other person
+
+        Arguments:
+            other {Person} -- The person to merge this person to
+        """
+        self._handler.merge_persons([self], other)
+
+    def convert_to_known(self):
+        """Convert person to known person
+        """
+        self.unknown = False
+        with self._meta.database.atomic():
+            self.save()
+        self._invalidate_handler()
+
+    def remove(self):
+        """Remove person from database
+        """
+        with self._meta.database.atomic():
+            self.delete_instance()
+        self._invalidate_handler()
+
+    def remove_image(self, image_name: str):
+        with self._meta.database.atomic():
+            next(i for i in self.images if i.name == image_name).delete_instance()
+        self._invalidate_handler()
+
+    def add_image(self, image_name: str, set_as_thumbnail: bool = False, phash: int = None, thumb: str = None):
+        """Add new image for this person, optionally setting it as the thumbnail
+
+        Arguments:
+            image_name {str} -- The name of the image file to add
+
+        Keyword Arguments:
+            set_as_thumbnail {bool} -- Whether to set the new image as the thumbnail of the person (default: {False})
+            phash {int} -- The perceptual hash of the image (default: {None})
+            thumb {str} -- The file name of the thumbnail of the image (default: {None})
+        """
+        image = Image()
+        image.name = image_name
+        image.person = self
+        image.phash = phash
+        image.thumb = thumb
+        with self._meta.database.atomic():
+            image.save()
+
+            if set_as_thumbnail:
+                self.set_thumbnail(image)
+
+        self._invalidate_handler()
+
+        logging.info("{} image was added for the person {}".format(
+            image_name, self.name))
+
+    def add_encoding(self, encodingbytes: bytes):
+        """Add a new face encoding for the person
+
+        Arguments:
+            encodingbytes {bytes} -- The face encoding to associate with the person
+        """
+        encoding = Encoding()
+        encoding.encoding = encodingbytes
+        encoding.person = self
+        with self._meta.database.atomic():
+            encoding.save()
+
+        self._invalidate_handler()
+
+        logging.info(
+            "A new encoding was added for the person {}".format(self.name))
+
+    def set_thumbnail(self, thumbnail: 'Image'):
+        """Change the person's thumbnail
+
+        Arguments:
+            thumbnail {Image} -- The Image object to set the thumbnail to
+        """
+        self.thumbnail = thumbnail
+        with self._meta.database.atomic():
+            self.save()
+        self._invalidate_handler()
+
+
+class Encoding(DBModel):
+    encoding = BlobField(null=True)
+    person = ForeignKeyField(Person, backref='encodings', on_delete='CASCADE')
+
+
+class UserEvent(DBModel):
+    datetime = DateTimeField(index=True)
+    event = TextField()
+    # e.g. "arrived" or "left", None for the free text events
+    kind = TextField(null=True, index=True)
+    person_name = TextField(null=True)
+
+
+class Presence(DBModel):
+    """An interval while a person was in front of a camera, the end is None while the person is still there"""
+    person = ForeignKeyField(Person, backref='presences', on_delete='CASCADE')
+    camera = TextField(null=True)
+    start = DateTimeField(index=True)
+    end = DateTimeField(null=True, index=True)
+    # the length in seconds, set when the interval ends, the longest interval of a person bounds the range queries
+    seconds = FloatField(null=True)
+    frame_count = IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('person', 'start'), False),
+            (('person', 'seconds'), False),
+        )
+
+
+class EventRollup(DBModel):
+    """Daily per person summary of the events that are older than the retention period"""
+    day = DateField()
+    # empty instead of NULL, so the unique index covers the events without a person or kind too
+    person_name = TextField(default="")
+    kind = TextField(default="")
+    count = IntegerField(default=0)
+    first = DateTimeField()
+    last = DateTimeField()
+
+    class Meta:
+        indexes = (
+            (('day', 'person_name', 'kind'), True),
+        )
+
+
+class Image(DBModel):
+    name = TextField(unique=True)
+    person = ForeignKeyField(Person, backref='images', on_delete='CASCADE')
+    phash = BigIntegerField(null=True, index=True)
+    # the file name of the thumbnail in Static/Images/thumbs, see Library.thumbnails
+    thumb = TextField(null=True)
+
+    def set_as_thumbnail(self):
+        """Set as the thumbnail for the person of this image
+        """
+        self.person.set_thumbnail(self)
+
+    def change_person(self, to_person: Person):
+        """Change the person of the image
+
+        Arguments:
+            to_person {Person} -- The new owner of the image
+        """
+        self.person = to_person
+        with self._meta.database.atomic():
+            self.save()
+        self._invalidate_handler()
+
+
+class User(DBModel):
+    name = TextField(unique=True)
+    password_hash = BlobField()
+
+    def verify(self, password: str) -> bool:
+        """Verify the login attempt from this user
+
+        Arguments:
+            password {str} -- The password of the login attempt
+
+        Returns:
+            bool -- Whether the login was accepted
+        """
+        return pwhash.verify(self.password_hash, password.encode())
+
+    def change_password(self, old_password: str, new_password: str) -> bool:
+        """Change the user's password
+
+        Arguments:
+            old_password {str} -- The old password of the user
+            new_password {str} -- The new password of the user
+
+        Returns:
+            bool -- Whether the password change was succesful
+        """
+        if self.verify(old_password):
+            self.password_hash = pwhash.str(new_password.encode())
+            with self._meta.database.atomic():
+                self.save()
+            return True
+        return False
+
+
+class GalleryVersion(DBModel):
+    """A single row counting the changes of the persons, images and encodings, made by any process
+    The other processes compare it to the version their cached person queries were loaded in
+    """
+    version = IntegerField(default=0)
+
+
+class DatabaseHandler(Handler):
+    """Access to the SQLite database
+
+    The person queries are cached: every change of the persons, images or encodings bumps the generation
+    counter, and a cached result is only served while the generation it was loaded in is current.
+    invalidate() also increments the version stored in the database, the changes committed by other processes
+    are noticed by checking it whenever PRAGMA data_version shows a commit of another connection.
+    The other commits, e.g. the event log and the presence intervals, leave the cache alone.
+
+    Every thread gets its own connection (peewee opens them on first use), and the database runs in WAL mode,
+    so the request threads keep reading while the camera thread writes.
+    """
+    TIME_FORMAT = "%Y.%m.%d. %H:%M:%S"
+    # applied to every new connection
+    pragmas = (
+        ('foreign_keys', 'on'),
+        ('journal_mode', 'wal'),
+        # in WAL mode NORMAL only syncs at checkpoints, a power loss can lose the last transactions but
+        # can't corrupt the database
+        ('synchronous', 'normal'),
+        ('cache_size', -16000),  # in KiB
+        ('mmap_size', 64 * 1024 * 1024),
+        ('temp_store', 'memory'),
+    )
+    # seconds a writer waits for the lock of another writer before giving up
+    busy_timeout = 10
+    _persons_select: Select = None
+    _unknown_persons_select: Select = None
+    _known_persons_select: Select = None
+    _images_select: Select = None
+    _encodings_select: Select = None
+    database: TimedSqliteDatabase = None
+
+    def __init__(self, app, db_location):
+        super().__init__(app)
+
+        DBModel._handler = self
+        # counts the queries and records their latency for the /metrics endpoint
+        self.database = TimedSqliteDatabase(db_location, pragmas=self.pragmas, timeout=self.busy_timeout)
+        self.database.connect()
+        self.migrate_tables()
+        self.init_tables([UserEvent, EventRollup, Presence, Encoding, Person, Image, User, GalleryVersion])
+        self.database.execute_sql("INSERT OR IGNORE INTO galleryversion (id, version) VALUES (1, 0)")
+        # db.close()
+        self.generation = 0
+        # cache key -> (generation, result)
+        self._cache: Dict[str, Tuple[int, object]] = dict()
+        self._cache_lock = threading.Lock()
+        # a read-only connection of our own, its data_version changes whenever any other connection commits
+        self._version_connection = sqlite3.connect(db_location, timeout=self.busy_timeout, check_same_thread=False)
+        self._version_lock = threading.Lock()
+        self._data_version = self._read_data_version()
+        self._gallery_version = self._read_gallery_version()
+        # events are written in batches on a background thread, see log_event
+        config = getattr(app, "config", dict())
+        self.writer = DatabaseWriter(self.database,
+                                     flush_interval_ms=config.get("DB_WRITER_INTERVAL_MS", 500),
+                                     batch_size=config.get("DB_WRITER_BATCH_SIZE", 100),
+                                     max_queue=config.get("DB_WRITER_QUEUE_SIZE", 1000))
+        atexit.register(self.writer.stop)
+        self.refresh()
+        self.check_query_plans()
+
+    def init_tables(self, tables: List[DBModel]):
+        # for some reason, changing the meta database on the DBModel doesn't inherit to the model implementations
+        # so we have to set it on each table manually
+        for table in tables:
+            table._meta.database = self.database
+        # the missing indexes are also created on existing databases (CREATE INDEX IF NOT EXISTS)
+        self.database.create_tables(tables)
+
+    def migrate_tables(self):
+        """Add the columns that were introduced after a database file was created
+        Has to run before init_tables, since creating the indexes of the new columns needs the columns
+        """
+        migrator = SqliteMigrator(self.database)
+        operations = []
+        backfill_events = False
+        if self.database.table_exists('image'):
+            columns = [column.name for column in self.database.get_columns('image')]
+            if 'phash' not in columns:
+                operations.append(migrator.add_column('image', 'phash', BigIntegerField(null=True)))
+            if 'thumb' not in columns:
+                operations.append(migrator.add_column('image', 'thumb', TextField(null=True)))
+        if self.database.table_exists('userevent'):
+            columns = [column.name for column in self.database.get_columns('userevent')]
+            if 'kind' not in columns:
+                operations.append(migrator.add_column('userevent', 'kind', TextField(null=True)))
+                operations.append(migrator.add_column('userevent', 'person_name', TextField(null=True)))
+                backfill_events = True
+        if operations:
+            with self.database.atomic():
+                migrate(*operations)
+                if backfill_events:
+                    # the old events only had the text, e.g. "[ARRIVED]: name"
+                    for kind, prefix in (("arrived", "[ARRIVED]: "), ("left", "[LEFT]: ")):
+                        self.database.execute_sql(
+                            "UPDATE userevent SET kind = ?, person_name = substr(event, ?) WHERE event LIKE ?",
+                            (kind, len(prefix) + 1, prefix + "%"))
+            logging.info("Database migrated, {} operations executed".format(len(operations)))
+
+    def hot_queries(self) -> Dict[str, Select]:
+        """The queries run constantly by the camera loop and the web UI, which must not scan whole tables"""
+        return {
+            "person by name": Person.select().where(Person.name == ""),
+            "unknown persons": Person.select().where(Person.unknown == True),  # NOQA
+            "recently seen persons": Person.select().where(Person.last_seen > datetime.now()),
+            "images of a person": Image.select().where(Image.person == 0),
+            "image by name": Image.select().where(Image.name == ""),
+            "encodings of a person": Encoding.select().where(Encoding.person == 0),
+            "events in a time range": UserEvent.select().where(UserEvent.datetime > datetime.now()),
+            "presence of a person in a time range": Presence.select().where(
+                (Presence.person == 0) & (Presence.start >= datetime.now()) & (Presence.start < datetime.now())),
+            "open presence intervals": Presence.select().where(Presence.end.is_null()),
+            "latest events of a kind": UserEvent.select().where((UserEvent.kind == "") & (UserEvent.id < 0))
+                                                .order_by(UserEvent.id.desc()).limit(1),
+        }
+
+    def check_query_plans(self) -> List[str]:
+        """Run EXPLAIN QUERY PLAN on the hot queries, logging the ones that scan a whole table
+
+        Returns:
+            List[str] -- The names of the queries with a full table scan
+        """
+        scanning = []
+        for name, query in self.hot_queries().items():
+            sql, params = query.sql()
+            plan = [row[-1] for row in self.database.execute_sql("EXPLAIN QUERY PLAN " + sql, params)]
+            # "SCAN table" is a full scan, "SEARCH table USING INDEX" or "SCAN table USING COVERING INDEX" are fine
+            if any(step.startswith("SCAN") and "INDEX" not in step for step in plan):
+                scanning.append(name)
+                logging.warning("The query '{}' scans a whole table: {}".format(name, "; ".join(plan)))
+        return scanning
+
+    def add_person(self, name: str, unknown: bool = True, thumbnail: Image = None) -> Person:
+        new_person = Person()
+        new_person.name = name
+        new_person.first_seen = datetime.now()
+        new_person.last_seen = new_person.first_seen
+        new_person.unknown = unknown
+        new_person.thumbnail = thumbnail
+        with self.database.atomic():
+            new_person.save()
+
+        self.refresh()
+
+        logging.info("A new {} person was added with the name {}".format(
+            'unkown' if unknown else 'known', name))
+
+        return new_person
+
+    def merge_persons(self, sources: List[Person], target: Person) -> int:
+        """Merge persons into one, moving their encodings, images and presence intervals with set based updates
+        in a single transaction, then removing them
+
+        Arguments:
+            sources {List[Person]} -- The persons to merge, the target is skipped if it's among them
+            target {Person} -- The person to merge into
+
+        Returns:
+            int -- The number of persons merged
+        """
+        sources = [person for person in sources if person.id != target.id]
+        if not sources:
+            return 0
+        first_seen = [person.first_seen for person in sources + [target] if person.first_seen is not None]
+        last_seen = [person.last_seen for person in sources + [target] if person.last_seen is not None]
+        with self.database.atomic():
+            for ids in chunks([person.id for person in sources]):
+                Encoding.update(person=target).where(Encoding.person.in_(ids)).execute()
+                Image.update(person=target).where(Image.person.in_(ids)).execute()
+                Presence.update(person=target).where(Presence.person.in_(ids)).execute()
+                Person.delete().where(Person.id.in_(ids)).execute()
+            target.first_seen = min(first_seen, default=None)
+            target.last_seen = max(last_seen, default=None)
+            if target.thumbnail_id is None:
+                target.thumbnail = next((person.thumbnail_id for person in sources if person.thumbnail_id), None)
+            target.save()
+        self.invalidate()
+        logging.info("Merged {} persons into {}".format(len(sources), target.name))
+        return len(sources)
+
+    def reassign_images(self, image_names: List[str], to_person: Person) -> int:
+        """Move images to another person with set based updates in a single transaction
+
+        Arguments:
+            image_names {List[str]} -- The names of the images
+            to_person {Person} -- The new owner of the images
+
+        Returns:
+            int -- The number of images moved
+        """
+        moved = 0
+        with self.database.atomic():
+            for names in chunks(image_names):
+                moved += Image.update(person=to_person).where(Image.name.in_(names)).execute()
+        self.invalidate()
+        return moved
+
+    def get_persons_by_names(self, names: List[str]) -> List[Person]:
+        """Get the persons with the given names, the missing names are skipped"""
+        persons = []
+        for part in chunks(names):
+            persons.extend(Person.select().where(Person.name.in_(part)))
+        return persons
+
+    def get_person_by_name(self, name: str) -> Person:
+        return Person.get(Person.name == name)
+
+    def get_user_by_name(self, name: str) -> User:
+        return User.get(User.name == name)
+
+    def get_image_by_name(self, name: str) -> Image:
+        return Image.get(Image.name == name)
+
+    def get_recent_image_hashes(self, person: Person, limit: int = 16) -> List[int]:
+        """Get the perceptual hashes of the latest images of a person
+
+        Arguments:
+            person {Person} -- The person whose images to check
+
+        Keyword Arguments:
+            limit {int} -- The maximum number of hashes to return (default: {16})
+
+        Returns:
+            List[int] -- The hashes, newest first
+        """
+        query = (Image
+                 .select(Image.phash)
+                 .where((Image.person == person) & (Image.phash.is_null(False)))
+                 .order_by(Image.id.desc())
+                 .limit(limit))
+        return [image.phash for image in query]
+
+    def get_all_events(self) -> List:
+        """Every event, unbounded, use get_events for anything shown on a page"""
+        return UserEvent.select()
+
+    def get_events(self, before_id: int = None, limit: int = 50, kind: str = None, person_name: str = None,
+                   since: datetime = None, until: datetime = None) -> List[UserEvent]:
+        """Get a page of the event log, newest first
+        Pages are addressed by the id of the last event of the previous page (keyset pagination),
+        so every page costs the same, however long the log is
+
+        Keyword Arguments:
+            before_id {int} -- Only events older than this event, None for the first page (default: {None})
+            limit {int} -- The page size (default: {50})
+            kind {str} -- Only events of this kind, e.g. "arrived" (default: {None})
+            person_name {str} -- Only events of this person (default: {None})
+            since {datetime} -- Only events at or after this time (default: {None})
+            until {datetime} -- Only events before this time (default: {None})
+
+        Returns:
+            List[UserEvent] -- The events
+        """
+        query = UserEvent.select()
+        if before_id is not None:
+            query = query.where(UserEvent.id < before_id)
+        if kind is not None:
+            query = query.where(UserEvent.kind == kind)
+        if person_name is not None:
+            query = query.where(UserEvent.person_name == person_name)
+        if since is not None:
+            query = query.where(UserEvent.datetime >= since)
+        if until is not None:
+            query = query.where(UserEvent.datetime < until)
+        return list(query.order_by(UserEvent.id.desc()).limit(limit))
+
+    def log_event(self, text: str, kind: str = None, person_name: str = None):
+        """Queue an event for the event log, it is committed with the next batch of the background writer
+
+        Arguments:
+            text {str} -- The text of the event
+
+        Keyword Arguments:
+            kind {str} -- The type of the event, e.g. "arrived" (default: {None})
+            person_name {str} -- The person the event is about (default: {None})
+        """
+        self.writer.submit(UserEvent, {"datetime": datetime.now(), "event": text, "kind": kind,
+                                       "person_name": person_name})
+
+    def presence_started(self, person: Person, camera: str = None, start: datetime = None):
+        """Open a presence interval for a person who just arrived, written by the background writer
+
+        Arguments:
+            person {Person} -- The person
+
+        Keyword Arguments:
+            camera {str} -- The name of the camera (default: {None})
+            start {datetime} -- The time of the arrival, now if None (default: {None})
+        """
+        self.writer.submit(Presence, {"person": person.id, "camera": camera, "start": start or datetime.now(),
+                                      "frame_count": 0})
+
+    def presence_ended(self, person: Person, end: datetime = None, frame_count: int = 0):
+        """Close the open presence interval of a person who just left, written by the background writer
+        The last_seen time of the person is updated as well
+
+        Arguments:
+            person {Person} -- The person
+
+        Keyword Arguments:
+            end {datetime} -- The time the person was last seen, now if None (default: {None})
+            frame_count {int} -- The number of frames the person was seen on (default: {0})
+        """
+        end = end or datetime.now()
+        # in the text format the datetimes are stored in
+        seconds = (fn.julianday(end.strftime("%Y-%m-%d %H:%M:%S.%f")) - fn.julianday(Presence.start)) * 86400
+        self.writer.submit_query(Presence
+                                 .update(end=end, seconds=seconds, frame_count=frame_count)
+                                 .where((Presence.person == person.id) & Presence.end.is_null()))
+        self.writer.submit_query(Person.update(last_seen=end).where(Person.id == person.id))
+
+    def close_open_presence(self) -> int:
+        """Close the intervals left open by a process that didn't shut down cleanly, with an unknown length
+        Must only be called by the process running the camera, before it starts
+
+        Returns:
+            int -- The number of intervals closed
+        """
+        closed = (Presence
+                  .update(end=Presence.start, seconds=0)
+                  .where(Presence.end.is_null())
+                  .execute())
+        if closed:
+            logging.warning("Closed {} presence intervals left open by the last run".format(closed))
+        return closed
+
+    def get_presence(self, since: datetime, until: datetime, person_name: str = None) -> List[Presence]:
+        """Get the presence intervals that overlap a time range
+
+        A closed interval of a person that overlaps the range can't start earlier than the length of the longest
+        interval of the same person before the range. Both the longest interval and the range are looked up in the
+        indexes of the person, so the scanned rows are bounded by the range, not by the amount of history, and one
+        long interval only widens the scan of its own person
+
+        Arguments:
+            since {datetime} -- The start of the range
+            until {datetime} -- The end of the range (exclusive)
+
+        Keyword Arguments:
+            person_name {str} -- Only the intervals of this person (default: {None})
+
+        Returns:
+            List[Presence] -- The intervals with their persons, ordered by their start
+        """
+        longest_presence = Presence.alias()
+        longest = (longest_presence
+                   .select(fn.MAX(longest_presence.seconds))
+                   .where(longest_presence.person == Person.id))
+        # in the text format the datetimes are stored in, a second earlier to be safe from the rounding
+        earliest_start = fn.strftime("%Y-%m-%d %H:%M:%S",
+                                     fn.julianday(since.strftime("%Y-%m-%d %H:%M:%S.%f"))
+                                     - (fn.COALESCE(longest, 0) + 1) / 86400.0)
+        # a cross join keeps the persons as the outer loop, so the intervals are searched per person
+        closed = (Presence
+                  .select(Presence)
+                  .from_(Person)
+                  .join(Presence, JOIN.CROSS)
+                  .where((Presence.person == Person.id) & (Presence.start >= earliest_start)
+                         & (Presence.start < until) & (Presence.end > since)))
+        still_open = (Presence
+                      .select(Presence)
+                      .join(Person)
+                      .where(Presence.end.is_null() & (Presence.start < until)))
+        intervals = []
+        for query in (closed, still_open):
+            if person_name is not None:
+                query = query.where(Person.name == person_name)
+            intervals.extend(query)
+        persons = {person.id: person for person in
+                   Person.select().where(Person.id.in_({interval.person_id for interval in intervals}))}
+        for interval in intervals:
+            interval.person = persons[interval.person_id]
+        return sorted(intervals, key=lambda interval: interval.start)
+
+    def get_occupancy(self, since: datetime, until: datetime, person_name: str = None) -> Dict[str, float]:
+        """Get the number of seconds every person was present in a time range
+
+        Arguments:
+            since {datetime} -- The start of the range
+            until {datetime} -- The end of the range (exclusive)
+
+        Keyword Arguments:
+            person_name {str} -- Only this person (default: {None})
+
+        Returns:
+            Dict[str, float] -- Person name -> seconds, only the persons who were present
+        """
+        return self.occupancy(self.get_presence(since, until, person_name), since, until)
+
+    @staticmethod
+    def occupancy(intervals: List[Presence], since: datetime, until: datetime) -> Dict[str, float]:
+        """Sum the seconds every person was present in a time range from the intervals that overlap it
+
+        Arguments:
+            intervals {List[Presence]} -- The intervals, as returned by get_presence
+            since {datetime} -- The start of the range
+            until {datetime} -- The end of the range (exclusive)
+
+        Returns:
+            Dict[str, float] -- Person name -> seconds, only the persons who were present
+        """
+        occupancy: Dict[str, float] = dict()
+        now = datetime.now()
+        for interval in intervals:
+            start = max(interval.start, since)
+            end = min(interval.end or now, until)
+            if end > start:
+                name = interval.person.name
+                occupancy[name] = occupancy.get(name, 0.0) + (end - start).total_seconds()
+        return occupancy
+
+    def rollup_events(self, retention_days: int) -> int:
+        """Replace the events older than the retention period with daily per person summaries
+
+        Arguments:
+            retention_days {int} -- The number of days the events are kept for
+
+        Returns:
+            int -- The number of events rolled up
+        """
+        cutoff = datetime.now() - timedelta(days=retention_days)
+        old_events = UserEvent.datetime < cutoff
+        day = fn.date(UserEvent.datetime)
+        # IMMEDIATE takes the write lock right away, so another process can't roll up the same events meanwhile
+        with self.database.atomic('IMMEDIATE'):
+            summaries = (UserEvent
+                         .select(day, UserEvent.person_name, UserEvent.kind, fn.COUNT(UserEvent.id),
+                                 fn.MIN(UserEvent.datetime), fn.MAX(UserEvent.datetime))
+                         .where(old_events)
+                         .group_by(day, UserEvent.person_name, UserEvent.kind)
+                         .tuples())
+            rows = [{"day": row[0], "person_name": row[1] or "", "kind": row[2] or "", "count": row[3], "first": row[4],
+                     "last": row[5]} for row in summaries]
+            for row in rows:
+                (EventRollup
+                 .insert(row)
+                 .on_conflict(conflict_target=[EventRollup.day, EventRollup.person_name, EventRollup.kind],
+                              update={EventRollup.count: EventRollup.count + EXCLUDED.count,
+                                      EventRollup.first: fn.MIN(EventRollup.first, EXCLUDED.first),
+                                      EventRollup.last: fn.MAX(EventRollup.last, EXCLUDED.last)})
+                 .execute())
+            removed = UserEvent.delete().where(old_events).execute()
+        if removed:
+            logging.info("Rolled up {} events older than {} days into {} summaries".format(
+                removed, retention_days, len(rows)))
+        return removed
+
+    def get_event_rollups(self, since=None, person_name: str = None) -> List[EventRollup]:
+        """Get the daily summaries of the rolled up events, newest first
+
+        Keyword Arguments:
+            since {date} -- Only the summaries of this day and later (default: {None})
+            person_name {str} -- Only the summaries of this person (default: {None})
+
+        Returns:
+            List[EventRollup] -- The summaries
+        """
+        query = EventRollup.select()
+        if since is not None:
+            query = query.where(EventRollup.day >= since)
+        if person_name is not None:
+            query = query.where(EventRollup.person_name == person_name)
+        return list(query.order_by(EventRollup.day.desc(), EventRollup.person_name))
+
+    def start_event_retention(self, retention_days: int, interval_hours: float = 1.0):
+        """Roll up the old events now and then periodically on a background thread
+
+        Arguments:
+            retention_days {int} -- The number of days the events are kept for
+
+        Keyword Arguments:
+            interval_hours {float} -- The time between two rollups (default: {1.0})
+        """
+        def run():
+            while True:
+                try:
+                    self.rollup_events(retention_days)
+                except Exception as e:
+                    logging.error("Event rollup failed: {}".format(e))
+                time.sleep(interval_hours * 3600)
+
+        threading.Thread(target=run, name="event-retention", daemon=True).start()
+
+    def invalidate(self):
+        """Bump the generation, so the cached person queries are loaded again on their next use
+        Has to be called after every change of the persons, images or encodings, the other processes are
+        notified through the version in the database
+        """
+        self.database.execute_sql("UPDATE galleryversion SET version = version + 1 WHERE id = 1")
+        self._gallery_version = self._read_gallery_version()
+        self._clear_cache()
+
+    def _clear_cache(self):
+        with self._cache_lock:
+            self.generation += 1
+            self._cache.clear()
+
+    def _read_data_version(self) -> int:
+        with self._version_lock:
+            return self._version_connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _read_gallery_version(self) -> int:
+        with self._version_lock:
+            row = self._version_connection.execute("SELECT version FROM galleryversion WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    def current_generation(self) -> int:
+        """Get the generation of the data, bumping it first if another process has changed the persons
+
+        Returns:
+            int -- The generation counter
+        """
+        data_version = self._read_data_version()
+        if data_version != self._data_version:
+            # some connection has committed, only a change of the gallery version means new persons
+            self._data_version = data_version
+            gallery_version = self._read_gallery_version()
+            if gallery_version != self._gallery_version:
+                self._gallery_version = gallery_version
+                self._clear_cache()
+        return self.generation
+
+    def _cached(self, key: str, loader: Callable):
+        """Get the result of a query from the cache, loading it if it's missing or belongs to an older generation
+
+        Arguments:
+            key {str} -- The cache key of the query
+            loader {Callable} -- Loads the materialized result
+
+        Returns:
+            The result of the loader
+        """
+        generation = self.current_generation()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == generation:
+            return cached[1]
+        logging.debug("Loading {} for generation {}".format(key, generation))
+        result = loader()
+        with self._cache_lock:
+            # a change during the load already bumped the generation, the result is only valid for the old one
+            if self.generation == generation:
+                self._cache[key] = (generation, result)
+        return result
+
+    def refresh(self):
+        self._persons_select = Person.select()
+        # peewee doesn't work with an equality check in the format of Person.unknown is False
+        # instead we should use Person.unknown == False
+        self._known_persons_select = Person.select().where(Person.unknown == False)  # NOQA
+        self._unknown_persons_select = Person.select().where(Person.unknown == True)  # NOQA
+        self._images_select = Image.select()
+        self._encodings_select = Encoding.select()
+        self.invalidate()
+
+    def _prefetch(self, persons_select: Select) -> List[Person]:
+        # peewee keeps the rows on an executed query, the clones are executed again
+        return prefetch(persons_select.clone(), self._images_select.clone(), self._encodings_select.clone())
+
+    def get_persons(self) -> List[Person]:
+        """
+        Returns all persons, known and unknown both, with their images and encodings
+        The returned list is shared between the callers until the next change, it must not be modified
+        """
+        logging.debug("Getting all persons")
+        return self._cached("persons", lambda: list(self._prefetch(self._persons_select)))
+
+    def get_known_persons(self) -> List[Person]:
+        logging.debug("Getting known persons")
+        return self._cached("known_persons", lambda: list(self._prefetch(self._known_persons_select)))
+
+    def get_unknown_persons(self) -> List[Person]:
+        logging.debug("Getting unknown persons")
+        return self._cached("unknown_persons", lambda: list(self._prefetch(self._unknown_persons_select)))
+
+    def count_persons(self) -> Dict[bool, int]:
+        """Count the persons with a single COUNT query, without loading them
+
+        Returns:
+            Dict[bool, int] -- The number of the unknown (True) and of the known (False) persons
+        """
+        def load() -> Dict[bool, int]:
+            counts = {True: 0, False: 0}
+            for unknown, count in Person.select(Person.unknown, fn.COUNT(Person.id)).group_by(Person.unknown).tuples():
+                counts[bool(unknown)] = count
+            return counts
+        return self._cached("person_counts", load)
+
+    @staticmethod
+    def _filter_unknown(query: Select, unknown: bool = None) -> Select:
+        if unknown is None:
+            return query
+        return query.where(Person.unknown == unknown)
+
+    def get_person_names(self, unknown: bool = None) -> List[str]:
+        """Get the names of the persons, without loading their images and encodings
+
+        Keyword Arguments:
+            unknown {bool} -- Only the unknown (True) or only the known (False) persons, all if None (default: {None})
+
+        Returns:
+            List[str] -- The names
+        """
+        query = self._filter_unknown(Person.select(Person.name), unknown).order_by(Person.id)
+        return self._cached("person_names_{}".format(unknown), lambda: [name for (name,) in query.tuples()])
+
+    # sort key -> the ORDER BY clause of get_person_page, the id makes the order stable
+    person_sort_orders = {
+        "last_seen": lambda: [Person.last_seen.desc(nulls='LAST'), Person.id.desc()],
+        "name": lambda: [Person.name, Person.id],
+        "images": lambda: [SQL("image_count").desc(), Person.id.desc()],
+    }
+
+    def search_person_names(self, search: str = None, limit: int = 20, exclude: str = None) -> List[str]:
+        """Get the names of the persons matching a search, the most recently seen first, e.g. for picking a person
+
+        Keyword Arguments:
+            search {str} -- Only the persons with this text in their name, all if None (default: {None})
+            limit {int} -- The maximum number of names (default: {20})
+            exclude {str} -- A name to leave out (default: {None})
+
+        Returns:
+            List[str] -- The names
+        """
+        query = Person.select(Person.name)
+        if search:
+            query = query.where(Person.name.contains(search))
+        if exclude is not None:
+            query = query.where(Person.name != exclude)
+        query = query.order_by(*self.person_sort_orders["last_seen"]()).limit(limit)
+        return [name for (name,) in query.tuples()]
+
+    def get_person_page(self, unknown: bool, page: int = 1, page_size: int = 24, search: str = None,
+                        sort: str = "last_seen") -> Tuple[List[Person], int]:
+        """Get a page of persons with their thumbnails and the number of their images, nothing else is loaded
+
+        Arguments:
+            unknown {bool} -- List the unknown persons instead of the known ones
+
+        Keyword Arguments:
+            page {int} -- The page number, starting at 1 (default: {1})
+            page_size {int} -- The number of persons on a page (default: {24})
+            search {str} -- Only the persons with this text in their name (default: {None})
+            sort {str} -- One of the keys of person_sort_orders (default: {"last_seen"})
+
+        Returns:
+            Tuple[List[Person], int] -- The persons on the page, each with an image_count attribute,
+                and the number of persons matching the search
+        """
+        condition = Person.unknown == unknown
+        if search:
+            condition &= Person.name.contains(search)
+        total = Person.select().where(condition).count()
+        thumbnail = Image.alias()
+        # counted with the index on image.person, only for the persons that are listed
+        image_count = Image.select(fn.COUNT(Image.id)).where(Image.person == Person.id)
+        order = self.person_sort_orders.get(sort, self.person_sort_orders["last_seen"])()
+        query = (Person
+                 .select(Person, thumbnail, image_count.alias("image_count"))
+                 .join(thumbnail, JOIN.LEFT_OUTER, on=(Person.thumbnail == thumbnail.id))
+                 .where(condition)
+                 .order_by(*order)
+                 .paginate(max(1, page), page_size))
+        return list(query), total
+
+    def get_recent_images(self, person: Person, limit: int = 12) -> List[Image]:
+        """Get the latest images of a person, only their names and thumbnails are loaded
+
+        Arguments:
+            person {Person} -- The person
+
+        Keyword Arguments:
+            limit {int} -- The maximum number of images (default: {12})
+
+        Returns:
+            List[Image] -- The images, newest first
+        """
+        return list(Image.select(Image.id, Image.name, Image.thumb)
+                    .where(Image.person == person).order_by(Image.id.desc()).limit(limit))
+
+    def get_persons_with_thumbnails(self, unknown: bool = None) -> List[Person]:
+        """Get the persons with their thumbnails in a single query, without the rest of their images and encodings
+
+        Keyword Arguments:
+            unknown {bool} -- Only the unknown (True) or only the known (False) persons, all if None (default: {None})
+
+        Returns:
+            List[Person] -- The persons, the thumbnail is None if not set
+        """
+        query = self._filter_unknown(
+            Person.select(Person, Image).join(Image, JOIN.LEFT_OUTER, on=(Person.thumbnail == Image.id)), unknown)
+        return self._cached("persons_with_thumbnails_{}".format(unknown), lambda: list(query.order_by(Person.id)))
@@ -0,0 +1,173 @@
+import logging
+import queue
+import threading
+import time
+from itertools import groupby
+from typing import Dict, List, Tuple
+
+from peewee import Model, Database, Query
+
+# queued instead of a row to commit the pending rows right away
+_FLUSH = object()
+
+
+class DatabaseWriter:
+    """Inserts rows on a background thread, grouping them into batched transactions
+
+    Callers (e.g. the arrival and departure callbacks running on the camera thread) only put the row on a
+    bounded queue. The writer thread collects rows until batch_size rows are pending or flush_interval_ms
+    has passed since the first one, then inserts them with insert_many inside a single transaction,
+    so the whole batch costs one commit. If the queue is full the row is dropped instead of blocking the caller.
+    Queries (e.g. updates) can be queued too, everything is executed in the order it was submitted.
+    """
+
+    def __init__(self, database: Database, flush_interval_ms: int = 500, batch_size: int = 100,
+                 max_queue: int = 1000):
+        self.database = database
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.high_water_mark = 0
+        self.last_commit_ms = 0.0
+        self.max_commit_ms = 0.0
+        self.total_commit_ms = 0.0
+        self._worker = threading.Thread(target=self._work, name="database-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, model: Model, row: Dict) -> bool:
+        """Queue a row for insertion without blocking
+
+        Arguments:
+            model {Model} -- The model (table) of the row
+            row {Dict} -- Field name -> value
+
+        Returns:
+            bool -- False if the queue was full and the row was dropped
+        """
+        return self._put((model, row))
+
+    def submit_query(self, query: Query) -> bool:
+        """Queue a query for execution in the next batch without blocking
+
+        Arguments:
+            query {Query} -- The query, e.g. an update, it's executed after the rows and queries submitted before
+
+        Returns:
+            bool -- False if the queue was full and the query was dropped
+        """
+        return self._put((None, query))
+
+    def _put(self, item: Tuple) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 100 == 0:
+                logging.warning("Database writer queue is full, {} rows dropped so far".format(dropped))
+            return False
+        depth = self._queue.qsize()
+        if depth > self.high_water_mark:
+            self.high_water_mark = depth
+        return True
+
+    def _collect(self) -> Tuple[List[Tuple[Model, Dict]], int, bool]:
+        """Wait for the next batch of rows
+
+        Returns:
+            Tuple[List[Tuple[Model, Dict]], int, bool] -- The rows, the number of items taken from the queue
+                (rows and markers) and whether the writer has to stop afterwards
+        """
+        rows = []
+        item = self._queue.get()
+        taken = 1
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return rows, taken, True
+            if item is _FLUSH:
+                return rows, taken, False
+            rows.append(item)
+            remaining = deadline - time.monotonic()
+            if len(rows) >= self.batch_size or remaining <= 0:
+                return rows, taken, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return rows, taken, False
+            taken += 1
+
+    def _work(self):
+        while True:
+            rows, taken, stopping = self._collect()
+            try:
+                if rows:
+                    self._commit(rows)
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+            if stopping:
+                return
+
+    def _commit(self, rows: List[Tuple[Model, Dict]]):
+        start = time.perf_counter()
+        try:
+            with self.database.atomic():
+                # consecutive rows of the same model are inserted together, queries one by one
+                for model, items in groupby(rows, key=lambda item: item[0]):
+                    if model is None:
+                        for _, query in items:
+                            query.execute()
+                    else:
+                        model.insert_many([row for _, row in items]).execute()
+        except Exception as e:
+            logging.error("Could not write {} rows to the database: {}".format(len(rows), e))
+            with self._stats_lock:
+                self.failed += len(rows)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self.written += len(rows)
+            self.batches += 1
+            self.last_commit_ms = elapsed_ms
+            self.max_commit_ms = max(self.max_commit_ms, elapsed_ms)
+            self.total_commit_ms += elapsed_ms
+
+    def metrics(self) -> Dict:
+        """Queue and commit statistics of the writer
+
+        Returns:
+            Dict -- Queue depth, high water mark, written/dropped/failed row counts, batch sizes and commit latencies
+        """
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "high_water_mark": self.high_water_mark,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+                "avg_batch_size": self.written / self.batches if self.batches else 0.0,
+                "last_commit_ms": self.last_commit_ms,
+                "max_commit_ms": self.max_commit_ms,
+                "avg_commit_ms": self.total_commit_ms / self.batches if self.batches else 0.0
+            }
+
+    def flush(self):
+        """Commit the pending rows now and block until every queued row is written"""
+        if self._worker.is_alive():
+            self._queue.put(_FLUSH)
+            self._queue.join()
+
+    def stop(self):
+        """Write the queued rows, then stop the writer thread"""
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
@@ -0,0 +1,173 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import cv2
+
+from Library.thumbnails import write_thumbnail
+
+
+class ImageWriter:
+    """Persists face crops on a small pool of background threads
+
+    The camera thread only copies the crop and puts it on a bounded queue, the encoding, the
+    thumbnail and the file system writes happen on the writer threads. If the queue is full (e.g. the SD card stalls)
+    the crop is dropped instead of blocking the recognition loop. The optional callback of an image is called on the
+    writer thread once the write is done, so the database only references the images that are on the disk.
+    """
+    # format name -> (file extension, OpenCV quality flag)
+    formats = {
+        "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+        "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+        "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY)
+    }
+    # PNG is lossless, the quality setting is ignored and a fast compression level is used instead
+    png_compression = 1
+
+    def __init__(self, folder_path="Static/Images/", workers: int = 1, max_queue: int = 32):
+        self.folder_path = Path(folder_path)
+        os.makedirs(str(self.folder_path), exist_ok=True)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._counter = itertools.count(1)
+        self._stats_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.high_water_mark = 0
+        self.last_write_ms = 0.0
+        self.total_write_ms = 0.0
+        self._workers: List[threading.Thread] = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name="image-writer-{}".format(i), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def image_name(self, person_name: str, image_format: str = "jpg") -> str:
+        """Generate a unique file name for a new image of a person
+        The name is built from a timestamp and a process wide counter, so no database lookup is needed
+
+        Arguments:
+            person_name {str} -- The name of the person the image belongs to
+
+        Keyword Arguments:
+            image_format {str} -- One of the keys of ImageWriter.formats (default: {"jpg"})
+
+        Returns:
+            str -- The file name of the image
+        """
+        extension = self.formats.get(image_format, self.formats["jpg"])[0]
+        return "{}_{}_{}{}".format(person_name, int(time.time() * 1000), next(self._counter), extension)
+
+    def submit(self, image_name: str, image, quality: int = 90, thumbnail_name: str = None,
+               on_written: Callable[[bool], None] = None) -> bool:
+        """Queue an image for writing without blocking
+
+        Arguments:
+            image_name {str} -- The file name, the extension selects the encoding
+            image -- The image (numpy array), a copy is taken so the caller can keep drawing on the frame
+
+        Keyword Arguments:
+            quality {int} -- Encoding quality for the lossy formats (default: {90})
+            thumbnail_name {str} -- Also write a thumbnail with this name, see Library.thumbnails (default: {None})
+            on_written {Callable[[bool], None]} -- Called on the writer thread with whether the image was written,
+                not called if the image is dropped (default: {None})
+
+        Returns:
+            bool -- False if the queue was full and the image was dropped
+        """
+        try:
+            self._queue.put_nowait((image_name, image.copy(), int(quality), thumbnail_name, on_written))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 100 == 0:
+                logging.warning("Image writer queue is full, {} images dropped so far".format(dropped))
+            return False
+        depth = self._queue.qsize()
+        if depth > self.high_water_mark:
+            self.high_water_mark = depth
+        return True
+
+    def encode_params(self, image_name: str, quality: int) -> List[int]:
+        extension = os.path.splitext(image_name)[1].lower()
+        for ext, flag in self.formats.values():
+            if ext == extension:
+                if flag == cv2.IMWRITE_PNG_COMPRESSION:
+                    return [flag, self.png_compression]
+                return [flag, max(0, min(100, quality))]
+        return []
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                *image_job, on_written = job
+                written = self._write(*image_job)
+                if on_written is not None:
+                    on_written(written)
+            except Exception:
+                logging.exception("Could not write the image {} or run its callback".format(job[0]))
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image_name: str, image, quality: int, thumbnail_name: str = None) -> bool:
+        start = time.perf_counter()
+        path = self.folder_path.joinpath(image_name)
+        try:
+            ok = cv2.imwrite(str(path), image, self.encode_params(image_name, quality))
+            if ok and thumbnail_name is not None and not write_thumbnail(thumbnail_name, image):
+                logging.error("Could not write the thumbnail {}".format(thumbnail_name))
+        except cv2.error as e:
+            logging.error("Could not encode the image {}: {}".format(image_name, e))
+            ok = False
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            if ok:
+                self.written += 1
+                self.last_write_ms = elapsed_ms
+                self.total_write_ms += elapsed_ms
+            else:
+                self.failed += 1
+        if ok:
+            logging.info("Picture taken: {}".format(image_name))
+        else:
+            logging.error("Could not write the picture {}".format(path))
+        return ok
+
+    def metrics(self) -> Dict:
+        """Backpressure and throughput statistics of the writer
+
+        Returns:
+            Dict -- Queue depth, high water mark, written/dropped/failed counts and write latencies
+        """
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "high_water_mark": self.high_water_mark,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "last_write_ms": self.last_write_ms,
+                "avg_write_ms": self.total_write_ms / self.written if self.written else 0.0
+            }
+
+    def flush(self):
+        """Block until every queued image is written"""
+        self._queue.join()
+
+    def stop(self):
+        """Write the queued images, then stop the worker threads"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
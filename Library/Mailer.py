@@ -1,32 +1,310 @@
-import smtplib
-from email.mime.text import MIMEText
-from socket import gaierror
-import logging
-
-class Mailer:
-
-    def __init__(self, from_email, from_password):
-        self.from_email = from_email
-        self.from_password = from_password
-        try:
-            self.smtpserver = smtplib.SMTP('smtp.gmail.com', 587)  # Server to use.
-        except gaierror as error:
-            logging.info("Can't set up mailer since there is probably no internet: {}".format(error))
-            return
-        self.send_mail_cooldown_seconds = None
-        self.last_mail_sent_date = None
-
-    def send_email(self, to_email, subject, msg):
-        self.smtpserver.ehlo()  # Says 'hello' to the server
-        self.smtpserver.starttls()  # Start TLS encryption
-        self.smtpserver.ehlo()
-        self.smtpserver.login(self.from_email, self.from_password)  # Log in to server
-
-        msg = MIMEText(str(msg))
-        msg['Subject'] = subject
-        msg['From'] = self.from_email
-        msg['To'] = to_email
-        # Sends the message
-        self.smtpserver.sendmail(self.from_email, [to_email], msg.as_string())
-        # Closes the smtp server.
-        self.smtpserver.quit()
+import smtplib
+from email.mime.text import MIMEText
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+from Library.Handler import Handler
+
+# queued to stop the dispatcher thread
+_STOP = object()
+
+
+class Mailer:
+    """Sends emails over a single SMTP connection, which is opened on first use and reused until it's closed
+    The EHLO, STARTTLS and login handshake is only done once per connection, not for every email
+    """
+
+    def __init__(self, from_email, from_password, host: str = 'smtp.gmail.com', port: int = 587,
+                 use_tls: bool = True, timeout: float = 30.0, login_name: str = None):
+        self.from_email = from_email
+        self.from_password = from_password
+        # the account name, if it's not the sender address
+        self.login_name = login_name
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.smtpserver: smtplib.SMTP = None
+
+    def connect(self) -> smtplib.SMTP:
+        """Open and authenticate the connection if it isn't open yet
+
+        Returns:
+            smtplib.SMTP -- The connection
+        """
+        if self.smtpserver is None:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                server.ehlo()  # Says 'hello' to the server
+                if self.use_tls:
+                    server.starttls()  # Start TLS encryption
+                    server.ehlo()
+                if self.from_password:
+                    server.login(self.login_name or self.from_email, self.from_password)  # Log in to server
+            except BaseException:
+                server.close()
+                raise
+            self.smtpserver = server
+        return self.smtpserver
+
+    def send_email(self, to_email, subject, msg):
+        """Send an email, reconnecting once if the server has closed the connection in the meantime
+
+        Arguments:
+            to_email {str} -- The recipient
+            subject {str} -- The subject
+            msg {str} -- The plain text body
+        """
+        msg = MIMEText(str(msg))
+        msg['Subject'] = subject
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        try:
+            self.connect().sendmail(self.from_email, [to_email], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self.connect().sendmail(self.from_email, [to_email], msg.as_string())
+
+    def close(self):
+        """Close the connection, the next email opens a new one"""
+        server, self.smtpserver = self.smtpserver, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+
+class MailDispatcher:
+    """Sends the notification emails on a background thread, folding bursts of notifications into digests
+
+    The first notification for a recipient starts a digest_seconds long window, the notifications arriving during it
+    are sent together in one email. A recipient gets at most one email every cooldown_seconds, the notifications
+    arriving during the cooldown are sent in the next digest. The connection is closed after idle_seconds without
+    emails. Callers only put the notification on a bounded queue, if it's full the notification is dropped.
+    A digest that could not be sent stays pending and is retried after retry_seconds, doubled after every failure,
+    it's dropped after max_attempts failures. Only a sent email starts the cooldown.
+    The cooldown_seconds is the default, a notification may carry the cooldown of its recipient.
+    """
+
+    def __init__(self, mailer: Mailer, cooldown_seconds: float = 120.0, digest_seconds: float = 30.0,
+                 idle_seconds: float = 60.0, max_queue: int = 256, retry_seconds: float = 30.0,
+                 max_attempts: int = 5):
+        self.mailer = mailer
+        self.cooldown_seconds = cooldown_seconds
+        self.digest_seconds = digest_seconds
+        self.idle_seconds = idle_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue(maxsize=max_queue)
+        # recipient -> (monotonic time of the first pending notification, subjects and lines of the notifications)
+        self._pending: Dict[str, Tuple[float, List[Tuple[str, str]]]] = dict()
+        # recipient -> monotonic time of the last email
+        self._last_sent: Dict[str, float] = dict()
+        # recipient -> the cooldown given with its last notification
+        self._cooldowns: Dict[str, float] = dict()
+        # recipient -> the failed attempts to send the pending digest and the monotonic time of the next one
+        self._failures: Dict[str, Tuple[int, float]] = dict()
+        self._last_activity = 0.0
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.notifications = 0
+        self.dropped = 0
+        self.failed = 0
+        self._worker = threading.Thread(target=self._work, name="mail-dispatcher", daemon=True)
+        self._worker.start()
+
+    def notify(self, recipient: str, subject: str, line: str, cooldown_seconds: float = None) -> bool:
+        """Queue a notification without blocking
+
+        Arguments:
+            recipient {str} -- The email address to notify
+            subject {str} -- The subject, used if the notification is sent alone
+            line {str} -- The text of the notification, a line of the digest
+
+        Keyword Arguments:
+            cooldown_seconds {float} -- The shortest time between two emails to the recipient,
+                the cooldown_seconds of the dispatcher if None (default: {None})
+
+        Returns:
+            bool -- False if the queue was full and the notification was dropped
+        """
+        try:
+            self._queue.put_nowait((recipient, subject, line, cooldown_seconds))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            logging.warning("Mail queue is full, notification dropped")
+            return False
+        return True
+
+    def due_time(self, recipient: str) -> float:
+        """The monotonic time the pending notifications of a recipient are to be sent at"""
+        first, _ = self._pending[recipient]
+        cooldown = self._cooldowns.get(recipient, self.cooldown_seconds)
+        return max(first + self.digest_seconds,
+                   self._last_sent.get(recipient, float("-inf")) + cooldown,
+                   self._failures.get(recipient, (0, float("-inf")))[1])
+
+    def _work(self):
+        while True:
+            now = time.monotonic()
+            if self._pending:
+                timeout = max(0.0, min(self.due_time(recipient) for recipient in self._pending) - now)
+            elif self.mailer.smtpserver is not None:
+                timeout = max(0.0, self._last_activity + self.idle_seconds - now)
+            else:
+                timeout = None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._send_due(flush=True)
+                self.mailer.close()
+                return
+            if item is not None:
+                recipient, subject, line, cooldown_seconds = item
+                with self._stats_lock:
+                    self.notifications += 1
+                if cooldown_seconds is None:
+                    self._cooldowns.pop(recipient, None)
+                else:
+                    self._cooldowns[recipient] = cooldown_seconds
+                self._pending.setdefault(recipient, (time.monotonic(), []))[1].append((subject, line))
+            self._send_due()
+            if not self._pending and self.mailer.smtpserver is not None \
+                    and time.monotonic() - self._last_activity >= self.idle_seconds:
+                self.mailer.close()
+
+    def _send_due(self, flush: bool = False):
+        now = time.monotonic()
+        for recipient in [recipient for recipient in self._pending if flush or self.due_time(recipient) <= now]:
+            first, notifications = self._pending[recipient]
+            subject, body = self.digest(notifications)
+            try:
+                self.mailer.send_email(recipient, subject, body)
+            except (smtplib.SMTPException, OSError) as e:
+                self.mailer.close()
+                self._failed(recipient, e)
+                continue
+            finally:
+                self._last_activity = time.monotonic()
+            del self._pending[recipient]
+            self._failures.pop(recipient, None)
+            self._last_sent[recipient] = self._last_activity
+            with self._stats_lock:
+                self.sent += 1
+
+    def _failed(self, recipient: str, error: Exception):
+        """Schedule the retry of the pending digest of a recipient, or drop it after max_attempts failures"""
+        attempts = self._failures.get(recipient, (0, 0.0))[0] + 1
+        with self._stats_lock:
+            self.failed += 1
+            if attempts >= self.max_attempts:
+                self.dropped += len(self._pending[recipient][1])
+        if attempts >= self.max_attempts:
+            logging.error("Could not send the notification email to {}, giving up after {} attempts: {}".format(
+                recipient, attempts, error))
+            del self._pending[recipient]
+            self._failures.pop(recipient, None)
+            return
+        delay = self.retry_seconds * 2 ** (attempts - 1)
+        logging.error("Could not send the notification email to {}, retrying in {} seconds: {}".format(
+            recipient, delay, error))
+        self._failures[recipient] = (attempts, time.monotonic() + delay)
+
+    @staticmethod
+    def digest(notifications: List[Tuple[str, str]]) -> Tuple[str, str]:
+        """Create the email of the pending notifications of a recipient
+
+        Arguments:
+            notifications {List[Tuple[str, str]]} -- The subject and the line of every notification
+
+        Returns:
+            Tuple[str, str] -- The subject and the body of the email
+        """
+        if len(notifications) == 1:
+            return notifications[0]
+        return ("[recognEYEz] {} notifications".format(len(notifications)),
+                "\n".join(line for _, line in notifications))
+
+    def metrics(self) -> Dict:
+        """Delivery statistics of the dispatcher
+
+        Returns:
+            Dict -- Queue depth, pending recipients, the notification/sent/dropped counts
+                and the number of failed attempts to send an email
+        """
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "pending_recipients": len(self._pending),
+                "notifications": self.notifications,
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "failed": self.failed
+            }
+
+    def stop(self):
+        """Send the pending digests right away, then stop the dispatcher thread"""
+        if self._worker.is_alive():
+            self._queue.put(_STOP)
+            self._worker.join()
+
+
+class EmailNotifier(Handler):
+    """Email notifications about the arriving persons, following the e-notif settings of the notification page
+
+    The SMTP account comes from the MAIL_* config values, the password may also be given in the
+    RECOGNEYEZ_MAIL_PASSWORD environment variable. Without MAIL_USERNAME no emails are sent.
+    The cooldown is the e-notif-cooldown setting in minutes, MAIL_COOLDOWN_SECONDS if it's not set.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        username = app.config.get("MAIL_USERNAME")
+        self.dispatcher: MailDispatcher = None
+        if not username:
+            logging.info("MAIL_USERNAME is not set, email notifications are disabled")
+            return
+        mailer = Mailer(app.config.get("MAIL_SENDER") or username,
+                        app.config.get("MAIL_PASSWORD") or os.environ.get("RECOGNEYEZ_MAIL_PASSWORD"),
+                        host=app.config.get("MAIL_SERVER", "smtp.gmail.com"),
+                        port=app.config.get("MAIL_PORT", 587),
+                        use_tls=app.config.get("MAIL_USE_TLS", True),
+                        login_name=username)
+        self.dispatcher = MailDispatcher(mailer,
+                                         cooldown_seconds=app.config.get("MAIL_COOLDOWN_SECONDS", 120),
+                                         digest_seconds=app.config.get("MAIL_DIGEST_SECONDS", 30),
+                                         idle_seconds=app.config.get("MAIL_IDLE_SECONDS", 60),
+                                         max_queue=app.config.get("MAIL_QUEUE_SIZE", 256),
+                                         retry_seconds=app.config.get("MAIL_RETRY_SECONDS", 30),
+                                         max_attempts=app.config.get("MAIL_MAX_ATTEMPTS", 5))
+
+    def notify_arrived(self, person, date: str):
+        """Queue the notification about an arriving person, if the settings ask for one
+
+        Arguments:
+            person {Person} -- The person who arrived
+            date {str} -- The formatted time of the arrival
+        """
+        if self.dispatcher is None:
+            return
+        settings = self.app.sh.get_notification_settings()
+        if not settings.get("e-notif") or not settings.get("email"):
+            return
+        if not settings.get("e-notif-unk" if person.unknown else "e-notif-kno"):
+            return
+        line = "[{}] {} arrived".format(date, person.name)
+        cooldown = settings.get("e-notif-cooldown")
+        self.dispatcher.notify(settings["email"], "[recognEYEz] {} arrived".format(person.name), line,
+                               cooldown_seconds=None if cooldown is None else max(0.0, float(cooldown)) * 60)
+
+    def stop(self):
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
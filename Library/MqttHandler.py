@@ -1,40 +1,78 @@
-import paho.mqtt.client as mqtt
-import logging
-from Library.Handler import Handler
-from socket import gaierror
-
-class MqttHandler(Handler):
-
-    def __init__(self, app):
-        super().__init__(app)
-        self.data = self.app.sh.get_notification_settings()
-        self.client = mqtt.Client()
-        # self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        try:
-            self.connect()
-        except gaierror as error:
-            logging.info("Can't set up MQTT since there is probably no internet: {}".format(error))
-            return
-        self.client.loop_start()
-
-    def start_loop(self):
-        self.client.loop_start()
-
-    def stop_loop(self):
-        self.client.loop_stop()
-
-    def connect(self):
-        """ connects to the broker defined in the db """
-        if self.client.connect(self.data["broker_url"], int(self.data["port"])):
-            logging.info("MQTT connected to " + self.data["broker_url"])
-
-    def publish(self, topic, payload=None):
-        self.client.publish(topic, payload)
-
-    def subscribe(self, topic):
-        self.client.subscribe(topic)
-
-    def on_message(self, client, userdata, message):
-        logging.info("[MQTT-REC][" + message.topic + "]: " + str(message.payload.decode("utf-8")))
-        pass
+import paho.mqtt.client as mqtt
+import atexit
+import logging
+from typing import Set
+from Library.Handler import Handler
+from Library.MqttPublisher import MqttPublisher, MessageSpool
+
+
+class MqttHandler(Handler):
+    """MQTT notifications, the messages are sent by a background publisher
+
+    The client connects asynchronously and keeps reconnecting with backoff, so an unreachable broker at startup
+    only delays the delivery. Messages published in the meantime wait in the disk spool.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.data = self.app.sh.get_notification_settings()
+        self.subscriptions: Set[str] = set()
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=self.app.config.get("MQTT_MAX_BACKOFF_SECONDS", 60))
+        self.publisher = MqttPublisher(
+            self.client,
+            MessageSpool(self.app.config.get("MQTT_SPOOL_PATH", "Data/mqtt_spool.jsonl"),
+                         max_messages=self.app.config.get("MQTT_SPOOL_MAX_MESSAGES", 10000)),
+            qos=self.app.config.get("MQTT_QOS", 1),
+            batch_ms=self.app.config.get("MQTT_BATCH_MS", 0),
+            max_queue=self.app.config.get("MQTT_QUEUE_SIZE", 256))
+        atexit.register(self.stop)
+        self.connect()
+        self.client.loop_start()
+
+    def start_loop(self):
+        self.client.loop_start()
+
+    def stop_loop(self):
+        self.client.loop_stop()
+
+    def stop(self):
+        """Spool the undelivered messages and disconnect"""
+        self.publisher.stop()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def connect(self):
+        """ connects to the broker defined in the notification settings, without waiting for the connection """
+        self.client.connect_async(self.data["broker_url"], int(self.data["port"]))
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc != mqtt.CONNACK_ACCEPTED:
+            logging.error("MQTT connection refused: {}".format(mqtt.connack_string(rc)))
+            return
+        logging.info("MQTT connected to " + self.data["broker_url"])
+        for topic in self.subscriptions:
+            self.client.subscribe(topic)
+        self.publisher.set_connected(True)
+
+    def on_disconnect(self, client, userdata, rc):
+        self.publisher.set_connected(False)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            logging.info("MQTT connection lost: {}".format(mqtt.error_string(rc)))
+
+    def publish(self, topic, payload=None):
+        """Queue a message for the publisher thread, never blocks"""
+        self.publisher.submit(topic, payload)
+
+    def subscribe(self, topic):
+        """Subscribe to a topic, now if connected and after every reconnect"""
+        self.subscriptions.add(topic)
+        if self.client.is_connected():
+            self.client.subscribe(topic)
+
+    def on_message(self, client, userdata, message):
+        logging.info("[MQTT-REC][" + message.topic + "]: " + str(message.payload.decode("utf-8")))
+        pass
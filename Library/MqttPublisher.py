@@ -0,0 +1,276 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import paho.mqtt.client as mqtt
+
+# queued to stop the publisher thread
+_STOP = object()
+
+
+class MessageSpool:
+    """Messages that could not be delivered, kept in a JSON lines file until the broker is reachable again
+
+    Only the publisher thread uses the spool, it's not thread safe.
+    """
+
+    def __init__(self, path: Path, max_messages: int = 10000):
+        self.path = Path(path)
+        self.max_messages = max_messages
+        self.dropped = 0
+        self._count = None
+
+    def __len__(self) -> int:
+        if self._count is None:
+            self._count = len(self.read())
+        return self._count
+
+    def append(self, messages: List[Tuple[str, str, int]]):
+        """Store messages at the end of the spool, dropping the new ones when the spool is full
+
+        Arguments:
+            messages {List[Tuple[str, str, int]]} -- Topic, payload and QoS of every message
+        """
+        room = self.max_messages - len(self)
+        if room < len(messages):
+            self.dropped += len(messages) - max(room, 0)
+            logging.warning("MQTT spool is full, {} messages dropped so far".format(self.dropped))
+            messages = messages[:max(room, 0)]
+        if not messages:
+            return
+        os.makedirs(str(self.path.parent), exist_ok=True)
+        with open(str(self.path), 'a') as fp:
+            for topic, payload, qos in messages:
+                fp.write(json.dumps([topic, payload, qos]) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._count = len(self) + len(messages)
+
+    def read(self) -> List[Tuple[str, str, int]]:
+        """Get the spooled messages, oldest first, skipping the lines a crash has cut in half
+
+        Returns:
+            List[Tuple[str, str, int]] -- Topic, payload and QoS of every message
+        """
+        try:
+            with open(str(self.path)) as fp:
+                lines = fp.readlines()
+        except FileNotFoundError:
+            return []
+        messages = []
+        for line in lines:
+            try:
+                topic, payload, qos = json.loads(line)
+            except ValueError:
+                continue
+            messages.append((topic, payload, qos))
+        return messages
+
+    def replace(self, messages: List[Tuple[str, str, int]]):
+        """Atomically replace the content of the spool
+
+        Arguments:
+            messages {List[Tuple[str, str, int]]} -- The messages to keep
+        """
+        if not messages:
+            if self.path.exists():
+                self.path.unlink()
+            self._count = 0
+            return
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(str(temp_path), 'w') as fp:
+            for topic, payload, qos in messages:
+                fp.write(json.dumps([topic, payload, qos]) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(str(temp_path), str(self.path))
+        self._count = len(messages)
+
+
+class MqttPublisher:
+    """Publishes MQTT messages on a background thread, so a slow or unreachable broker never delays the caller
+
+    Messages are put on a bounded queue, the publisher thread collects them for batch_ms (if set), combines the
+    payloads of the same topic into one message separated by new lines and hands them to the paho client.
+    While the client is disconnected, or when the client refuses a message, the messages go to the disk spool,
+    which is replayed in order once the connection is back. Reconnecting with backoff is done by the client's loop.
+    """
+
+    def __init__(self, client: mqtt.Client, spool: MessageSpool, qos: int = 1, batch_ms: int = 0,
+                 max_queue: int = 256):
+        self.client = client
+        self.spool = spool
+        self.qos = qos
+        self.batch_interval = batch_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._connected = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.published = 0
+        self.spooled = 0
+        self.dropped = 0
+        # copies of the spool's counters, updated by the publisher thread, as the spool is not thread safe
+        self._spool_depth = len(spool)
+        self._spool_dropped = spool.dropped
+        self._worker = threading.Thread(target=self._work, name="mqtt-publisher", daemon=True)
+        self._worker.start()
+
+    def set_connected(self, connected: bool):
+        """Called from the connection callbacks of the client
+
+        Arguments:
+            connected {bool} -- Whether the client is connected to the broker
+        """
+        if connected:
+            self._connected.set()
+            # wake the publisher thread up to replay the spool
+            self._put(None)
+        else:
+            self._connected.clear()
+
+    def submit(self, topic: str, payload: str = None) -> bool:
+        """Queue a message without blocking
+
+        Arguments:
+            topic {str} -- The topic
+
+        Keyword Arguments:
+            payload {str} -- The payload (default: {None})
+
+        Returns:
+            bool -- False if the queue was full and the message was dropped
+        """
+        return self._put((topic, "" if payload is None else str(payload), self.qos))
+
+    def _put(self, item) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 100 == 0:
+                logging.warning("MQTT queue is full, {} messages dropped so far".format(dropped))
+            return False
+        return True
+
+    def _collect(self) -> Tuple[List[Tuple[str, str, int]], bool]:
+        """Wait for the next messages
+
+        Returns:
+            Tuple[List[Tuple[str, str, int]], bool] -- The messages and whether the publisher has to stop afterwards
+        """
+        messages = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.batch_interval
+        while True:
+            if item is _STOP:
+                return messages, True
+            if item is not None:
+                messages.append(item)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return messages, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return messages, False
+
+    @staticmethod
+    def batch(messages: List[Tuple[str, str, int]]) -> List[Tuple[str, str, int]]:
+        """Combine the consecutive messages of the same topic and QoS, joining their payloads with new lines
+
+        Arguments:
+            messages {List[Tuple[str, str, int]]} -- Topic, payload and QoS of every message
+
+        Returns:
+            List[Tuple[str, str, int]] -- The combined messages, in the original order
+        """
+        return [(topic, "\n".join(payload for _, payload, _ in group), qos)
+                for (topic, qos), group in groupby(messages, key=lambda message: (message[0], message[2]))]
+
+    def _work(self):
+        while True:
+            messages, stopping = self._collect()
+            if self.batch_interval > 0:
+                messages = self.batch(messages)
+            if self._connected.is_set() and len(self.spool):
+                self._replay_spool()
+            if len(self.spool):
+                # keep the order, nothing overtakes the messages waiting in the spool
+                self._spool(messages)
+            else:
+                self._spool(self._publish(messages))
+            with self._stats_lock:
+                self._spool_depth = len(self.spool)
+                self._spool_dropped = self.spool.dropped
+            if stopping:
+                return
+
+    def _publish(self, messages: List[Tuple[str, str, int]]) -> List[Tuple[str, str, int]]:
+        """Hand the messages to the client
+
+        Returns:
+            List[Tuple[str, str, int]] -- The messages that could not be sent, starting with the first failure
+        """
+        for index, (topic, payload, qos) in enumerate(messages):
+            if not self._connected.is_set():
+                return messages[index:]
+            info = self.client.publish(topic, payload, qos)
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                logging.info("MQTT publish failed: {}".format(mqtt.error_string(info.rc)))
+                return messages[index:]
+            with self._stats_lock:
+                self.published += 1
+        return []
+
+    def _spool(self, messages: List[Tuple[str, str, int]]):
+        if not messages:
+            return
+        try:
+            self.spool.append(messages)
+        except OSError as e:
+            logging.error("Could not spool {} MQTT messages: {}".format(len(messages), e))
+            with self._stats_lock:
+                self.dropped += len(messages)
+            return
+        with self._stats_lock:
+            self.spooled += len(messages)
+
+    def _replay_spool(self):
+        messages = self.spool.read()
+        if not messages:
+            return
+        remaining = self._publish(messages)
+        try:
+            self.spool.replace(remaining)
+        except OSError as e:
+            logging.error("Could not update the MQTT spool: {}".format(e))
+        logging.info("Replayed {} spooled MQTT messages".format(len(messages) - len(remaining)))
+
+    def metrics(self) -> Dict:
+        """Delivery statistics of the publisher
+
+        Returns:
+            Dict -- Queue depth, connection state and the published/spooled/dropped message counts
+        """
+        with self._stats_lock:
+            return {
+                "connected": self._connected.is_set(),
+                "queue_depth": self._queue.qsize(),
+                "spool_depth": self._spool_depth,
+                "published": self.published,
+                "spooled": self.spooled,
+                "dropped": self.dropped + self._spool_dropped
+            }
+
+    def stop(self):
+        """Publish or spool the queued messages, then stop the publisher thread"""
+        if self._worker.is_alive():
+            self._queue.put(_STOP)
+            self._worker.join()
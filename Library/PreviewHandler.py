@@ -0,0 +1,363 @@
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Tuple, Iterator, Dict, List, Iterable
+
+import cv2
+
+from Library.Handler import Handler
+from Library.framebus import FrameBus
+
+font = cv2.FONT_HERSHEY_DUPLEX
+
+# the face rectangle in (top, right, bottom, left) order, the name of the person
+# and whether the face is visible on the current frame
+Label = Tuple[Tuple, str, bool]
+# the names are shortened to this many characters when the labels don't fit the metadata of the frame bus
+bus_label_length = 32
+
+
+def annotate(frame, face_rects: List[Tuple], labels: List[Label]):
+    """Draw the detected face rectangles and the names of the tracked persons on a copy of the frame
+
+    Arguments:
+        frame -- BGR image (numpy)
+        face_rects {List[Tuple]} -- The detected faces in (top, right, bottom, left) order
+        labels {List[Label]} -- The tracked persons
+
+    Returns:
+        The annotated copy of the frame
+    """
+    frame = frame.copy()
+    for (top, right, bottom, left) in face_rects:
+        cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+    for ((top, right, bottom, left), name, visible) in labels:
+        y = top - 15 if top - 15 > 15 else top + 15
+        if visible:
+            cv2.putText(frame, name, (left, y), font, 0.4, (0, 255, 0), 1)
+        else:
+            cv2.rectangle(frame, (left, top), (right, bottom), (120, 0, 120), 2)
+            cv2.putText(frame, name, (left, y), font, 0.4, (120, 0, 120), 1)
+    return frame
+
+
+def make_labels(tracking_data: Iterable) -> List[Label]:
+    """Take a snapshot of the tracking data that is needed to draw the overlay later
+
+    Arguments:
+        tracking_data {Iterable[TrackedPerson]} -- The currently tracked persons
+
+    Returns:
+        List[Label] -- The labels
+    """
+    return [(tracked.rect, tracked.person.name, tracked.disappearCount == 0) for tracked in tracking_data]
+
+
+class PreviewHandler(Handler):
+    """Holds the latest preview frame of the camera loop and fans it out to the browsers
+
+    The camera loop only stores the raw frame with the detections and tracking labels, the overlay
+    is drawn when a client actually asks for the frame. Every frame is annotated and JPEG encoded at most
+    once per variant (full size or thumbnail), no matter how many clients are watching. Streaming clients
+    always get the newest frame when they are ready for one, so a slow client simply skips the frames in between.
+    In headless mode the frames are not kept at all.
+
+    With a frame bus, the process running the camera also writes every frame to shared memory, and the web
+    worker processes (created with bus_name) serve the frames they read from it instead of their own.
+    """
+    boundary = "frame"
+    thumbnail_width = 160
+    # seconds after which the current frame is sent again, to keep idle streams alive
+    keepalive_seconds = 5.0
+    # a polling client counts as watching for this many seconds after its last request
+    poll_consumer_seconds = 5.0
+    # how often a reader checks whether the frame bus was (re)created by the camera process
+    bus_check_seconds = 5.0
+    # how often a streaming reader polls the frame bus for a new frame
+    bus_poll_seconds = 0.01
+
+    def __init__(self, app, max_viewers: int = 4, jpeg_quality: int = 80, headless: bool = False,
+                 bus: FrameBus = None, bus_name: str = None):
+        super().__init__(app)
+        self.max_viewers = max_viewers
+        self.jpeg_quality = jpeg_quality
+        self.headless = headless
+        # the frame bus this process writes to, or reads from if bus_name is set
+        self.bus = bus
+        self.bus_name = bus_name
+        self._bus_checked = 0.0
+        # guards replacing the bus against the readers of its control block, the frames are read under _encode_lock
+        self._bus_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._viewer_lock = threading.Lock()
+        self.viewers = 0
+        self.last_poll = 0.0
+        self._sequence = 0
+        self.frame = None
+        self.face_rects: List[Tuple] = []
+        self.labels: List[Label] = []
+        self.annotated_frames = 0
+        self.skipped_frames = 0
+        self.annotation_seconds = 0.0
+        self._annotated_sequence = -1
+        # the frames written to the frame bus without some of their metadata
+        self.truncated_metadata = 0
+        # thumbnail flag -> (sequence number, JPEG bytes) of the last encoded frame
+        self._encoded: Dict[bool, Tuple[int, bytes]] = dict()
+        # makes the ETags of this process distinct from the ones handed out before a restart
+        self._instance = "{:x}".format(int(time.time()))
+        self._annotated_frame = None
+        self.publish_empty()
+
+    def publish(self, frame, face_rects: List[Tuple] = None, labels: List[Label] = None):
+        """Make a new frame the current preview frame, waking up the streaming clients
+        The frame is stored as it is, the overlay is only drawn if somebody requests the frame
+
+        Arguments:
+            frame -- BGR image (numpy)
+
+        Keyword Arguments:
+            face_rects {List[Tuple]} -- The detected faces (default: {None})
+            labels {List[Label]} -- The labels of the tracked persons, see make_labels (default: {None})
+        """
+        with self._condition:
+            if self.headless and self.frame is not None:
+                # nothing is kept, so nothing is ever drawn
+                if face_rects or labels:
+                    self.skipped_frames += 1
+                return
+            if self._annotated_sequence != self._sequence and (self.face_rects or self.labels):
+                self.skipped_frames += 1
+            self.frame = frame
+            self.face_rects = face_rects or []
+            self.labels = labels or []
+            self._sequence += 1
+            self._condition.notify_all()
+        if self.bus is not None and self.bus.owner:
+            self._write_to_bus(frame, self.face_rects, self.labels)
+
+    def _write_to_bus(self, frame, face_rects: List[Tuple], labels: List[Label]):
+        """Write the frame to the frame bus, with as much of the metadata as fits
+        The names are edited by the users and have no length limit, a long name or a crowded frame
+        mustn't stop the camera loop, so the names are shortened, then the labels and the rectangles are dropped
+        """
+        try:
+            self.bus.write(frame, {"face_rects": face_rects, "labels": labels})
+            return
+        except ValueError:
+            pass
+        shortened = [(rect, name[:bus_label_length], visible) for (rect, name, visible) in labels]
+        for description, meta in (("shortened names", {"face_rects": face_rects, "labels": shortened}),
+                                  ("no labels", {"face_rects": face_rects, "labels": []}),
+                                  ("no metadata", {})):
+            try:
+                self.bus.write(frame, meta)
+            except ValueError:
+                continue
+            self.truncated_metadata += 1
+            if self.truncated_metadata == 1 or self.truncated_metadata % 100 == 0:
+                logging.warning("The preview labels don't fit the frame bus, frame written with {} ({} so far)".format(
+                    description, self.truncated_metadata))
+            return
+
+    @property
+    def reading_bus(self) -> bool:
+        return self.bus_name is not None
+
+    @property
+    def sequence(self) -> int:
+        """The sequence number of the newest frame"""
+        if self.reading_bus:
+            self._check_bus()
+            with self._bus_lock:
+                return self.bus.latest_sequence if self.bus is not None else 0
+        return self._sequence
+
+    def _check_bus(self):
+        """Attach to the frame bus, or attach again if the camera process has re-created it since"""
+        now = time.monotonic()
+        if now - self._bus_checked < self.bus_check_seconds:
+            return
+        self._bus_checked = now
+        try:
+            bus = FrameBus.attach(self.bus_name)
+        except (FileNotFoundError, ValueError):
+            return
+        # numpy views don't keep the shared memory mapped, so the old bus is only closed once no thread can use it
+        with self._encode_lock, self._bus_lock:
+            if self.bus is not None and bus.created == self.bus.created:
+                bus.close()
+                return
+            logging.info("Attached to the frame bus {}".format(self.bus_name))
+            old_bus, self.bus = self.bus, bus
+            # in microseconds, a bus re-created within the same second must not repeat the ETags of the old one
+            self._instance = "{:x}".format(int(bus.created * 1000000))
+            # the sequence numbers start over on the new bus, nothing cached from the old one may be served
+            self._encoded.clear()
+            self._annotated_sequence = -1
+            self._annotated_frame = None
+            if old_bus is not None:
+                old_bus.close()
+
+    def _current(self) -> Tuple:
+        """Get the newest frame with its sequence number, face rectangles and labels
+        Frames read from the bus are views into the shared memory, not copies
+        """
+        if self.reading_bus:
+            entry = self.bus.read() if self.bus is not None else None
+            if entry is None:
+                return self.frame, 0, [], []
+            sequence, _, frame, meta = entry
+            labels = [(tuple(rect), name, visible) for (rect, name, visible) in meta.get("labels", [])]
+            return frame, sequence, [tuple(rect) for rect in meta.get("face_rects", [])], labels
+        with self._condition:
+            return self.frame, self._sequence, self.face_rects, self.labels
+
+    def publish_empty(self):
+        """Replace the preview with the placeholder picture, e.g. when the camera stops"""
+        with self._condition:
+            # the placeholder is shown even in headless mode
+            self.frame = None
+        self.publish(cv2.imread(str(Path("Static", "empty_pic.png"))))
+
+    def has_consumers(self) -> bool:
+        """Check whether anybody is watching the preview, either streaming or polling
+
+        Returns:
+            bool -- True if there is a stream open or the still preview was polled recently
+        """
+        return self.viewers > 0 or time.monotonic() - self.last_poll < self.poll_consumer_seconds
+
+    def record_poll(self):
+        """Mark that a client has just polled the still preview"""
+        self.last_poll = time.monotonic()
+
+    def annotation_stats(self) -> Dict:
+        """Statistics of the lazy annotation
+
+        Returns:
+            Dict -- The number of annotated frames and the time spent on them, the number of frames with
+                an overlay that was never drawn because nobody looked at them
+        """
+        return {
+            "headless": self.headless,
+            "watched": self.has_consumers(),
+            "annotated_frames": self.annotated_frames,
+            "annotation_seconds": self.annotation_seconds,
+            "skipped_frames": self.skipped_frames,
+            "truncated_bus_metadata": self.truncated_metadata
+        }
+
+    def get_jpeg(self, thumbnail: bool = False) -> Tuple[int, bytes]:
+        """Get the current frame encoded as JPEG, encoding it only if this frame has not been encoded yet
+
+        Keyword Arguments:
+            thumbnail {bool} -- Get the downscaled variant of the frame (default: {False})
+
+        Returns:
+            Tuple[int, bytes] -- The sequence number of the frame and the JPEG bytes
+        """
+        with self._encode_lock:
+            frame, sequence, face_rects, labels = self._current()
+            cached = self._encoded.get(thumbnail)
+            if cached is None or cached[0] != sequence:
+                cached = (sequence, self._encode(frame, sequence, face_rects, labels, thumbnail))
+                if self.reading_bus and sequence and not self.bus.still_valid(sequence):
+                    # the camera process overwrote the slot while it was encoded, take the newest frame instead
+                    frame, sequence, face_rects, labels = self._current()
+                    cached = (sequence, self._encode(frame, sequence, face_rects, labels, thumbnail))
+                self._encoded[thumbnail] = cached
+            return cached
+
+    def _encode(self, frame, sequence: int, face_rects: List[Tuple], labels: List[Label], thumbnail: bool) -> bytes:
+        if self._annotated_sequence != sequence:
+            self._annotated_frame = self._annotate(frame, face_rects, labels)
+            self._annotated_sequence = sequence
+        frame = self._annotated_frame
+        if thumbnail and frame.shape[1] > self.thumbnail_width:
+            height = int(frame.shape[0] * self.thumbnail_width / frame.shape[1])
+            frame = cv2.resize(frame, (self.thumbnail_width, height), interpolation=cv2.INTER_AREA)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return buffer.tobytes()
+
+    def _annotate(self, frame, face_rects: List[Tuple], labels: List[Label]):
+        if not face_rects and not labels:
+            return frame
+        start = time.perf_counter()
+        frame = annotate(frame, face_rects, labels)
+        self.annotation_seconds += time.perf_counter() - start
+        self.annotated_frames += 1
+        return frame
+
+    def etag(self, sequence: int, thumbnail: bool = False) -> str:
+        """Get the entity tag of an encoded frame
+
+        Arguments:
+            sequence {int} -- The sequence number of the frame
+
+        Keyword Arguments:
+            thumbnail {bool} -- Whether the tag is for the thumbnail variant (default: {False})
+
+        Returns:
+            str -- The ETag value
+        """
+        return "{}-{}{}".format(self._instance, sequence, "-thumb" if thumbnail else "")
+
+    def wait_for_frame(self, last_sequence: int, timeout: float) -> bool:
+        """Block until a frame newer than last_sequence is published
+
+        Returns:
+            bool -- False if the timeout expired without a new frame
+        """
+        if self.reading_bus:
+            return self._wait_for_bus_frame(last_sequence, timeout)
+        with self._condition:
+            return self._condition.wait_for(lambda: self._sequence != last_sequence, timeout)
+
+    def _wait_for_bus_frame(self, last_sequence: int, timeout: float) -> bool:
+        """Poll the frame bus like FrameBus.wait_for, but under the bus lock, as the bus may be replaced meanwhile"""
+        previous_bus = self.bus
+        self._check_bus()
+        if self.bus is not previous_bus and self.bus is not None:
+            # the sequence numbers started over on the new bus
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._bus_lock:
+                if self.bus is not None and self.bus.latest_sequence != last_sequence:
+                    return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.bus_poll_seconds)
+
+    def add_viewer(self) -> bool:
+        """Reserve a streaming slot
+
+        Returns:
+            bool -- False if the maximum number of concurrent viewers is reached
+        """
+        with self._viewer_lock:
+            if self.viewers >= self.max_viewers:
+                return False
+            self.viewers += 1
+            return True
+
+    def remove_viewer(self):
+        with self._viewer_lock:
+            self.viewers = max(0, self.viewers - 1)
+        logging.info("Preview stream closed, {} viewers left".format(self.viewers))
+
+    def stream(self) -> Iterator[bytes]:
+        """Generate a multipart/x-mixed-replace MJPEG stream of the preview frames
+        The caller has to reserve a slot with add_viewer and free it with remove_viewer
+        """
+        last_sequence = -1
+        while True:
+            # on timeout the current frame is sent again
+            self.wait_for_frame(last_sequence, self.keepalive_seconds)
+            last_sequence, jpeg = self.get_jpeg()
+            yield (b"--" + self.boundary.encode() + b"\r\n"
+                   b"Content-Type: image/jpeg\r\n"
+                   b"Content-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
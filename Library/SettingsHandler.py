@@ -1,34 +1,198 @@
-from typing import Dict
+from typing import Dict, NamedTuple, Tuple
 from pathlib import Path
+import copy
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
 from Library.Handler import Handler
 from Library.helpers import InvalidUsage
 
 
+class FaceRecognitionSnapshot(NamedTuple):
+    """The face recognition settings and the selected camera setting, parsed once into typed fields
+    The camera loop reads this instead of the settings dictionary, a new snapshot replaces it when the settings change
+    """
+    selected_setting: str
+    preferred_id: int
+    url: str
+    flip_cam: bool
+    resolution: str
+    dnn_threshold: float
+    dnn_scan_freq: int
+    force_dnn_on_new: bool
+    cache_unknown: bool
+    image_format: str
+    image_quality: int
+    dedup_distance: int
+    # the recording played back by the replay camera (preferred id -2)
+    replay_path: str
+    replay_mode: str
+    replay_step: int
+    replay_loop: bool
+
+    @property
+    def camera_source(self) -> Tuple:
+        """The settings that can only be applied by opening the camera again"""
+        return (self.preferred_id, self.url, self.resolution,
+                self.replay_path, self.replay_mode, self.replay_step, self.replay_loop)
+
+    @classmethod
+    def from_settings(cls, settings: Dict, camera_setting: Dict) -> 'FaceRecognitionSnapshot':
+        """Create a snapshot from the face recognition settings
+
+        Arguments:
+            settings {Dict} -- The face recognition setting dictionary
+            camera_setting {Dict} -- The selected camera setting
+
+        Returns:
+            FaceRecognitionSnapshot -- The snapshot
+        """
+        return cls(
+            selected_setting=settings["selected-setting"],
+            preferred_id=int(camera_setting.get("preferred-id", 0)),
+            url=camera_setting.get("URL", ""),
+            flip_cam=camera_setting.get("flip-cam", False) is True,
+            resolution=camera_setting.get("resolution", "qvga"),
+            dnn_threshold=float(settings["dnn-tresh"]),
+            dnn_scan_freq=int(settings["dnn-scan-freq"]),
+            force_dnn_on_new=bool(settings.get("force-dnn-on-new", False)),
+            cache_unknown=bool(settings.get("cache-unknown", True)),
+            image_format=settings.get("image-format", "jpg"),
+            image_quality=int(settings.get("image-quality", 90)),
+            dedup_distance=int(settings.get("dedup-distance", 6)),
+            replay_path=camera_setting.get("replay-path", ""),
+            replay_mode=camera_setting.get("replay-mode", "realtime"),
+            replay_step=int(camera_setting.get("replay-step", 1)),
+            replay_loop=camera_setting.get("replay-loop", False) is True
+        )
+
+
 class SettingsHandler(Handler):
-    __face_recognition_settings = dict()
-    __notification_settings = dict()
+    """Loads and saves the JSON setting files, shared by every process of the app
+
+    The files are replaced atomically (written to a temporary file, then renamed over the old one), so a crash
+    can't leave a half written file behind and other processes never read one. Every save increments the version
+    stored in the file. The cached settings are checked against the files at most every SETTINGS_POLL_SECONDS
+    with a stat call, a file changed by another process is reloaded on the next access.
+    """
+    face_recognition_settings_path = Path("Data", "FaceRecSettings.json")
+    notification_settings_path = Path("Data", "NotificationSettings.json")
 
     def __init__(self, app):
         super().__init__(app)
+        self.poll_interval = app.config.get("SETTINGS_POLL_SECONDS", 1.0)
+        self._face_recognition_settings: Dict = dict()
+        self._face_recognition_snapshot: FaceRecognitionSnapshot = None
+        self._notification_settings: Dict = dict()
+        # path -> the stat signature of the file the cached settings were read from or written to
+        self._signatures: Dict[Path, Tuple] = dict()
+        self._next_check = 0.0
+        # serializes the saves of this process, the read-modify-write of the files
+        self._save_lock = threading.RLock()
+
+    def reload(self):
+        """Drop the cached settings, so the next access reads them from the file system again"""
+        self._face_recognition_settings = dict()
+        self._face_recognition_snapshot = None
+        self._notification_settings = dict()
+
+    @staticmethod
+    def file_signature(path: Path) -> Tuple:
+        """Get what identifies a version of a file, it changes when the file is replaced or modified
+
+        Arguments:
+            path {Path} -- The file
+
+        Returns:
+            Tuple -- The inode, the modification time and the size, None if the file doesn't exist
+        """
+        try:
+            stat = os.stat(str(path))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def check_for_changes(self, force: bool = False) -> bool:
+        """Drop the cached settings of the files that were changed since they were read, e.g. by another process
+
+        Keyword Arguments:
+            force {bool} -- Check now, even if the poll interval hasn't elapsed yet (default: {False})
+
+        Returns:
+            bool -- Whether a file has changed
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        self._next_check = now + self.poll_interval
+        changed = False
+        if self._face_recognition_settings \
+                and self._has_changed(self.face_recognition_settings_path):
+            self._face_recognition_settings = dict()
+            changed = True
+        if self._notification_settings and self._has_changed(self.notification_settings_path):
+            self._notification_settings = dict()
+            changed = True
+        if changed:
+            logging.info("The setting files were changed, reloading them")
+        return changed
+
+    def _has_changed(self, path: Path) -> bool:
+        return self.file_signature(path) != self._signatures.get(path)
+
+    def _read_json(self, path: Path) -> Dict:
+        # the signature is taken first, a replace during the read is caught by the next check
+        signature = self.file_signature(path)
+        with open(str(path)) as fp:
+            data = json.load(fp)
+        self._signatures[path] = signature
+        return data
+
+    def _write_json(self, path: Path, data: Dict):
+        """Atomically replace a setting file, incrementing its version
+
+        Arguments:
+            path {Path} -- The setting file
+            data {Dict} -- The settings, their version is updated in place
+        """
+        data["version"] = int(data.get("version", 0)) + 1
+        fd, temp_path = tempfile.mkstemp(prefix=path.name, suffix=".tmp", dir=str(path.parent))
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(data, fp, indent=3)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp_path, str(path))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        self._signatures[path] = self.file_signature(path)
 
     def get_notification_settings(self) -> Dict:
-        if not self.__notification_settings:
-            self.__notification_settings = self.load_notification_settings()
-        return self.__notification_settings
+        self.check_for_changes()
+        settings = self._notification_settings
+        if not settings:
+            settings = self.load_notification_settings()
+            self._notification_settings = settings
+        return settings
 
     def load_notification_settings(self) -> Dict:
-        with open("Data/NotificationSettings.json") as nfp:
-            return json.load(nfp)
+        return self._read_json(self.notification_settings_path)
 
     def save_notification_configuration(self, transformed_form_data):
-        current_settings_dictionary = self.get_notification_settings()
-        for key, value in transformed_form_data.items():
-            current_settings_dictionary[key] = value
+        with self._save_lock:
+            # start from the latest version on the disk, another process may have saved since it was read
+            self.check_for_changes(force=True)
+            current_settings_dictionary = copy.deepcopy(self.get_notification_settings())
+            for key, value in transformed_form_data.items():
+                current_settings_dictionary[key] = value
 
-        with open(Path("Data/NotificationSettings.json"), 'w') as nfp:
-            json.dump(current_settings_dictionary, nfp, indent=3)
-        self.__notification_settings = current_settings_dictionary
+            self._write_json(self.notification_settings_path, current_settings_dictionary)
+            self._notification_settings = current_settings_dictionary
 
     def get_camera_setting_by_name(self, setting_name: str) -> Dict:
         """Get a specific camera setting by its name
@@ -39,10 +203,8 @@ class SettingsHandler(Handler):
         Returns:
             Dict -- The camera setting
         """
-        self.get_face_recognition_settings()
-        return self.__face_recognition_settings["camera-settings"][self.get_current_settings_index(
-            self.__face_recognition_settings,
-            setting_name)]
+        settings = self.get_face_recognition_settings()
+        return settings["camera-settings"][self.get_current_settings_index(settings, setting_name)]
 
     def get_face_recognition_settings(self) -> Dict:
         """Get the dictionary containing settings related to the face recognition process
@@ -50,9 +212,45 @@ class SettingsHandler(Handler):
         Returns:
             Dict -- Face recognition setting dictionary
         """
-        if not self.__face_recognition_settings:
-            self.__face_recognition_settings = self.load_face_recognition_settings()
-        return self.__face_recognition_settings
+        self.check_for_changes()
+        settings = self._face_recognition_settings
+        if not settings:
+            settings = self.load_face_recognition_settings()
+            self._set_face_recognition_settings(settings)
+        return settings
+
+    def get_face_recognition_snapshot(self) -> FaceRecognitionSnapshot:
+        """Get the typed, immutable copy of the face recognition settings, meant for the per frame code
+
+        Returns:
+            FaceRecognitionSnapshot -- The current snapshot, replaced as a whole when the settings change
+        """
+        self.check_for_changes()
+        # the change may have been found by another getter, which only dropped the settings dictionary
+        if not self._face_recognition_settings or self._face_recognition_snapshot is None:
+            self.get_face_recognition_settings()
+        return self._face_recognition_snapshot
+
+    def get_face_recognition_version(self) -> int:
+        """Get the version of the face recognition settings, incremented by every save
+
+        Returns:
+            int -- The version, 0 for a file that was never saved by the app
+        """
+        return int(self.get_face_recognition_settings().get("version", 0))
+
+    def _set_face_recognition_settings(self, settings: Dict):
+        """Replace the cached settings and their snapshot
+        The snapshot is built before it's published with a single assignment, readers never see a partial update
+
+        Arguments:
+            settings {Dict} -- The new face recognition setting dictionary
+        """
+        camera_setting = settings["camera-settings"][self.get_current_settings_index(
+            settings, settings["selected-setting"])]
+        snapshot = FaceRecognitionSnapshot.from_settings(settings, camera_setting)
+        self._face_recognition_settings = settings
+        self._face_recognition_snapshot = snapshot
 
     def load_face_recognition_settings(self) -> Dict:
         """Load the face recognition setting JSON as a dictionary from the file system
@@ -60,8 +258,7 @@ class SettingsHandler(Handler):
         Returns:
             Dict -- The face recognition setting dictionary
         """
-        with open("Data/FaceRecSettings.json") as ffp:
-            return json.load(ffp)
+        return self._read_json(self.face_recognition_settings_path)
 
     def transform_form_to_dict(self, form) -> Dict:
         """Transform the form data coming from the API into a friendlier format
@@ -95,18 +292,21 @@ class SettingsHandler(Handler):
         Arguments:
             transformed_form_data {Dict} -- Dictionary containing the new setting values
         """
-        current_settings_dict = self.get_face_recognition_settings()
-        settings_index = self.get_current_settings_index(current_settings_dict, transformed_form_data["selected-setting-static"])
-        transformed_form_data["selected-setting-static"] = transformed_form_data["setting-name"]
-        for key, value in transformed_form_data.items():
-            if key.endswith("-static"):
-                current_settings_dict[key.replace("-static", "")] = value
-            else:
-                current_settings_dict["camera-settings"][settings_index][key] = value
+        with self._save_lock:
+            # start from the latest version on the disk and leave the cached one alone until the new one is written
+            self.check_for_changes(force=True)
+            current_settings_dict = copy.deepcopy(self.get_face_recognition_settings())
+            settings_index = self.get_current_settings_index(
+                current_settings_dict, transformed_form_data["selected-setting-static"])
+            transformed_form_data["selected-setting-static"] = transformed_form_data["setting-name"]
+            for key, value in transformed_form_data.items():
+                if key.endswith("-static"):
+                    current_settings_dict[key.replace("-static", "")] = value
+                else:
+                    current_settings_dict["camera-settings"][settings_index][key] = value
 
-        with open(Path("Data/FaceRecSettings.json"), 'w') as ffp:
-            json.dump(current_settings_dict, ffp, indent=3)
-        self.__face_recognition_settings = current_settings_dict
+            self._write_json(self.face_recognition_settings_path, current_settings_dict)
+            self._set_face_recognition_settings(current_settings_dict)
 
     def get_current_settings_index(self, current_settings_dict, setting_name) -> int:
         """Get the index of a camera setting based on a setting name
@@ -125,30 +325,30 @@ class SettingsHandler(Handler):
         return -1
 
     def remove_camera_settings(self, camera_setting: str):
-        new_dict = self.load_face_recognition_settings()
-        if len(new_dict["camera-settings"]) <= 1:
-            raise InvalidUsage("Cannot delete last camera preset")
-        index = self.get_current_settings_index(new_dict, camera_setting)
-        new_dict["camera-settings"].pop(index)
-        if new_dict["selected-setting"] == camera_setting:
-            new_dict["selected-setting"] = new_dict["camera-settings"][0]["setting-name"]
-        with open(Path("Data/FaceRecSettings.json"), 'w') as ffp:
-            json.dump(new_dict, ffp, indent=3)
-        self.__face_recognition_settings = new_dict
+        with self._save_lock:
+            new_dict = self.load_face_recognition_settings()
+            if len(new_dict["camera-settings"]) <= 1:
+                raise InvalidUsage("Cannot delete last camera preset")
+            index = self.get_current_settings_index(new_dict, camera_setting)
+            new_dict["camera-settings"].pop(index)
+            if new_dict["selected-setting"] == camera_setting:
+                new_dict["selected-setting"] = new_dict["camera-settings"][0]["setting-name"]
+            self._write_json(self.face_recognition_settings_path, new_dict)
+            self._set_face_recognition_settings(new_dict)
 
     def add_camera_setting(self):
-        current_dict = self.load_face_recognition_settings()
-        i = 0
-        while self.get_current_settings_index(current_dict, "Preset {}".format(i)) != -1:
-            i = i + 1
-        current_dict["camera-settings"].append({
-            "setting-name": "Preset {}".format(i),
-            "preferred-id": 0,
-            "URL": "",
-            "flip-cam": False,
-            "resolution": "qvga"
-        })
-
-        with open(Path("Data/FaceRecSettings.json"), 'w') as ffp:
-            json.dump(current_dict, ffp, indent=3)
-        self.__face_recognition_settings = current_dict
+        with self._save_lock:
+            current_dict = self.load_face_recognition_settings()
+            i = 0
+            while self.get_current_settings_index(current_dict, "Preset {}".format(i)) != -1:
+                i = i + 1
+            current_dict["camera-settings"].append({
+                "setting-name": "Preset {}".format(i),
+                "preferred-id": 0,
+                "URL": "",
+                "flip-cam": False,
+                "resolution": "qvga"
+            })
+
+            self._write_json(self.face_recognition_settings_path, current_dict)
+            self._set_face_recognition_settings(current_dict)
@@ -0,0 +1,132 @@
+import json
+import logging
+import queue
+import threading
+from typing import List, Iterator, Dict
+
+
+class Subscription:
+    """A client of a Broadcaster with its own bounded queue of serialized messages"""
+
+    def __init__(self, queue_size: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, message: bytes):
+        """Queue a message, dropping the oldest one if the client can't keep up"""
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+
+class Broadcaster:
+    """Fans out server-sent events to any number of subscribers
+
+    Every message is serialized once, then the same bytes are put on the queue of every subscriber.
+    Publishing never blocks, a slow subscriber loses its oldest messages instead.
+    """
+    # seconds of silence after which a comment line is sent to keep the connection open
+    keepalive_seconds = 15.0
+
+    def __init__(self, queue_size: int = 64, max_subscribers: int = 32):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self) -> Subscription:
+        """Register a new subscriber
+
+        Returns:
+            Subscription -- The subscription, or None if the maximum number of subscribers is reached
+        """
+        with self._lock:
+            if len(self._subscriptions) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscriptions.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            try:
+                self._subscriptions.remove(subscription)
+            except ValueError:
+                pass
+        logging.info("Event stream closed, {} subscribers left".format(self.subscriber_count))
+
+    @staticmethod
+    def serialize(event: str, data: Dict) -> bytes:
+        """Serialize an event in the text/event-stream format
+
+        Arguments:
+            event {str} -- The event type
+            data {Dict} -- JSON serializable payload
+
+        Returns:
+            bytes -- The message
+        """
+        return "event: {}\ndata: {}\n\n".format(event, json.dumps(data, separators=(',', ':'), default=str)).encode()
+
+    def publish(self, event: str, data: Dict):
+        """Send an event to every subscriber
+
+        Arguments:
+            event {str} -- The event type
+            data {Dict} -- JSON serializable payload
+        """
+        if not self._subscriptions:
+            return
+        self.publish_message(self.serialize(event, data))
+
+    def publish_message(self, message: bytes):
+        """Send an already serialized message to every subscriber
+
+        Arguments:
+            message {bytes} -- The message, see serialize
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def stream(self, subscription: Subscription, first_message: bytes = None) -> Iterator[bytes]:
+        """Generate the text/event-stream body for a subscriber
+
+        Arguments:
+            subscription {Subscription} -- The subscription to read from
+
+        Keyword Arguments:
+            first_message {bytes} -- A message sent before everything else, e.g. the current state (default: {None})
+        """
+        if first_message is not None:
+            yield first_message
+        while True:
+            try:
+                yield subscription.queue.get(timeout=self.keepalive_seconds)
+            except queue.Empty:
+                yield b": keepalive\n\n"
+
+
+def tracking_snapshot(tracking_data) -> Dict:
+    """Compact, JSON serializable view of the currently tracked persons
+
+    Arguments:
+        tracking_data {Iterable[TrackedPerson]} -- The currently tracked persons
+
+    Returns:
+        Dict -- The names of the tracked persons and whether they are visible on the current frame
+    """
+    return {"persons": [{"name": tracked.person.name, "visible": tracked.disappearCount == 0}
+                        for tracked in tracking_data]}
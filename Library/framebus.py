@@ -0,0 +1,205 @@
+import json
+import time
+from multiprocessing import shared_memory, resource_tracker
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+
+# control block: magic, slot count, frame capacity (height, width, channels), metadata capacity,
+# latest sequence number, creation time
+CONTROL_DTYPE = np.dtype([
+    ("magic", "<u4"), ("slots", "<u4"), ("height", "<u4"), ("width", "<u4"), ("channels", "<u4"),
+    ("meta_size", "<u4"), ("latest", "<i8"), ("created", "<f8")
+])
+# per slot header: sequence number (-1 while the slot is being written), timestamp, frame shape, metadata length
+SLOT_DTYPE = np.dtype([
+    ("sequence", "<i8"), ("timestamp", "<f8"), ("height", "<u4"), ("width", "<u4"), ("channels", "<u4"),
+    ("meta_length", "<u4")
+])
+MAGIC = 0x52455946  # "FYER"
+WRITING = -1
+
+
+def _json_default(value):
+    # numpy scalars, e.g. the coordinates coming from the face detector
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class FrameBus:
+    """Ring buffer of camera frames with metadata in shared memory
+
+    A single writer process (the camera/recognition process) puts frames into the ring, any number of
+    reader processes (the web workers) get numpy views of the newest frame without copying it.
+    Every slot is guarded by its sequence number: the writer invalidates the slot before overwriting it,
+    so a reader can tell whether the frame changed under it with still_valid().
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.control = np.ndarray((1,), dtype=CONTROL_DTYPE, buffer=shm.buf)[0:1]
+        if self.control["magic"][0] != MAGIC:
+            raise ValueError("The shared memory block {} is not a frame bus".format(shm.name))
+        self.slots = int(self.control["slots"][0])
+        self.frame_shape = tuple(int(self.control[key][0]) for key in ("height", "width", "channels"))
+        self.meta_size = int(self.control["meta_size"][0])
+        self.frame_size = int(np.prod(self.frame_shape))
+        self.slot_size = SLOT_DTYPE.itemsize + self.meta_size + self.frame_size
+
+    @classmethod
+    def required_size(cls, slots: int, frame_shape: Tuple[int, int, int], meta_size: int) -> int:
+        return CONTROL_DTYPE.itemsize + slots * (SLOT_DTYPE.itemsize + meta_size + int(np.prod(frame_shape)))
+
+    @classmethod
+    def create(cls, name: str, slots: int = 4, max_resolution: Tuple[int, int] = (1920, 1080),
+               channels: int = 3, meta_size: int = 8192) -> 'FrameBus':
+        """Create the shared memory block, replacing a stale one left behind by a crashed process
+
+        Arguments:
+            name {str} -- System wide name of the block
+
+        Keyword Arguments:
+            slots {int} -- The number of frames in the ring (default: {4})
+            max_resolution {Tuple[int, int]} -- (width, height) capacity, larger frames are downscaled
+            channels {int} -- Colour channels of the frames (default: {3})
+            meta_size {int} -- Capacity of the JSON metadata of a frame in bytes (default: {8192})
+        """
+        frame_shape = (max_resolution[1], max_resolution[0], channels)
+        size = cls.required_size(slots, frame_shape, meta_size)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        control = np.ndarray((1,), dtype=CONTROL_DTYPE, buffer=shm.buf)
+        control[0] = (MAGIC, slots, frame_shape[0], frame_shape[1], frame_shape[2], meta_size, 0, time.time())
+        del control
+        bus = cls(shm, owner=True)
+        for slot in range(slots):
+            bus._slot_header(slot)["sequence"] = 0
+        return bus
+
+    @classmethod
+    def attach(cls, name: str) -> 'FrameBus':
+        """Attach to a frame bus created by another process
+
+        Arguments:
+            name {str} -- System wide name of the block
+        """
+        # only the creator may unlink the block, so readers must not register it with the resource tracker,
+        # otherwise the block is removed when a reader exits, see https://bugs.python.org/issue39959
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13 has no track parameter
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args, **kwargs: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm, owner=False)
+
+    @property
+    def created(self) -> float:
+        return float(self.control["created"][0])
+
+    @property
+    def latest_sequence(self) -> int:
+        return int(self.control["latest"][0])
+
+    def _slot_offset(self, slot: int) -> int:
+        return CONTROL_DTYPE.itemsize + slot * self.slot_size
+
+    def _slot_header(self, slot: int):
+        return np.ndarray((1,), dtype=SLOT_DTYPE, buffer=self.shm.buf, offset=self._slot_offset(slot))
+
+    def write(self, frame, meta: Dict = None) -> int:
+        """Put a new frame into the ring
+
+        Arguments:
+            frame -- Image (numpy, uint8)
+
+        Keyword Arguments:
+            meta {Dict} -- JSON serializable metadata, e.g. the detections (default: {None})
+
+        Returns:
+            int -- The sequence number of the frame
+        """
+        height, width = frame.shape[:2]
+        if height > self.frame_shape[0] or width > self.frame_shape[1]:
+            scale = min(self.frame_shape[0] / height, self.frame_shape[1] / width)
+            frame = cv2.resize(frame, (int(width * scale), int(height * scale)))
+        frame = np.ascontiguousarray(frame, dtype=np.uint8).reshape(frame.shape[0], frame.shape[1], -1)
+        meta_bytes = json.dumps(meta or {}, separators=(',', ':'), default=_json_default).encode()
+        if len(meta_bytes) > self.meta_size:
+            raise ValueError("Frame metadata is larger than {} bytes".format(self.meta_size))
+
+        sequence = self.latest_sequence + 1
+        slot = sequence % self.slots
+        header = self._slot_header(slot)
+        header["sequence"] = WRITING
+        offset = self._slot_offset(slot) + SLOT_DTYPE.itemsize
+        self.shm.buf[offset:offset + len(meta_bytes)] = meta_bytes
+        offset += self.meta_size
+        self.shm.buf[offset:offset + frame.nbytes] = frame.reshape(-1).data
+        header[0] = (WRITING, time.time(), frame.shape[0], frame.shape[1], frame.shape[2], len(meta_bytes))
+        header["sequence"] = sequence
+        self.control["latest"] = sequence
+        return sequence
+
+    def read(self, sequence: int = None) -> Tuple[int, float, np.ndarray, Dict]:
+        """Get a frame without copying it
+
+        Keyword Arguments:
+            sequence {int} -- The sequence number to read, the latest frame if None (default: {None})
+
+        Returns:
+            Tuple[int, float, np.ndarray, Dict] -- Sequence number, timestamp, frame view and metadata,
+                or None if the frame was already overwritten. The view is only valid while still_valid() is True
+        """
+        if sequence is None:
+            sequence = self.latest_sequence
+        if sequence <= 0:
+            return None
+        slot = sequence % self.slots
+        header = self._slot_header(slot)[0]
+        if int(header["sequence"]) != sequence:
+            return None
+        offset = self._slot_offset(slot) + SLOT_DTYPE.itemsize
+        meta = json.loads(bytes(self.shm.buf[offset:offset + int(header["meta_length"])]) or b"{}")
+        shape = (int(header["height"]), int(header["width"]), int(header["channels"]))
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset + self.meta_size)
+        timestamp = float(header["timestamp"])
+        if not self.still_valid(sequence):
+            return None
+        return sequence, timestamp, frame, meta
+
+    def still_valid(self, sequence: int) -> bool:
+        """Check whether the frame with the given sequence number is still in the ring, unmodified"""
+        return int(self._slot_header(sequence % self.slots)["sequence"][0]) == sequence
+
+    def wait_for(self, last_sequence: int, timeout: float, poll_interval: float = 0.01) -> bool:
+        """Block until a frame newer than last_sequence is written, by polling the control block
+
+        Returns:
+            bool -- False if the timeout expired without a new frame
+        """
+        deadline = time.monotonic() + timeout
+        while self.latest_sequence == last_sequence:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def close(self):
+        """Detach from the block, the creator also removes it"""
+        self.control = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
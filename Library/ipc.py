@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection
+from typing import Dict, List, Tuple, Callable
+
+from Library.Handler import Handler
+from Library.errors import InvalidUsage
+from Library.broadcast import Broadcaster, tracking_snapshot
+from Library.metrics import MetricFamily, database_metric_families
+
+
+class WorkerUnavailable(Exception):
+    """Raised when the recognition worker process can't be reached"""
+
+
+def ipc_authkey(config) -> bytes:
+    """The shared secret of the worker and the web processes, IPC_AUTHKEY or the RECOGNEYEZ_IPC_KEY variable
+
+    Arguments:
+        config {Dict} -- The Flask config of the app
+
+    Returns:
+        bytes -- The key
+    """
+    key = config.get("IPC_AUTHKEY") or os.environ.get("RECOGNEYEZ_IPC_KEY")
+    if not key:
+        raise RuntimeError("Set IPC_AUTHKEY or the RECOGNEYEZ_IPC_KEY environment variable")
+    return key.encode() if isinstance(key, str) else key
+
+
+class WorkerServer:
+    """Serves the commands of the web processes inside the recognition worker process
+
+    Every request is a (command, args) tuple, every reply an (ok, result) tuple.
+    The subscribe command turns the connection into a one way channel of server-sent event messages.
+    """
+
+    def __init__(self, app, address: Tuple[str, int], authkey: bytes):
+        self.app = app
+        self.listener = Listener(address, authkey=authkey)
+        self.commands: Dict[str, Callable] = {
+            "status": self.status,
+            "start_camera": app.ch.camera_start_processing,
+            "stop_camera": app.ch.camera_stop_processing,
+            "restart_camera": self.restart_camera,
+            "force_rescan": app.ch.force_rescan,
+            "available_cameras": app.ch.available_cameras,
+            "dedup_images": app.fh.dedup_stored_images,
+            "frame_timings": app.fh.frame_timings,
+            "reset_frame_timings": app.fh.reset_frame_timings,
+            "metric_families": app.fh.metric_families,
+            "profile": app.ch.profile,
+        }
+        logging.info("Recognition worker listening on {}".format(address))
+
+    def status(self) -> Dict:
+        return {
+            "cam_is_running": self.app.ch.cam_is_running,
+            "cam_is_processing": self.app.ch.cam_is_processing,
+            "running_since": self.app.fh.running_since,
+            "tracking": self.app.fh.tracking_snapshot()
+        }
+
+    def restart_camera(self):
+        # the settings were changed by the web process
+        self.app.sh.reload()
+        self.app.ch.restart_cam()
+
+    def serve_forever(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                # failed authentication or a client that went away during the handshake
+                logging.error("IPC connection refused: {}".format(e))
+                continue
+            threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+
+    def handle(self, connection: Connection):
+        try:
+            while True:
+                command, args = connection.recv()
+                if command == "subscribe":
+                    connection.send((True, None))
+                    self.forward_events(connection)
+                    return
+                try:
+                    connection.send((True, self.commands[command](*args)))
+                except Exception as e:
+                    logging.exception("IPC command {} failed".format(command))
+                    connection.send((False, getattr(e, "message", str(e))))
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def forward_events(self, connection: Connection):
+        subscription = self.app.eb.subscribe()
+        if subscription is None:
+            return
+        try:
+            for message in self.app.eb.stream(subscription):
+                connection.send_bytes(message)
+        finally:
+            self.app.eb.unsubscribe(subscription)
+
+
+class WorkerClient:
+    """Talks to the recognition worker process from a web process, with one connection per thread"""
+    # seconds to wait between attempts to reconnect the event subscription
+    max_backoff_seconds = 10.0
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self) -> Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = Client(self.address, authkey=self.authkey)
+            except (OSError, AuthenticationError) as e:
+                raise WorkerUnavailable("The recognition worker is not running: {}".format(e))
+            self._local.connection = connection
+        return connection
+
+    def call(self, command: str, *args):
+        """Execute a command in the worker process
+
+        Arguments:
+            command {str} -- The name of the command
+
+        Raises:
+            WorkerUnavailable: The worker can't be reached
+            RuntimeError: The command failed in the worker
+
+        Returns:
+            The result of the command
+        """
+        connection = self._connection()
+        try:
+            connection.send((command, args))
+            ok, result = connection.recv()
+        except (EOFError, OSError) as e:
+            # the worker was restarted, the next call connects again
+            self._local.connection = None
+            raise WorkerUnavailable("Lost the connection to the recognition worker: {}".format(e))
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    def forward_events(self, broadcaster: Broadcaster):
+        """Re-publish the events of the worker on a local broadcaster, reconnecting on a background thread"""
+        threading.Thread(target=self._forward_events, args=(broadcaster,), name="ipc-events", daemon=True).start()
+
+    def _forward_events(self, broadcaster: Broadcaster):
+        backoff = 0.5
+        while True:
+            try:
+                connection = Client(self.address, authkey=self.authkey)
+                connection.send(("subscribe", ()))
+                connection.recv()
+                backoff = 0.5
+                while True:
+                    broadcaster.publish_message(connection.recv_bytes())
+            except (EOFError, OSError, AuthenticationError):
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff_seconds)
+
+
+class RemoteCameraHandler(Handler):
+    """Stands in for the CameraHandler in the web processes, forwarding everything to the worker"""
+    # seconds the status of the worker is cached for
+    status_ttl = 1.0
+
+    def __init__(self, app, client: WorkerClient):
+        super().__init__(app)
+        self.client = client
+        self._status: Dict = dict()
+        self._status_time = 0.0
+
+    def status(self) -> Dict:
+        if time.monotonic() - self._status_time > self.status_ttl:
+            try:
+                self._status = self.client.call("status")
+            except WorkerUnavailable as e:
+                logging.error(e)
+                self._status = dict()
+            self._status_time = time.monotonic()
+        return self._status
+
+    @property
+    def cam_is_running(self) -> bool:
+        return self.status().get("cam_is_running", False)
+
+    @property
+    def cam_is_processing(self) -> bool:
+        return self.status().get("cam_is_processing", False)
+
+    def _call(self, command: str, *args):
+        self._status_time = 0.0
+        try:
+            return self.client.call(command, *args)
+        except WorkerUnavailable as e:
+            logging.error(e)
+            return None
+
+    def camera_start_processing(self):
+        self._call("start_camera")
+
+    def camera_stop_processing(self):
+        self._call("stop_camera")
+
+    def restart_cam(self):
+        self._call("restart_camera")
+
+    def force_rescan(self):
+        self._call("force_rescan")
+
+    def available_cameras(self) -> int:
+        return self._call("available_cameras") or 0
+
+    def profile(self, seconds: float, mode: str = "sample", interval: float = 0.005):
+        """Profile the camera loop of the worker, see CameraHandler.profile"""
+        try:
+            return self.client.call("profile", seconds, mode, interval)
+        except (WorkerUnavailable, RuntimeError) as e:
+            raise InvalidUsage(str(e), status_code=409)
+
+
+class RemoteFaceHandler(Handler):
+    """Stands in for the FaceHandler in the web processes, the data comes from the worker"""
+
+    def __init__(self, app, client: WorkerClient):
+        super().__init__(app)
+        self.client = client
+        self.started = datetime.now()
+
+    @property
+    def running_since(self) -> datetime:
+        return self.app.ch.status().get("running_since") or self.started
+
+    def tracking_snapshot(self) -> Dict:
+        return self.app.ch.status().get("tracking") or tracking_snapshot([])
+
+    def dedup_stored_images(self) -> Dict:
+        return self.client.call("dedup_images")
+
+    def frame_timings(self) -> Dict:
+        return self.client.call("frame_timings")
+
+    def reset_frame_timings(self):
+        self.client.call("reset_frame_timings")
+
+    def metric_families(self) -> List[MetricFamily]:
+        """The metrics of the worker, along with the database metrics of this web process"""
+        try:
+            families = self.client.call("metric_families")
+            up = 1
+        except WorkerUnavailable as e:
+            logging.error(e)
+            families = []
+            up = 0
+        families.append(("recogneyez_worker_up", "gauge", "Whether the recognition worker could be reached",
+                         [("", {}, up)]))
+        return families + database_metric_families(self.app.dh.database, self.app.config.get("PROCESS_ROLE", "web"))
@@ -0,0 +1,341 @@
+import bisect
+import math
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from peewee import SqliteDatabase
+
+# name, type, help and the samples (name suffix, labels, value) of a metric, the way Prometheus groups them
+MetricFamily = Tuple[str, str, str, List[Tuple[str, Dict[str, str], float]]]
+
+
+def _bucket_bounds(smallest: float, largest: float, factor: float) -> List[float]:
+    bounds = []
+    bound = smallest
+    while bound < largest:
+        bounds.append(bound)
+        bound *= factor
+    bounds.append(largest)
+    return bounds
+
+
+class LatencyHistogram:
+    """Latencies counted in fixed, exponentially growing buckets
+
+    Recording is a bisect and a few integer increments, without allocations, so it can be done for every stage of
+    every frame. Percentiles are estimated from the buckets, they're accurate to the bucket width (about 20%).
+    The histogram is written by a single thread, readers may see a value that is one record behind.
+    """
+    # upper bounds in seconds, from 50 us to 10 s, every bucket is 20% wider than the previous one
+    bounds = _bucket_bounds(0.00005, 10.0, 1.2)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        """Count a latency
+
+        Arguments:
+            seconds {float} -- The latency in seconds
+        """
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Estimate a percentile of the recorded latencies
+
+        Arguments:
+            fraction {float} -- The percentile between 0 and 1, e.g. 0.95
+
+        Returns:
+            float -- The upper bound of the bucket of the percentile in seconds, 0 if nothing was recorded
+        """
+        counts = list(self.counts)
+        target = math.ceil(sum(counts) * fraction)
+        if target == 0:
+            return 0.0
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+
+    def merge(self, other: 'LatencyHistogram'):
+        """Add the latencies recorded by another histogram to this one"""
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self) -> Dict:
+        """The count and the p50/p95/p99/max/mean latencies in milliseconds"""
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(0.5) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max * 1000,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0
+        }
+
+
+class StageTimer:
+    """The latency histograms of the stages of the frame processing of one camera
+
+    Usage, in the thread processing the frames:
+        lap = timer.start()
+        ... capture ...
+        lap = timer.lap("capture", lap)
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = dict()
+
+    @staticmethod
+    def start() -> float:
+        return time.perf_counter()
+
+    def lap(self, stage: str, since: float) -> float:
+        """Record the time spent in a stage
+
+        Arguments:
+            stage {str} -- The name of the stage
+            since {float} -- When the stage started, from start() or the previous lap()
+
+        Returns:
+            float -- The current time, the start of the next stage
+        """
+        now = time.perf_counter()
+        self.record(stage, now - since)
+        return now
+
+    def record(self, stage: str, seconds: float):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        histogram.record(seconds)
+
+    def summary(self) -> Dict[str, Dict]:
+        return {stage: histogram.summary() for stage, histogram in list(self.histograms.items())}
+
+
+class StageTimers:
+    """The stage timers of every camera (camera preset) the frames were processed from"""
+
+    def __init__(self):
+        self._timers: Dict[str, StageTimer] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, camera: str) -> StageTimer:
+        """Get the stage timer of a camera, creating it on first use
+
+        Arguments:
+            camera {str} -- The name of the camera preset
+
+        Returns:
+            StageTimer -- The timer
+        """
+        timer = self._timers.get(camera)
+        if timer is None:
+            with self._lock:
+                timer = self._timers.setdefault(camera, StageTimer())
+        return timer
+
+    def histograms(self) -> List[Tuple[str, str, LatencyHistogram]]:
+        """The camera, the stage and the histogram of every recorded stage"""
+        return [(camera, stage, histogram) for camera, timer in list(self._timers.items())
+                for stage, histogram in list(timer.histograms.items())]
+
+    def reset(self):
+        """Forget the recorded latencies, e.g. after an upgrade"""
+        with self._lock:
+            self._timers = dict()
+
+    def summary(self) -> Dict[str, Dict[str, Dict]]:
+        """The latency percentiles of every stage of every camera
+
+        Returns:
+            Dict[str, Dict[str, Dict]] -- Camera -> stage -> count, p50/p95/p99/max/mean in milliseconds
+        """
+        return {camera: timer.summary() for camera, timer in list(self._timers.items())}
+
+
+class Counters:
+    """Monotonic counters, sharded per thread so that counting needs no lock
+
+    Every thread increments the counters in its own dictionary, only the totals read by a scrape add them up.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[Dict[str, int]] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[str, int]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = dict()
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def inc(self, name: str, amount: int = 1):
+        """Increment a counter
+
+        Arguments:
+            name {str} -- The name of the counter
+
+        Keyword Arguments:
+            amount {int} -- The increment (default: {1})
+        """
+        shard = self._shard()
+        shard[name] = shard.get(name, 0) + amount
+
+    def values(self) -> Dict[str, int]:
+        """The totals of every counter, the counts of the finished threads included"""
+        with self._lock:
+            shards = list(self._shards)
+        totals = dict()
+        for shard in shards:
+            # copying a dictionary is atomic, the owner thread may keep counting meanwhile
+            for name, value in dict(shard).items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+class ShardedHistogram:
+    """A LatencyHistogram that many threads can record to, every thread has its own shard"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[LatencyHistogram] = []
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        histogram = getattr(self._local, "histogram", None)
+        if histogram is None:
+            histogram = LatencyHistogram()
+            with self._lock:
+                self._shards.append(histogram)
+            self._local.histogram = histogram
+        histogram.record(seconds)
+
+    def merged(self) -> LatencyHistogram:
+        """All the recorded latencies in a single histogram"""
+        with self._lock:
+            shards = list(self._shards)
+        histogram = LatencyHistogram()
+        for shard in shards:
+            histogram.merge(shard)
+        return histogram
+
+
+class TimedSqliteDatabase(SqliteDatabase):
+    """SqliteDatabase that counts the executed statements and records their execution time per statement kind
+    Fetching the rows of a SELECT after the execution is not included
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # SELECT, INSERT, UPDATE, ... -> histogram
+        self.query_latency: Dict[str, ShardedHistogram] = dict()
+
+    def execute_sql(self, sql, params=None):
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params)
+        finally:
+            kind = sql.split(None, 1)[0].upper() if sql else "OTHER"
+            histogram = self.query_latency.get(kind)
+            if histogram is None:
+                histogram = self.query_latency.setdefault(kind, ShardedHistogram())
+            histogram.record(time.perf_counter() - start)
+
+
+# every n-th bucket bound of LatencyHistogram is exported, doubling from one to the next
+# the bounds are the same on every node, so the buckets can be summed up across nodes and over time windows
+exported_bucket_step = 4
+
+
+def histogram_samples(histogram: LatencyHistogram, labels: Dict[str, str]) -> List[Tuple[str, Dict[str, str], float]]:
+    """The samples of a Prometheus histogram, the cumulative bucket counts with the sum and the count
+
+    Arguments:
+        histogram {LatencyHistogram} -- The latencies
+        labels {Dict[str, str]} -- The labels of the samples, the le label of the buckets is added
+
+    Returns:
+        List[Tuple[str, Dict[str, str], float]] -- The _bucket, _sum and _count samples
+    """
+    counts = list(histogram.counts)
+    bounds = histogram.bounds
+    samples = []
+    cumulative = 0
+    for index, bound in enumerate(bounds):
+        cumulative += counts[index]
+        if index % exported_bucket_step == exported_bucket_step - 1 or index == len(bounds) - 1:
+            samples.append(("_bucket", dict(labels, le="{:.6g}".format(bound)), cumulative))
+    total = sum(counts)
+    samples.append(("_bucket", dict(labels, le="+Inf"), total))
+    samples.append(("_sum", labels, histogram.total))
+    samples.append(("_count", labels, total))
+    return samples
+
+
+def database_metric_families(database: TimedSqliteDatabase, process: str) -> List[MetricFamily]:
+    """The query metrics of the database connection of a process
+
+    Arguments:
+        database {TimedSqliteDatabase} -- The database
+        process {str} -- The role of the process, the value of the process label
+
+    Returns:
+        List[MetricFamily] -- The metric families
+    """
+    samples = []
+    for kind, histogram in sorted(database.query_latency.items()):
+        samples.extend(histogram_samples(histogram.merged(), {"process": process, "kind": kind}))
+    return [("recogneyez_db_query_seconds", "histogram", "Execution time of the database statements", samples)]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_prometheus(families: List[MetricFamily]) -> str:
+    """Render metric families in the Prometheus text exposition format
+    Families of the same name, e.g. from different processes, are rendered as one
+
+    Arguments:
+        families {List[MetricFamily]} -- The metric families
+
+    Returns:
+        str -- The text of the /metrics endpoint
+    """
+    merged: Dict[str, MetricFamily] = dict()
+    for name, kind, help_text, samples in families:
+        if name in merged:
+            merged[name][3].extend(samples)
+        else:
+            merged[name] = (name, kind, help_text, list(samples))
+    lines = []
+    for name, kind, help_text, samples in merged.values():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for suffix, labels, value in samples:
+            if labels:
+                label_text = ",".join('{}="{}"'.format(key, _escape(label)) for key, label in labels.items())
+                lines.append("{}{}{{{}}} {}".format(name, suffix, label_text, repr(float(value))))
+            else:
+                lines.append("{}{} {}".format(name, suffix, repr(float(value))))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+import cv2
+
+HASH_MASK = (1 << 64) - 1
+
+
+def dhash(image, hash_size: int = 8) -> int:
+    """Calculate the difference hash of an image
+    Similar looking images have hashes with a small Hamming distance between them
+
+    Arguments:
+        image -- BGR or grayscale image (numpy)
+
+    Keyword Arguments:
+        hash_size {int} -- The hash has hash_size * hash_size bits (default: {8})
+
+    Returns:
+        int -- The hash as a signed 64 bit integer, so it can be stored in an SQLite INTEGER column
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    value = 0
+    for bit in (resized[:, 1:] > resized[:, :-1]).flatten():
+        value = (value << 1) | int(bit)
+    # map to the signed range of a 64 bit integer
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """Count the differing bits of two hashes
+
+    Arguments:
+        a {int} -- First hash
+        b {int} -- Second hash
+
+    Returns:
+        int -- The Hamming distance
+    """
+    return bin((a ^ b) & HASH_MASK).count("1")
+
+
+def is_near_duplicate(value: int, hashes, max_distance: int) -> bool:
+    """Check whether a hash is within max_distance of any of the given hashes
+
+    Arguments:
+        value {int} -- The hash to check
+        hashes -- Iterable of hashes to compare against
+        max_distance {int} -- The largest Hamming distance still considered a duplicate
+
+    Returns:
+        bool -- True if a near duplicate was found
+    """
+    return any(hamming(value, other) <= max_distance for other in hashes if other is not None)
@@ -0,0 +1,114 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return "{}:{}".format(os.path.basename(code.co_filename), code.co_name)
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    """Sample the call stack of a running thread, without changing or slowing down the thread itself
+
+    The sampling thread only holds the GIL while it walks the stack, every interval seconds.
+
+    Arguments:
+        thread_id {int} -- The ident of the sampled thread
+        seconds {float} -- How long to sample
+
+    Keyword Arguments:
+        interval {float} -- The time between two samples in seconds (default: {0.005})
+
+    Returns:
+        str -- The stacks in the collapsed format of flamegraph.pl and speedscope, one "root;...;leaf count" per line
+    """
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            # the thread has finished
+            break
+        names = []
+        while frame is not None:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        stacks[";".join(reversed(names))] += 1
+        del frame
+        time.sleep(interval)
+    return "".join("{} {}\n".format(stack, count) for stack, count in stacks.most_common())
+
+
+class ThreadProfile:
+    """A time boxed cProfile of a loop running on another thread
+
+    cProfile can only profile the thread that enables it, so the profiled loop calls tick() on every iteration,
+    the first call starts the profiler on that thread and the first call after the time is up, or after stop(),
+    stops it.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.profile: cProfile.Profile = None
+        self.deadline = None
+        self.stopping = False
+        self.done = threading.Event()
+
+    def tick(self):
+        """Called by the profiled thread on every iteration of its loop"""
+        if self.done.is_set():
+            return
+        if self.stopping:
+            self.finish()
+            return
+        now = time.monotonic()
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.deadline = now + self.seconds
+            self.profile.enable()
+        elif now >= self.deadline:
+            self.finish()
+
+    def stop(self):
+        """Ask the profiled thread to stop the profiler on its next tick, e.g. when nobody waits for the result"""
+        self.stopping = True
+
+    def finish(self):
+        """Stop the profiler, has to be called by the profiled thread"""
+        if self.profile is not None and not self.done.is_set():
+            self.profile.disable()
+        self.done.set()
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until the profile is finished
+
+        Arguments:
+            timeout {float} -- The maximum time to wait in seconds
+
+        Returns:
+            bool -- Whether the profile has finished and has data
+        """
+        return self.done.wait(timeout) and self.profile is not None
+
+    def pstats_dump(self) -> bytes:
+        """The profile in the format of pstats.Stats.dump_stats, can be opened with pstats, snakeviz, etc."""
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+    def text(self, sort: str = "cumulative", limit: int = 60) -> str:
+        """The most expensive functions of the profile as a text report
+
+        Keyword Arguments:
+            sort {str} -- The pstats sort key (default: {"cumulative"})
+            limit {int} -- The number of functions to list (default: {60})
+        """
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
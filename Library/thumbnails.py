@@ -0,0 +1,128 @@
+"""Small, fixed size copies of the face pictures for the person cards and the picture panels
+
+The file name of a thumbnail contains a hash of the picture's pixels, so a thumbnail never changes
+under its name and the browsers can cache it forever.
+
+Thumbnails of the pictures taken before they were generated automatically can be created with
+    python -m Library.thumbnails [database file]
+"""
+import hashlib
+import logging
+import os
+import sys
+import types
+from pathlib import Path
+from typing import Dict
+
+import cv2
+from flask import url_for
+
+thumbnail_folder_path = Path("Static", "Images", "thumbs")
+# the longer side of a thumbnail in pixels
+thumbnail_size = 160
+
+
+def thumbnail_name(image_name: str, image) -> str:
+    """Get the content addressed file name of the thumbnail of a picture
+
+    Arguments:
+        image_name {str} -- The file name of the picture
+        image -- The picture (numpy array)
+
+    Returns:
+        str -- The file name of the thumbnail
+    """
+    digest = hashlib.blake2b(image.tobytes(), digest_size=8).hexdigest()
+    return "{}_{}.jpg".format(os.path.splitext(image_name)[0], digest)
+
+
+def make_thumbnail(image, size: int = thumbnail_size):
+    """Downscale a picture so that its longer side is at most size pixels
+
+    Arguments:
+        image -- The picture (numpy array)
+
+    Keyword Arguments:
+        size {int} -- The maximum length of the longer side (default: {thumbnail_size})
+
+    Returns:
+        The thumbnail, or the picture itself if it's small enough
+    """
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def write_thumbnail(name: str, image, quality: int = 85) -> bool:
+    """Create the thumbnail of a picture in the thumbnail folder
+
+    Arguments:
+        name {str} -- The file name of the thumbnail, see thumbnail_name
+        image -- The full size picture (numpy array)
+
+    Keyword Arguments:
+        quality {int} -- JPEG quality (default: {85})
+
+    Returns:
+        bool -- Whether the thumbnail was written
+    """
+    os.makedirs(str(thumbnail_folder_path), exist_ok=True)
+    return cv2.imwrite(str(thumbnail_folder_path.joinpath(name)), make_thumbnail(image),
+                       [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+
+def thumbnail_url(image) -> str:
+    """Get the URL of the thumbnail of an image, used by the templates
+
+    Arguments:
+        image {Image} -- The image, may be None
+
+    Returns:
+        str -- The URL of the thumbnail, the full size picture if it has no thumbnail yet
+            or the empty picture if there is no image
+    """
+    if image is None:
+        return url_for('static', filename='empty_pic.png')
+    if image.thumb:
+        return url_for('actions.thumbnail', name=image.thumb)
+    return url_for('static', filename='Images/' + image.name)
+
+
+def backfill_thumbnails(dh, picture_folder_path=Path("Static", "Images")) -> Dict:
+    """Create the missing thumbnails of the stored pictures
+
+    Arguments:
+        dh {DatabaseHandler} -- The database of the pictures
+
+    Keyword Arguments:
+        picture_folder_path {Path} -- The folder of the full size pictures (default: {Path("Static", "Images")})
+
+    Returns:
+        Dict -- The number of created thumbnails and of the pictures that could not be read
+    """
+    from Library.DatabaseHandler import Image
+
+    report = {"created": 0, "missing": 0}
+    for image in Image.select().where(Image.thumb.is_null()).iterator():
+        picture = cv2.imread(str(Path(picture_folder_path).joinpath(image.name)))
+        if picture is None:
+            report["missing"] += 1
+            continue
+        name = thumbnail_name(image.name, picture)
+        if write_thumbnail(name, picture):
+            Image.update(thumb=name).where(Image.id == image.id).execute()
+            report["created"] += 1
+    dh.invalidate()
+    logging.info("Thumbnail backfill: {}".format(report))
+    return report
+
+
+if __name__ == '__main__':
+    from Library.DatabaseHandler import DatabaseHandler
+
+    logging.basicConfig(level=logging.INFO)
+    handler = DatabaseHandler(types.SimpleNamespace(config=dict()), sys.argv[1] if len(sys.argv) > 1 else "recogneyez.db")
+    print(backfill_thumbnails(handler))
+    handler.writer.stop()
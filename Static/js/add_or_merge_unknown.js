@@ -8,18 +8,41 @@ $(function() {
   });
   $(".dialog-overlay").click(function(e) {
     if ($(e.target).hasClass("dialog-overlay")) {
-      $("#merge-options").remove();
+      $("#merge-options").empty();
       $(this).hide();
     }
   });
   $("#cancel-add-small").click(function(e) {
-    $("#merge-options").remove();
+    $("#merge-options").empty();
     $(".dialog-overlay").hide();
   });
+  // the merge targets are searched on the server, the page doesn't list every person
+  let search_timer = null;
+  $("#merge-search").on("input", function() {
+    clearTimeout(search_timer);
+    search_timer = setTimeout(() => {
+      load_merge_options($("#selected-add-or-merge-name").text(), $("#merge-search").val());
+    }, 250);
+  });
 });
 
 $(function close_overlay(e) {});
 
+$(function() {
+  // the other pictures of an unknown are only loaded when the tooltip is first shown
+  $(".unknown-person-wrapper .tooltip").one("mouseenter", function() {
+    let wrapper = $(".tooltip-image-wrapper", this);
+    $.getJSON($SCRIPT_ROOT + "/_person_images", { n: wrapper.data("person") }, function(response) {
+      response.images.forEach(function(image, index) {
+        if (image != wrapper.data("thumbnail")) {
+          let img = $("<img class='w-100'>").attr("src", response.thumbnails[index]);
+          wrapper.append($("<div class='col-3 tooltip-image rounded'>").append(img));
+        }
+      });
+    });
+  });
+});
+
 $(function() {
   // cancel change
   $("#add-or-merge-dialog .cancel-add-or-merge").each(function(index) {
@@ -36,6 +59,7 @@ $(function() {
     $(this).bind("click", function() {
       name = $("#selected-add-or-merge-name").text();
       merge_to = $("#merge-options").val();
+      if (!merge_to) return false;
       send_to_merge(name, merge_to);
       setTimeout(() => {
         document.location.reload();
@@ -61,27 +85,25 @@ $(function() {
 
 function add_or_merge_dialog(name) {
   $("#selected-add-or-merge-name").text(name);
-
-  if ($("#merge-options-copy").length > 0) {
-    let new_select = $("#merge-options-copy")
-      .clone()
-      .attr("id", "merge-options")
-      .removeClass("d-none")[0];
-  
-    let ind = Array.prototype.findIndex.call(
-      new_select.options,
-      option => option.value == name
-    );
-  
-    if (ind > -1) new_select.options[ind].remove();
-    $(new_select).insertAfter("#merge-options-copy");
-  }
-
+  $("#merge-search").val("");
+  load_merge_options(name, "");
 
   $("#add-or-merge-dialog").show();
   $("#add-or-merge-dialog").css("display", "flex");
 }
 
+function load_merge_options(name, search) {
+  $.getJSON($SCRIPT_ROOT + "/_search_persons", { q: search, exclude: name }, function(response) {
+    if (name != $("#selected-add-or-merge-name").text()) return;
+    let select = $("#merge-options").empty();
+    response.names.forEach(function(option) {
+      select.append($("<option>").val(option).text(option));
+    });
+    // without a search, no names means there is nobody else to merge with
+    if (!search) $("#merge-section").toggleClass("d-none", response.names.length == 0);
+  });
+}
+
 function send_to_merge(name, merge_to) {
   $.getJSON($SCRIPT_ROOT + "/_merge_with", {
     n: name,
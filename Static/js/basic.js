@@ -1,4 +1,42 @@
 var preview_interval = null;
+var preview_etag = null;
+
+// poll the still preview, the browser revalidates it with its ETag, so an unchanged frame is not downloaded again
+function poll_preview(img) {
+    fetch("/preview", {cache: "no-cache", credentials: "same-origin"}).then(function (response) {
+        let etag = response.headers.get("ETag");
+        if (!response.ok || etag === preview_etag) {
+            return;
+        }
+        preview_etag = etag;
+        return response.blob().then(function (blob) {
+            let old_src = img.attr("src");
+            img.attr("src", URL.createObjectURL(blob));
+            if (old_src && old_src.startsWith("blob:")) {
+                URL.revokeObjectURL(old_src);
+            }
+        });
+    });
+}
+
+// show the MJPEG stream, falling back to polling the still preview if the stream is not available
+function start_preview() {
+    let img = $(".card-img-top");
+    img.one("error", function () {
+        preview_interval = setInterval(function(){
+            poll_preview(img);
+        }, 1000);
+    });
+    img.attr("src", "/stream");
+}
+
+function stop_preview() {
+    clearInterval(preview_interval);
+    preview_etag = null;
+    // removing the image closes the stream connection
+    $('.card-img-top').remove();
+}
+
 $(document).ready(function () {
     $('.start-camera-action').click(function (e) { 
         e.preventDefault();
@@ -9,11 +47,8 @@ $(document).ready(function () {
                 let parent = $('.camera-status').parent('p');
                 $('.camera-status').remove();
                 parent.append("<b class='camera-status' style='color:lightgreen;'>RUNNING</b>");
-                preview_interval = setInterval(function(){
-                    d = new Date();
-                    $(".card-img-top").attr("src", "/preview?"+d.getTime());
-                }, 1000);
-                $('.preview').append("<img class='card-img-top' src='/preview'>");
+                $('.preview').append("<img class='card-img-top'>");
+                start_preview();
             }
         });
     });
@@ -26,8 +61,7 @@ $(document).ready(function () {
                 let parent = $('.camera-status').parent('p');
                 $('.camera-status').remove();
                 parent.append("<b class='camera-status' style='color:red;'>NOT RUNNING</b>");
-                clearInterval(preview_interval);
-                $('.card-img-top').remove();
+                stop_preview();
             }
         });
     });
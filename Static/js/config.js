@@ -43,16 +43,15 @@ $(document).ready(function() {
     });
   });
 
+  function enable_source_inputs(target, enabled) {
+    target.prop("disabled", !enabled);
+    target.closest(".form-group").toggleClass("disabled", !enabled);
+  }
+
   $(".preferred-id-select").change(function(e) {
-    let target = $("#url-" + e.target.options[e.target.options.length - 1].id);
-    if (e.target.value == -1) {
-      target.prop("disabled", false);
-      target.parent().parent().removeClass("disabled");
-    }
-    else {
-      target.prop("disabled", true);
-      target.parent().parent().addClass("disabled");
-    }
+    let index = e.target.id.replace("preferred-id-", "");
+    enable_source_inputs($("#url-ipcam-" + index), e.target.value == -1);
+    enable_source_inputs($(".replay-input-" + index), e.target.value == -2);
   });
 
   $(".delete-setting").click(function(e) {
@@ -0,0 +1,97 @@
+"""Mixed read/write load on the database, like the camera thread writing while the web UI reads
+
+A writer thread adds images and events in small transactions, the way the camera loop does, while reader threads
+run the uncached queries of the request handlers. Reports the write throughput and the read latencies.
+
+    python benchmarks/db_concurrency.py
+    python benchmarks/db_concurrency.py --journal-mode delete   # the settings before WAL, for comparison
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from Library.DatabaseHandler import DatabaseHandler, Image, Person  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--persons", type=int, default=50)
+    parser.add_argument("--journal-mode", default="wal", choices=["wal", "delete"])
+    args = parser.parse_args()
+
+    class BenchmarkDatabaseHandler(DatabaseHandler):
+        if args.journal_mode == "wal":
+            pragmas = DatabaseHandler.pragmas
+        else:
+            pragmas = (('foreign_keys', 'on'), ('journal_mode', 'delete'))
+
+    folder = tempfile.mkdtemp()
+    dh = BenchmarkDatabaseHandler(types.SimpleNamespace(), os.path.join(folder, "benchmark.db"))
+    persons = [dh.add_person("person_{}".format(i)) for i in range(args.persons)]
+
+    stop = threading.Event()
+    writes = []
+    read_times = []
+    errors = []
+
+    def writer():
+        count = 0
+        while not stop.is_set():
+            person = persons[count % len(persons)]
+            start = time.perf_counter()
+            person.add_image("image_{}.jpg".format(count))
+            dh.log_event("event {}".format(count))
+            writes.append(time.perf_counter() - start)
+            count += 1
+
+    def reader():
+        times = []
+        count = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                person = dh.get_person_by_name("person_{}".format(count % len(persons)))
+                list(Image.select().where(Image.person == person))
+                Person.select().where(Person.unknown == True).count()  # NOQA
+            except Exception as e:
+                errors.append(e)
+            times.append(time.perf_counter() - start)
+            count += 1
+        read_times.extend(times)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    dh.writer.flush()
+
+    print("journal mode:  {}".format(args.journal_mode))
+    print("writes:        {:.0f}/s, mean {:.2f} ms, p99 {:.2f} ms".format(
+        len(writes) / args.seconds, statistics.mean(writes) * 1000, percentile(writes, 0.99)))
+    print("reads:         {:.0f}/s with {} readers".format(len(read_times) / args.seconds, args.readers))
+    print("read latency:  p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+        percentile(read_times, 0.5), percentile(read_times, 0.99), max(read_times) * 1000))
+    print("event writer:  {}".format(dh.writer.metrics()))
+    print("errors:        {}".format(len(errors)))
+
+
+if __name__ == '__main__':
+    main()
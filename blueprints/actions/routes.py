@@ -1,68 +1,164 @@
-from flask import Blueprint, redirect, make_response
-from flask import current_app as app
-from flask_simplelogin import login_required
-import os
-import sys
-import cv2
-import logging
-
-from Library.helpers import OKResponse
-
-actions = Blueprint("actions", __name__)
-
-
-# background process
-
-@actions.route('/start_camera')
-@login_required
-def start_cam():
-    app.ch.camera_start_processing()
-    return OKResponse()
-
-
-@actions.route('/stop_camera')
-@login_required
-def stop_cam():
-    app.ch.camera_stop_processing()
-    return OKResponse()
-
-
-@actions.route('/force_rescan')
-@login_required
-def force_a_rescan():
-    app.force_rescan = True
-    return OKResponse()
-
-
-@actions.route('/retrain')
-@login_required
-def retrain_dnn():
-    # TODO: fix train_dnn
-    # app.fh.train_dnn()
-    logging.info("NOT OPERATIONAL Camera algorithm retrained")
-    return redirect("/")
-
-
-@actions.route('/hard_reset')
-@login_required
-def hard_reset():
-    logging.info("Camera performing hard reset")
-    try:
-        os.execv(__file__, sys.argv)
-    except OSError:
-        pass
-    logging.info([sys.executable, __file__] + sys.argv)
-    # os.execv(sys.executable, [sys.executable, __file__.replace("/", "\\")])
-    os.execv("'" + sys.executable + "'", [sys.executable, __file__] + sys.argv)
-    logging.info("Camera hard reset performed")
-
-
-@actions.route('/preview')
-@login_required
-def preview():
-    image_binary = app.preview_image
-    retval, buffer = cv2.imencode('.png', image_binary)
-    response = make_response(buffer.tobytes())
-    response.headers.set('Content-Type', 'image/jpeg')
-    response.headers.set('Content-Disposition', 'inline')
-    return response
+from flask import Blueprint, redirect, make_response, jsonify, Response, request, send_from_directory
+from flask import current_app as app
+from flask_simplelogin import login_required, is_logged_in
+import hmac
+import math
+import os
+import sys
+import logging
+
+from Library.helpers import OKResponse, parse
+from Library.errors import InvalidUsage
+from Library.thumbnails import thumbnail_folder_path, backfill_thumbnails, thumbnail_url
+from Library.metrics import format_prometheus
+from config import Config
+
+actions = Blueprint("actions", __name__)
+actions.add_app_template_global(thumbnail_url)
+
+
+# background process
+
+@actions.route('/start_camera')
+@login_required
+def start_cam():
+    app.ch.camera_start_processing()
+    return OKResponse()
+
+
+@actions.route('/stop_camera')
+@login_required
+def stop_cam():
+    app.ch.camera_stop_processing()
+    return OKResponse()
+
+
+@actions.route('/force_rescan')
+@login_required
+def force_a_rescan():
+    app.ch.force_rescan()
+    return OKResponse()
+
+
+@actions.route('/retrain')
+@login_required
+def retrain_dnn():
+    # TODO: fix train_dnn
+    # app.fh.train_dnn()
+    logging.info("NOT OPERATIONAL Camera algorithm retrained")
+    return redirect("/")
+
+
+@actions.route('/hard_reset')
+@login_required
+def hard_reset():
+    logging.info("Camera performing hard reset")
+    try:
+        os.execv(__file__, sys.argv)
+    except OSError:
+        pass
+    logging.info([sys.executable, __file__] + sys.argv)
+    # os.execv(sys.executable, [sys.executable, __file__.replace("/", "\\")])
+    os.execv("'" + sys.executable + "'", [sys.executable, __file__] + sys.argv)
+    logging.info("Camera hard reset performed")
+
+
+@actions.route('/dedup_images', methods=['POST'])
+@login_required
+def dedup_images():
+    """Remove the near duplicate pictures from the image store, reporting the reclaimed space"""
+    return jsonify(app.fh.dedup_stored_images())
+
+
+@actions.route('/backfill_thumbnails', methods=['POST'])
+@login_required
+def backfill_missing_thumbnails():
+    """Create the thumbnails of the pictures that were taken before the thumbnails were generated"""
+    return jsonify(backfill_thumbnails(app.dh))
+
+
+@actions.route('/thumbnail/<path:name>')
+@login_required
+def thumbnail(name):
+    """A picture thumbnail, the name contains the hash of the content so it can be cached forever"""
+    response = send_from_directory(os.path.abspath(str(thumbnail_folder_path)), name, conditional=True, etag=True)
+    response.headers.set('Cache-Control', 'private, max-age=31536000, immutable')
+    return response
+
+
+@actions.route('/metrics')
+def metrics():
+    """Recognition and health metrics in the Prometheus text format
+    Scrapers authenticate with the METRICS_TOKEN bearer token, logged in users can open it in the browser
+    """
+    token = app.config.get("METRICS_TOKEN")
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer {}'.format(token))
+    if not authorized and not is_logged_in():
+        return Response("Unauthorized", status=401, mimetype='text/plain')
+    response = Response(format_prometheus(app.fh.metric_families()), mimetype='text/plain; version=0.0.4')
+    response.headers.set('Cache-Control', 'no-store')
+    return response
+
+
+@actions.route('/profile')
+@login_required(username=Config.SIMPLELOGIN_USERNAME)
+def profile_camera():
+    """Profile the running camera loop, admin only
+    Arguments: seconds (10 by default, at most PROFILE_MAX_SECONDS), interval_ms of the sampling (5 by default) and
+    mode: sample for collapsed stacks (flamegraph.pl, speedscope), cprofile for a pstats file, cprofile-text for a report
+    """
+    try:
+        seconds = min(float(parse(request, 'seconds') or 10), app.config.get("PROFILE_MAX_SECONDS", 60))
+        interval = float(parse(request, 'interval_ms') or 5) / 1000
+    except ValueError:
+        raise InvalidUsage("seconds and interval_ms have to be numbers")
+    if not math.isfinite(seconds) or not math.isfinite(interval):
+        raise InvalidUsage("seconds and interval_ms have to be finite numbers")
+    mode = parse(request, 'mode') or 'sample'
+    logging.info("Profiling the camera loop for {} seconds ({})".format(seconds, mode))
+    response = make_response(app.ch.profile(max(seconds, 0.1), mode, max(interval, 0.001)))
+    if mode == 'cprofile':
+        response.headers.set('Content-Type', 'application/octet-stream')
+        response.headers.set('Content-Disposition', 'attachment', filename='camera.pstats')
+    else:
+        response.headers.set('Content-Type', 'text/plain; charset=utf-8')
+    response.headers.set('Cache-Control', 'no-store')
+    return response
+
+
+@actions.route('/preview')
+@login_required
+def preview():
+    """The current preview frame as JPEG, pass size=thumb for a downscaled variant
+    Frames are encoded once and served from memory, an unchanged frame is answered with 304 Not Modified
+    """
+    app.ph.record_poll()
+    thumbnail = parse(request, 'size') == 'thumb'
+    etag = app.ph.etag(app.ph.sequence, thumbnail)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        sequence, jpeg = app.ph.get_jpeg(thumbnail)
+        etag = app.ph.etag(sequence, thumbnail)
+        response = make_response(jpeg)
+        response.headers.set('Content-Type', 'image/jpeg')
+        response.headers.set('Content-Disposition', 'inline')
+    response.set_etag(etag)
+    # the browser may keep the frame, but has to revalidate it on every poll
+    response.headers.set('Cache-Control', 'no-cache')
+    return response
+
+
+@actions.route('/stream')
+@login_required
+def stream():
+    """MJPEG stream of the preview, every frame is encoded once and shared by all the viewers"""
+    if not app.ph.add_viewer():
+        response = jsonify(message="Too many preview viewers, try again later.")
+        response.status_code = 503
+        return response
+    response = Response(app.ph.stream(),
+                        mimetype='multipart/x-mixed-replace; boundary={}'.format(app.ph.boundary))
+    response.headers.set('Cache-Control', 'no-cache, no-store')
+    response.call_on_close(app.ph.remove_viewer)
+    return response
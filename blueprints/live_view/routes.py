@@ -1,21 +1,132 @@
-from flask import Blueprint, render_template
-from flask import current_app as app
-from flask_simplelogin import login_required
-
-live_view = Blueprint("live_view", __name__)
-
-
-@live_view.route('/live_view')
-@live_view.route('/')
-@login_required
-def home():
-    names = []
-    if app.fh is not None:
-        logs = app.dh.get_all_events()
-        names = [p.person.name for p in app.fh.tracking_data]
-    return render_template(
-        "live_view.html",
-        running=app.ch.cam_is_processing,
-        names=names,
-        log=logs,
-        runsince=app.fh.running_since.strftime(app.config["TIME_FORMAT"]))
+from datetime import datetime, timedelta
+
+from flask import Blueprint, render_template, Response, jsonify, request
+from flask import current_app as app
+from flask_simplelogin import login_required
+
+from Library.broadcast import Broadcaster
+from Library.errors import InvalidUsage
+
+live_view = Blueprint("live_view", __name__)
+
+
+@live_view.route('/live_view')
+@live_view.route('/')
+@login_required
+def home():
+    names = []
+    # only the latest page, the older events are loaded from /event_log on demand
+    logs = app.dh.get_events(limit=app.config["EVENT_LOG_PAGE_SIZE"])
+    if app.fh is not None:
+        names = [p["name"] for p in app.fh.tracking_snapshot()["persons"]]
+    return render_template(
+        "live_view.html",
+        running=app.ch.cam_is_processing,
+        names=names,
+        log=logs,
+        next_event=logs[-1].id if len(logs) == app.config["EVENT_LOG_PAGE_SIZE"] else None,
+        runsince=app.fh.running_since.strftime(app.config["TIME_FORMAT"]))
+
+
+@live_view.route('/event_stream')
+@login_required
+def event_stream():
+    """Server-sent events of arrivals, departures and the tracking state
+    Starts with a snapshot of the current tracking state, so the page doesn't have to query anything
+    """
+    subscription = app.eb.subscribe()
+    if subscription is None:
+        response = jsonify(message="Too many event stream clients, try again later.")
+        response.status_code = 503
+        return response
+    first_message = Broadcaster.serialize("tracking", app.fh.tracking_snapshot())
+    response = Response(app.eb.stream(subscription, first_message), mimetype='text/event-stream')
+    response.headers.set('Cache-Control', 'no-cache')
+    # disables response buffering in nginx
+    response.headers.set('X-Accel-Buffering', 'no')
+    response.call_on_close(lambda: app.eb.unsubscribe(subscription))
+    return response
+
+
+def parse_time(argument_name: str) -> datetime:
+    """Parse an ISO 8601 request argument, a time with an offset is converted to the naive local time
+    the events are stored in
+    """
+    value = request.args.get(argument_name)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidUsage("The request argument {} is not an ISO 8601 date".format(argument_name))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+@live_view.route('/event_log')
+@login_required
+def event_log():
+    """A page of the event log as JSON, newest first
+    Pass the returned next value as before to get the following page, it's null on the last page
+    Filters: kind (e.g. arrived, left), person, since and until (ISO 8601)
+    """
+    limit = max(1, min(request.args.get('limit', app.config["EVENT_LOG_PAGE_SIZE"], type=int), 500))
+    events = app.dh.get_events(before_id=request.args.get('before', None, type=int),
+                               limit=limit,
+                               kind=request.args.get('kind'),
+                               person_name=request.args.get('person'),
+                               since=parse_time('since'),
+                               until=parse_time('until'))
+    return jsonify(
+        events=[{"id": event.id,
+                 "datetime": event.datetime.strftime(app.config["TIME_FORMAT"]),
+                 "kind": event.kind,
+                 "person": event.person_name,
+                 "event": event.event} for event in events],
+        next=events[-1].id if len(events) == limit else None)
+
+
+@live_view.route('/event_rollups')
+@login_required
+def event_rollups():
+    """The daily per person summaries of the events older than the retention period, newest first"""
+    since = parse_time('since')
+    rollups = app.dh.get_event_rollups(since=since.date() if since else None, person_name=request.args.get('person'))
+    return jsonify(rollups=[{"day": rollup.day.isoformat(),
+                             "person": rollup.person_name,
+                             "kind": rollup.kind,
+                             "count": rollup.count,
+                             "first": rollup.first.strftime(app.config["TIME_FORMAT"]),
+                             "last": rollup.last.strftime(app.config["TIME_FORMAT"])} for rollup in rollups])
+
+
+@live_view.route('/presence')
+@login_required
+def presence():
+    """Who was present in a time range and for how long
+    Arguments: since and until (ISO 8601, the last hour by default), person
+    """
+    until = parse_time('until') or datetime.now()
+    since = parse_time('since') or until - timedelta(hours=1)
+    person_name = request.args.get('person')
+    intervals = app.dh.get_presence(since, until, person_name)
+    return jsonify(
+        intervals=[{"person": interval.person.name,
+                    "camera": interval.camera,
+                    "start": interval.start.strftime(app.config["TIME_FORMAT"]),
+                    "end": interval.end.strftime(app.config["TIME_FORMAT"]) if interval.end else None,
+                    "frame_count": interval.frame_count} for interval in intervals],
+        occupancy=app.dh.occupancy(intervals, since, until))
+
+
+@live_view.route('/frame_timings')
+@login_required
+def frame_timings():
+    """Latency percentiles of the stages of the frame processing, per camera preset
+    Pass reset=1 to start over, e.g. after an upgrade
+    """
+    timings = app.fh.frame_timings()
+    if request.args.get('reset'):
+        app.fh.reset_frame_timings()
+    return jsonify(cameras=timings)
@@ -1,58 +1,114 @@
-from flask import Blueprint, render_template, request, redirect
-from flask import current_app as app
-from flask_simplelogin import login_required
-import logging
-from Library.helpers import parse, OKResponse
-
-persons_database = Blueprint("persons_database", __name__)
-
-
-@persons_database.route('/_new_person_from_unk')
-@login_required
-def create_new_person_from_unknown():
-    """"""
-    name = request.args.get('n', 0, type=str)
-    person_to_change = app.dh.get_person_by_name(name)
-    if person_to_change.unknown:
-        logging.info("Creating new person: {}".format(name))
-        person_to_change.convert_to_known()
-        app.dh.invalidate()
-        # app.fh.file.create_new_person_from_unk(name)
-    return redirect("/person_db")
-
-@persons_database.route('/person_db')
-@login_required
-def person_db_view():
-    """
-
-    :return:
-    """
-    return render_template(
-        "person_db.html",
-        persons=app.dh.get_known_persons(),
-        unk_persons=app.dh.get_unknown_persons(),
-        folder_location=app.config["PICTURE_FOLDER"]
-    )
-
-@persons_database.route('/remove_person', methods=['POST'])
-@login_required
-def remove_person():
-    """When remove is clicked on person db page"""
-    name = parse(request, "name", True)
-    logging.info("Removing: " + name)
-    app.dh.get_person_by_name(name).remove()
-    logging.info("Removed: " + name)
-    app.dh.invalidate()
-    return OKResponse()
-
-
-@persons_database.route('/_merge_with')
-@login_required
-def merge_unknown_with():
-    """"""
-    name = request.args.get('n', 0, type=str)
-    merge_to = request.args.get('m2', 0, type=str)
-    logging.info("Merging {} into {}".format(name, merge_to))
-    app.dh.get_person_by_name(name).merge_with(app.dh.get_person_by_name(merge_to))
-    app.dh.invalidate()
-    return redirect("/person_db")
+from flask import Blueprint, render_template, request, redirect, jsonify
+from flask import current_app as app
+from flask_simplelogin import login_required
+import logging
+import math
+from Library.helpers import parse, OKResponse
+from Library.thumbnails import thumbnail_url
+
+persons_database = Blueprint("persons_database", __name__)
+
+
+@persons_database.route('/_new_person_from_unk')
+@login_required
+def create_new_person_from_unknown():
+    """"""
+    name = request.args.get('n', 0, type=str)
+    person_to_change = app.dh.get_person_by_name(name)
+    if person_to_change.unknown:
+        logging.info("Creating new person: {}".format(name))
+        person_to_change.convert_to_known()
+        app.dh.invalidate()
+        # app.fh.file.create_new_person_from_unk(name)
+    return redirect("/person_db")
+
+
+SORT_ORDERS = [("last_seen", "Last seen"), ("name", "Name"), ("images", "Number of pictures")]
+
+
+@persons_database.route('/person_db')
+@login_required
+def person_db_view():
+    """
+    Known and unknown persons, a page of each, filtered by the q search argument and ordered by sort
+    page and upage select the page of the known and the unknown persons
+    :return:
+    """
+    page_size = app.config["PERSON_DB_PAGE_SIZE"]
+    search = request.args.get('q') or None
+    sort = request.args.get('sort', 'last_seen')
+    page = max(1, request.args.get('page', 1, type=int))
+    upage = max(1, request.args.get('upage', 1, type=int))
+    persons, persons_total = app.dh.get_person_page(False, page, page_size, search, sort)
+    unk_persons, unk_total = app.dh.get_person_page(True, upage, page_size, search, sort)
+    return render_template(
+        "person_db.html",
+        persons=persons,
+        persons_total=persons_total,
+        page=page,
+        pages=math.ceil(persons_total / page_size),
+        unk_persons=unk_persons,
+        unk_total=unk_total,
+        upage=upage,
+        unk_pages=math.ceil(unk_total / page_size),
+        search=search,
+        sort=sort,
+        sort_orders=SORT_ORDERS,
+        folder_location=app.config["PICTURE_FOLDER"]
+    )
+
+
+@persons_database.route('/_search_persons')
+@login_required
+def search_persons():
+    """The names of the persons matching the q search argument, the most recently seen first, e.g. the merge targets
+    At most limit (20 by default, up to 100) names are returned, the person named by exclude is left out
+    """
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    return jsonify(names=app.dh.search_person_names(request.args.get('q') or None, limit, request.args.get('exclude')))
+
+
+@persons_database.route('/_person_images')
+@login_required
+def person_images():
+    """The names and the thumbnail URLs of the latest pictures of a person"""
+    person = app.dh.get_person_by_name(parse(request, 'n', True))
+    images = app.dh.get_recent_images(person)
+    return jsonify(images=[image.name for image in images], thumbnails=[thumbnail_url(image) for image in images])
+
+@persons_database.route('/remove_person', methods=['POST'])
+@login_required
+def remove_person():
+    """When remove is clicked on person db page"""
+    name = parse(request, "name", True)
+    logging.info("Removing: " + name)
+    app.dh.get_person_by_name(name).remove()
+    logging.info("Removed: " + name)
+    app.dh.invalidate()
+    return OKResponse()
+
+
+@persons_database.route('/_merge_with')
+@login_required
+def merge_unknown_with():
+    """"""
+    name = request.args.get('n', 0, type=str)
+    merge_to = request.args.get('m2', 0, type=str)
+    logging.info("Merging {} into {}".format(name, merge_to))
+    app.dh.get_person_by_name(name).merge_with(app.dh.get_person_by_name(merge_to))
+    app.dh.invalidate()
+    return redirect("/person_db")
+
+
+@persons_database.route('/_merge_many', methods=['POST'])
+@login_required
+def merge_many():
+    """Merge many persons (the repeated n argument) into one (m2) in a single transaction"""
+    names = request.form.getlist('n') or request.args.getlist('n')
+    merge_to = parse(request, 'm2', True)
+    target = app.dh.get_person_by_name(merge_to)
+    sources = app.dh.get_persons_by_names(names)
+    logging.info("Merging {} persons into {}".format(len(sources), merge_to))
+    # the pictures are stored in a single folder, only their rows are reassigned
+    merged = app.dh.merge_persons(sources, target)
+    return jsonify(merged=merged, missing=sorted(set(names) - {person.name for person in sources}))
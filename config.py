@@ -1,34 +1,93 @@
-logging_config = {
-    'version': 1,
-    'formatters': {
-        'default': {
-            'format': '[%(asctime)s] [%(levelname)s]: %(message)s - in [%(module)s]',
-        }
-    },
-    'handlers': {
-        'wsgi': {
-            'class': 'logging.StreamHandler',
-            'stream': 'ext://sys.stdout',
-            'formatter': 'default'
-        },
-        'filehandler': {
-            'class': 'logging.handlers.RotatingFileHandler',
-            'formatter': 'default',
-            'filename': 'logs\\log.log',
-            'mode': 'a',
-            'backupCount': 1,
-            'maxBytes': 5242800
-        }
-    },
-    'root': {
-        'level': 'INFO',
-        'handlers': ['wsgi', 'filehandler']
-    }
-}
-
-class Config:
-    TIME_FORMAT = "%Y.%m.%d. %H:%M:%S"
-    PICTURE_FOLDER = "dnn_data"  # relative from the Static folder
-    SIMPLELOGIN_USERNAME = 'admin'
-    IMAGES_PATH = 'Static'
-    SEND_FILE_MAX_AGE_DEFAULT = 0  # to update images with the same filename, but dif content
+logging_config = {
+    'version': 1,
+    'formatters': {
+        'default': {
+            'format': '[%(asctime)s] [%(levelname)s]: %(message)s - in [%(module)s]',
+        }
+    },
+    'handlers': {
+        'wsgi': {
+            'class': 'logging.StreamHandler',
+            'stream': 'ext://sys.stdout',
+            'formatter': 'default'
+        },
+        'filehandler': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'formatter': 'default',
+            'filename': 'logs\\log.log',
+            'mode': 'a',
+            'backupCount': 1,
+            'maxBytes': 5242800
+        }
+    },
+    'root': {
+        'level': 'INFO',
+        'handlers': ['wsgi', 'filehandler']
+    }
+}
+
+class Config:
+    TIME_FORMAT = "%Y.%m.%d. %H:%M:%S"
+    PICTURE_FOLDER = "dnn_data"  # relative from the Static folder
+    SIMPLELOGIN_USERNAME = 'admin'
+    IMAGES_PATH = 'Static'
+    SEND_FILE_MAX_AGE_DEFAULT = 0  # to update images with the same filename, but dif content
+    IMAGE_WRITER_THREADS = 1
+    IMAGE_WRITER_QUEUE_SIZE = 32  # face crops over this limit are dropped instead of blocking the camera
+    PREVIEW_MAX_VIEWERS = 4  # concurrent MJPEG preview streams
+    PREVIEW_JPEG_QUALITY = 80
+    PREVIEW_HEADLESS = False  # never keep or draw preview frames, for nodes nobody watches
+    EVENT_STREAM_MAX_CLIENTS = 32
+    EVENT_STREAM_QUEUE_SIZE = 64  # per client, the oldest events are dropped for slow clients
+    EVENT_SNAPSHOT_SECONDS = 2.0  # how often the tracking state is pushed to the event stream
+    # shared memory ring buffer of the preview frames, set a name to share the frames with other processes
+    FRAME_BUS_NAME = None
+    FRAME_BUS_ROLE = "writer"  # the camera process writes, web worker processes use "reader"
+    FRAME_BUS_SLOTS = 4
+    FRAME_BUS_MAX_RESOLUTION = "fhd"  # larger frames are downscaled
+    CAMERA_AUTOSTART = False
+    # events are committed in batches every DB_WRITER_INTERVAL_MS or DB_WRITER_BATCH_SIZE events
+    DB_WRITER_INTERVAL_MS = 500
+    DB_WRITER_BATCH_SIZE = 100
+    DB_WRITER_QUEUE_SIZE = 1000
+    # events older than this many days are rolled up into daily per person summaries, None keeps every event
+    EVENT_RETENTION_DAYS = None
+    EVENT_ROLLUP_INTERVAL_HOURS = 1.0
+    EVENT_LOG_PAGE_SIZE = 50
+    PERSON_DB_PAGE_SIZE = 24
+    SETTINGS_POLL_SECONDS = 1.0  # how often the setting files are checked for changes made by other processes
+    MQTT_QOS = 1
+    MQTT_QUEUE_SIZE = 256  # notifications over this limit are dropped instead of blocking the camera
+    MQTT_BATCH_MS = 0  # combine the messages of a topic published within this window, 0 sends them one by one
+    MQTT_MAX_BACKOFF_SECONDS = 60
+    # undelivered notifications are kept here and sent when the broker is reachable again
+    MQTT_SPOOL_PATH = "Data/mqtt_spool.jsonl"
+    MQTT_SPOOL_MAX_MESSAGES = 10000
+    # the SMTP account of the email notifications, no emails are sent without MAIL_USERNAME
+    MAIL_SERVER = "smtp.gmail.com"
+    MAIL_PORT = 587
+    MAIL_USE_TLS = True
+    MAIL_USERNAME = None
+    MAIL_PASSWORD = None  # or the RECOGNEYEZ_MAIL_PASSWORD environment variable
+    MAIL_SENDER = None  # the MAIL_USERNAME if not set
+    MAIL_COOLDOWN_SECONDS = 120  # the shortest time between two emails to an address, if e-notif-cooldown is not set
+    MAIL_DIGEST_SECONDS = 30  # arrivals within this window are sent in one email
+    MAIL_IDLE_SECONDS = 60  # the SMTP connection is closed after this long without emails
+    MAIL_QUEUE_SIZE = 256
+    MAIL_RETRY_SECONDS = 30  # the first retry of an email that could not be sent, doubled after every failure
+    MAIL_MAX_ATTEMPTS = 5
+    METRICS_TOKEN = None  # bearer token of the Prometheus scrapers on /metrics, without it only logged in users
+    PROFILE_MAX_SECONDS = 60  # the longest profile of the camera loop /profile takes
+    REPLAY_FPS = 25.0  # the frame rate of the replayed picture folders and the videos without one
+
+
+class ProductionConfig(Config):
+    """Used by serve.py, the recognition worker and the web UI run in separate processes"""
+    FRAME_BUS_NAME = "recogneyez_frames"
+    IPC_ADDRESS = ("127.0.0.1", 6001)
+    IPC_AUTHKEY = None  # taken from the RECOGNEYEZ_IPC_KEY environment variable, serve.py generates one
+    WEB_HOST = "0.0.0.0"
+    WEB_PORT = 5000
+    WEB_THREADS = 8
+    # a restarted worker continues where the crashed one stopped
+    CAMERA_AUTOSTART = True
@@ -0,0 +1,128 @@
+"""Production entry point
+
+The camera loop and the face recognition run in a separate recognition worker process, restarted automatically
+if it crashes. The web UI is served by waitress from this process, it talks to the worker over a local
+authenticated socket and gets the preview frames from the shared memory frame bus.
+
+    python serve.py           # worker and web UI
+    python serve.py worker    # only the supervised worker, e.g. when the web UI runs under gunicorn
+    python serve.py web       # only the web UI
+
+Other WSGI servers can load the web UI with the create_web_app factory, e.g.
+    gunicorn --threads 8 "serve:create_web_app()"
+The worker and the web processes must share the RECOGNEYEZ_IPC_KEY environment variable.
+"""
+import argparse
+import copy
+import logging
+import logging.config
+import logging.handlers
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+
+from config import logging_config, ProductionConfig
+from webapp import create_app
+
+
+def configure_logging(filename: str = None):
+    """Set up the logging of run.py, every process writes its own log file so they don't rotate the same file"""
+    config = copy.deepcopy(logging_config)
+    if filename:
+        config["handlers"]["filehandler"]["filename"] = filename
+    logging.config.dictConfig(config)
+
+    for handler in logging.getLogger().handlers:
+        if issubclass(handler.__class__, logging.handlers.BaseRotatingHandler):
+            handler.namer = lambda fn: fn.replace("log.1", "1.log")
+
+
+def run_worker():
+    """Body of the recognition worker process"""
+    from Library.ipc import WorkerServer, ipc_authkey
+
+    configure_logging('logs\\worker.log')
+    app = create_app(ProductionConfig, role="worker")
+    server = WorkerServer(app, app.config["IPC_ADDRESS"], ipc_authkey(app.config))
+    if app.config.get("CAMERA_AUTOSTART"):
+        app.ch.camera_start_processing()
+    server.serve_forever()
+
+
+class Supervisor(threading.Thread):
+    """Keeps the recognition worker process running, restarting it with an increasing delay when it exits"""
+    max_backoff_seconds = 60.0
+    # a worker that ran at least this long is considered healthy, the delay starts over
+    healthy_seconds = 60.0
+
+    def __init__(self):
+        super().__init__(name="worker-supervisor", daemon=True)
+        self.process: multiprocessing.Process = None
+        self.stopping = threading.Event()
+        self.restarts = 0
+
+    def run(self):
+        backoff = 1.0
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.process = multiprocessing.Process(target=run_worker, name="recognition-worker")
+            self.process.start()
+            logging.info("Recognition worker started, pid {}".format(self.process.pid))
+            self.process.join()
+            if self.stopping.is_set():
+                break
+            if time.monotonic() - started > self.healthy_seconds:
+                backoff = 1.0
+            self.restarts += 1
+            logging.error("Recognition worker exited with code {}, restarting in {} s"
+                          .format(self.process.exitcode, backoff))
+            self.stopping.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff_seconds)
+
+    def stop(self):
+        self.stopping.set()
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(10)
+
+
+def create_web_app():
+    """App factory of the web UI for WSGI servers"""
+    return create_app(ProductionConfig, role="web")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run recognEYEz with a separate recognition worker process")
+    parser.add_argument("role", nargs="?", choices=["all", "worker", "web"], default="all")
+    args = parser.parse_args()
+
+    configure_logging()
+    if not os.environ.get("RECOGNEYEZ_IPC_KEY"):
+        if args.role != "all":
+            parser.error("the RECOGNEYEZ_IPC_KEY environment variable must be set when running the roles separately")
+        # inherited by the worker process
+        os.environ["RECOGNEYEZ_IPC_KEY"] = secrets.token_hex(16)
+
+    supervisor = None
+    if args.role in ("all", "worker"):
+        supervisor = Supervisor()
+        supervisor.start()
+    try:
+        if args.role == "worker":
+            supervisor.join()
+            return
+        from waitress import serve
+
+        app = create_web_app()
+        logging.info("Server starting.")
+        serve(app, host=app.config["WEB_HOST"], port=app.config["WEB_PORT"], threads=app.config["WEB_THREADS"])
+        logging.info("Server stopped.")
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import sys
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+# the modules import each other as Library.*, from the root of the repository
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def wait_for(condition, timeout=5.0):
+    """Poll a condition of a background thread until it's true, failing the test after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def logged_in_client(app):
+    """A test client of a Flask app with a logged in flask_simplelogin session"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["simple_logged_in"] = True
+        session["simple_username"] = "admin"
+    return client
+
+
+@pytest.fixture
+def web_app():
+    """A bare Flask app with the error handlers, the tests register the blueprint and set the handlers they need"""
+    from flask import Flask
+    from blueprints.errors.handlers import errors
+
+    app = Flask("recogneyez_test")
+    app.secret_key = "test"
+    app.register_blueprint(errors)
+    return app
+
+
+@pytest.fixture
+def dh(tmp_path):
+    """A DatabaseHandler on an empty database"""
+    from Library.DatabaseHandler import DatabaseHandler
+
+    handler = DatabaseHandler(types.SimpleNamespace(config=dict()), str(tmp_path.joinpath("recogneyez.db")))
+    yield handler
+    handler.writer.stop()
+    handler.database.close()
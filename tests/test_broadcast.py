@@ -0,0 +1,55 @@
+import json
+import types
+
+from Library.broadcast import Broadcaster, tracking_snapshot
+
+
+def parse(message: bytes):
+    event, data = message.decode().rstrip("\n").split("\n")
+    return event[len("event: "):], json.loads(data[len("data: "):])
+
+
+def test_every_subscriber_gets_the_same_serialized_message():
+    broadcaster = Broadcaster()
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    broadcaster.publish("arrived", {"name": "Ann"})
+    message = first.queue.get_nowait()
+    assert message is second.queue.get_nowait()
+    assert parse(message) == ("arrived", {"name": "Ann"})
+
+
+def test_a_slow_subscriber_loses_its_oldest_messages():
+    broadcaster = Broadcaster(queue_size=3)
+    subscription = broadcaster.subscribe()
+    for index in range(5):
+        broadcaster.publish("arrived", {"index": index})
+    assert [parse(subscription.queue.get_nowait())[1]["index"] for _ in range(3)] == [2, 3, 4]
+    assert subscription.dropped == 2
+
+
+def test_subscribers_over_the_limit_are_refused():
+    broadcaster = Broadcaster(max_subscribers=1)
+    subscription = broadcaster.subscribe()
+    assert broadcaster.subscribe() is None
+    broadcaster.unsubscribe(subscription)
+    assert broadcaster.subscribe() is not None
+
+
+def test_the_stream_starts_with_the_snapshot_and_keeps_the_connection_alive():
+    broadcaster = Broadcaster()
+    broadcaster.keepalive_seconds = 0.01
+    subscription = broadcaster.subscribe()
+    tracked = [types.SimpleNamespace(person=types.SimpleNamespace(name="Ann"), disappearCount=0)]
+    stream = broadcaster.stream(subscription, Broadcaster.serialize("tracking", tracking_snapshot(tracked)))
+    assert parse(next(stream)) == ("tracking", {"persons": [{"name": "Ann", "visible": True}]})
+    assert next(stream) == b": keepalive\n\n"
+    broadcaster.publish("left", {"name": "Ann"})
+    assert parse(next(stream)) == ("left", {"name": "Ann"})
+
+
+def test_nothing_is_serialized_without_subscribers():
+    broadcaster = Broadcaster()
+    serialized = []
+    broadcaster.serialize = lambda event, data: serialized.append(event)
+    broadcaster.publish("tracking", {"persons": []})
+    assert serialized == []
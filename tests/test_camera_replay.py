@@ -0,0 +1,94 @@
+import time
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+from Library.CameraHandler import CameraHandler, ReplayCamera
+
+
+@pytest.fixture
+def pictures(tmp_path):
+    """A folder of five pictures, the pixels of the i-th picture are i * 10"""
+    for index in range(5):
+        cv2.imwrite(str(tmp_path.joinpath("{:03d}.png".format(index))), np.full((8, 8, 3), index * 10, np.uint8))
+    return str(tmp_path)
+
+
+def replay_all(camera, limit=20):
+    values = []
+    for _ in range(limit):
+        ret, frame = camera.read()
+        if not ret:
+            break
+        values.append(int(frame[0, 0, 0]) // 10)
+    return values
+
+
+def test_fast_mode_returns_every_frame(pictures):
+    camera = ReplayCamera(pictures, mode="fast")
+    assert replay_all(camera) == [0, 1, 2, 3, 4]
+    assert not camera.cam_is_running
+
+
+def test_step_mode_returns_every_step_th_frame(pictures):
+    camera = ReplayCamera(pictures, mode="step", step=2)
+    assert replay_all(camera) == [1, 3]
+    # 0 and 2, then 4 on the way to the end
+    assert camera.frames_skipped == 3
+
+
+def test_a_looping_replay_starts_over(pictures):
+    camera = ReplayCamera(pictures, mode="fast", loop=True)
+    assert replay_all(camera, limit=7) == [0, 1, 2, 3, 4, 0, 1]
+    assert camera.cam_is_running
+
+
+def test_realtime_mode_skips_the_frames_it_is_too_slow_for(pictures):
+    camera = ReplayCamera(pictures, mode="realtime", fps=50)
+    values = []
+    for _ in range(3):
+        ret, frame = camera.read()
+        if not ret:
+            break
+        values.append(int(frame[0, 0, 0]) // 10)
+        # twice as slow as the recording
+        time.sleep(0.04)
+    assert values[0] == 0
+    assert camera.frames_skipped > 0
+    assert values == sorted(set(values))
+
+
+class FakeFaceHandler:
+    """Reads the camera like FaceHandler.process_next_frame, without the recognition"""
+
+    def __init__(self, app):
+        self.app = app
+        self.stage_timers = types.SimpleNamespace(get=lambda name: types.SimpleNamespace(lap=lambda *args: 0.0))
+
+    def process_next_frame(self, use_dnn=False, save_new_faces=False):
+        ret, frame = self.app.ch.cam.read()
+        if not ret or frame is None:
+            raise AssertionError("The camera didn't return a frame object.")
+        return [], frame, []
+
+
+def test_the_end_of_a_replay_stops_the_processing(pictures):
+    settings = types.SimpleNamespace(dnn_scan_freq=-1, selected_setting="replay", camera_source="replay")
+    published = []
+    app = types.SimpleNamespace(config=dict(), force_rescan=False, camera_thread=None,
+                                sh=types.SimpleNamespace(get_face_recognition_snapshot=lambda: settings),
+                                ph=types.SimpleNamespace(publish=lambda frame, *args: published.append("frame"),
+                                                         publish_empty=lambda: published.append("empty")),
+                                eb=types.SimpleNamespace(subscriber_count=0))
+    app.fh = FakeFaceHandler(app)
+    app.ch = handler = CameraHandler(app)
+    handler.cam = ReplayCamera(pictures, mode="fast")
+    handler.camera_source = "replay"
+    handler.cam_is_running = handler.cam_is_processing = True
+
+    handler.camera_process()
+    assert published == ["frame"] * 5 + ["empty"]
+    assert not handler.cam_is_running
+    assert not handler.cam_is_processing
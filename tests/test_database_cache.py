@@ -0,0 +1,47 @@
+import sqlite3
+
+
+def test_event_writes_keep_the_person_cache(dh):
+    dh.add_person("Ann", unknown=False)
+    persons = dh.get_known_persons()
+    generation = dh.current_generation()
+    dh.log_event("[ARRIVED]: Ann", "arrived", "Ann")
+    dh.presence_started(persons[0])
+    dh.presence_ended(persons[0])
+    dh.writer.flush()
+    assert dh.current_generation() == generation
+    assert dh.get_known_persons() is persons
+
+
+def test_person_changes_invalidate_the_cache(dh):
+    dh.add_person("Ann", unknown=False)
+    persons = dh.get_known_persons()
+    dh.add_person("Bob", unknown=False)
+    assert [person.name for person in dh.get_known_persons()] == ["Ann", "Bob"]
+    assert dh.get_known_persons() is not persons
+
+
+def test_another_process_changing_the_persons_invalidates_the_cache(dh):
+    persons = dh.get_known_persons()
+    generation = dh.current_generation()
+    other = sqlite3.connect(dh.database.database)
+    other.execute("INSERT INTO userevent (datetime, event) VALUES ('2024-01-01 00:00:00', 'other process')")
+    other.commit()
+    assert dh.current_generation() == generation
+    # what invalidate() does in the other process
+    other.execute("INSERT INTO person (name, unknown) VALUES ('Eve', 0)")
+    other.execute("UPDATE galleryversion SET version = version + 1 WHERE id = 1")
+    other.commit()
+    other.close()
+    assert dh.current_generation() > generation
+    assert [person.name for person in dh.get_known_persons()] == ["Eve"]
+    assert persons == []
+
+
+def test_a_rolled_back_person_is_not_cached(dh):
+    dh.add_person("Ann", unknown=False)
+    with dh.database.atomic() as transaction:
+        dh.add_person("_Unk_dropped")
+        transaction.rollback()
+    assert dh.get_person_names() == ["Ann"]
+    assert [person.name for person in dh.get_persons()] == ["Ann"]
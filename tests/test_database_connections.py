@@ -0,0 +1,52 @@
+import threading
+
+from conftest import wait_for
+from Library.DatabaseHandler import Person
+
+
+def run_in_thread(function):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_the_database_runs_in_wal_mode(dh):
+    assert dh.database.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_every_thread_gets_its_own_tuned_connection(dh):
+    def pragmas():
+        connection = dh.database.connection()
+        values = [connection.execute("PRAGMA {}".format(name)).fetchone()[0]
+                  for name in ("foreign_keys", "synchronous", "cache_size", "temp_store")]
+        dh.database.close()
+        return id(connection), values
+
+    connection, values = run_in_thread(pragmas)
+    assert connection != id(dh.database.connection())
+    # NORMAL is 1, MEMORY is 2
+    assert values == [1, 1, -16000, 2]
+
+
+def test_readers_are_not_blocked_by_an_open_write_transaction(dh):
+    dh.add_person("Ann", unknown=False)
+    writing = threading.Event()
+    done = threading.Event()
+
+    def write():
+        with dh.database.atomic():
+            Person.create(name="Bob", unknown=False)
+            writing.set()
+            done.wait(5)
+        dh.database.close()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    wait_for(writing.is_set)
+    # the reader sees the last commit while the writer holds the lock
+    assert [person.name for person in Person.select()] == ["Ann"]
+    done.set()
+    writer.join()
+    assert sorted(person.name for person in Person.select()) == ["Ann", "Bob"]
@@ -0,0 +1,70 @@
+import threading
+from datetime import datetime
+
+from conftest import wait_for
+from Library.DatabaseHandler import UserEvent
+from Library.DatabaseWriter import DatabaseWriter
+
+
+def event(text):
+    return {"datetime": datetime.now(), "event": text}
+
+
+def test_events_are_written_in_batches(dh):
+    for i in range(5):
+        dh.log_event("event {}".format(i), "arrived", "Ann")
+    # nothing is committed by the caller
+    assert UserEvent.select().count() < 5
+    dh.writer.flush()
+    assert [event.event for event in UserEvent.select().order_by(UserEvent.id)] == ["event {}".format(i)
+                                                                                     for i in range(5)]
+    metrics = dh.writer.metrics()
+    assert metrics["written"] == 5
+    assert metrics["batches"] == 1
+    assert metrics["queue_depth"] == 0
+
+
+def test_a_batch_is_committed_when_it_is_full(dh):
+    writer = DatabaseWriter(dh.database, flush_interval_ms=60000, batch_size=3)
+    for i in range(7):
+        writer.submit(UserEvent, event("event {}".format(i)))
+    writer.stop()
+    metrics = writer.metrics()
+    assert metrics["written"] == 7
+    # two full batches, the rest on stop
+    assert metrics["batches"] == 3
+
+
+def test_a_full_queue_drops_instead_of_blocking(dh):
+    blocked = threading.Lock()
+    blocked.acquire()
+    writer = DatabaseWriter(dh.database, flush_interval_ms=0, batch_size=1, max_queue=2)
+
+    class Blocking:
+        def execute(self):
+            blocked.acquire()
+
+    writer.submit_query(Blocking())
+    # wait for the writer to take the blocking query off the queue
+    wait_for(lambda: writer.metrics()["queue_depth"] == 0)
+    assert writer.submit(UserEvent, event("first"))
+    assert writer.submit(UserEvent, event("second"))
+    assert not writer.submit(UserEvent, event("dropped"))
+    blocked.release()
+    writer.stop()
+    metrics = writer.metrics()
+    assert metrics["dropped"] == 1
+    # the query and the two rows
+    assert metrics["written"] == 3
+    assert [event.event for event in UserEvent.select().order_by(UserEvent.id)] == ["first", "second"]
+
+
+def test_a_failed_batch_is_counted_and_the_writer_goes_on(dh):
+    writer = DatabaseWriter(dh.database, flush_interval_ms=0)
+    writer.submit(UserEvent, {"no_such_field": 1})
+    writer.flush()
+    writer.submit(UserEvent, event("after"))
+    writer.stop()
+    metrics = writer.metrics()
+    assert metrics["failed"] == 1
+    assert metrics["written"] == 1
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from blueprints.live_view.routes import live_view
+from conftest import logged_in_client
+from Library.DatabaseHandler import EventRollup, UserEvent
+
+NOW = datetime.now().replace(microsecond=0)
+
+
+def events(count, kind="arrived", person_name="Ann", start=NOW):
+    return [UserEvent.create(datetime=start + timedelta(minutes=i), event="event {}".format(i), kind=kind,
+                             person_name=person_name).id for i in range(count)]
+
+
+@pytest.fixture
+def client(web_app, dh):
+    web_app.register_blueprint(live_view)
+    web_app.config.update(EVENT_LOG_PAGE_SIZE=2, TIME_FORMAT="%Y.%m.%d. %H:%M:%S")
+    web_app.dh = dh
+    return logged_in_client(web_app)
+
+
+def test_the_pages_follow_each_other_newest_first(dh):
+    ids = events(5)
+    first = dh.get_events(limit=2)
+    second = dh.get_events(before_id=first[-1].id, limit=2)
+    last = dh.get_events(before_id=second[-1].id, limit=2)
+    assert [event.id for event in first + second + last] == ids[::-1]
+
+
+def test_the_events_are_filtered(dh):
+    arrivals = events(2)
+    departures = events(2, kind="left")
+    bob = events(1, person_name="Bob", start=NOW + timedelta(hours=1))
+    assert [event.id for event in dh.get_events(kind="left")] == departures[::-1]
+    assert [event.id for event in dh.get_events(person_name="Bob")] == bob
+    assert [event.id for event in dh.get_events(kind="arrived", person_name="Ann")] == arrivals[::-1]
+    assert [event.id for event in dh.get_events(since=NOW + timedelta(minutes=1),
+                                                until=NOW + timedelta(hours=1))] == [departures[1], arrivals[1]]
+
+
+def test_the_route_returns_the_next_page_until_the_last(client):
+    ids = events(3)
+    page = client.get("/event_log").get_json()
+    assert [event["id"] for event in page["events"]] == [ids[2], ids[1]]
+    page = client.get("/event_log?before={}".format(page["next"])).get_json()
+    assert [event["id"] for event in page["events"]] == [ids[0]]
+    assert page["next"] is None
+    assert client.get("/event_log?since=yesterday").status_code == 400
+
+
+def test_old_events_are_rolled_up_into_daily_summaries(dh):
+    # noon, so the events stay on one day
+    old = (NOW - timedelta(days=10)).replace(hour=12, minute=0, second=0)
+    events(3, start=old)
+    events(1, kind="left", start=old)
+    kept = events(1)
+    assert dh.rollup_events(retention_days=7) == 4
+    assert [event.id for event in dh.get_events()] == kept
+    rollups = dh.get_event_rollups(person_name="Ann")
+    assert sorted((rollup.day, rollup.kind, rollup.count) for rollup in rollups) == [
+        (old.date(), "arrived", 3), (old.date(), "left", 1)]
+    # a later rollup of the same day adds to the summary
+    events(2, start=old + timedelta(minutes=30))
+    assert dh.rollup_events(retention_days=7) == 2
+    arrived = EventRollup.get(EventRollup.kind == "arrived")
+    assert arrived.count == 5
+    assert arrived.first == old
+    assert arrived.last == old + timedelta(minutes=31)
+    assert dh.get_event_rollups(since=NOW.date()) == []
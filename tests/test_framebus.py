@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+from Library.framebus import WRITING, FrameBus
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus.create("recogneyez_test_bus_{}".format(os.getpid()), slots=2, max_resolution=(32, 24),
+                          meta_size=64)
+    yield bus
+    bus.close()
+
+
+@pytest.fixture
+def reader(bus):
+    reader = FrameBus.attach(bus.shm.name)
+    yield reader
+    reader.close()
+
+
+def frame(value: int, width: int = 32, height: int = 24):
+    return np.full((height, width, 3), value, np.uint8)
+
+
+def test_a_reader_gets_the_latest_frame_with_its_metadata(bus, reader):
+    assert reader.read() is None
+    bus.write(frame(1), {"face_rects": [[np.int32(1), 2, 3, 4]]})
+    bus.write(frame(2), {"labels": []})
+    sequence, _, image, meta = reader.read()
+    assert (sequence, int(image[0, 0, 0]), meta) == (2, 2, {"labels": []})
+    assert reader.read(1)[3] == {"face_rects": [[1, 2, 3, 4]]}
+
+
+def test_an_overwritten_slot_is_no_longer_valid(bus, reader):
+    bus.write(frame(1))
+    sequence, _, image, _ = reader.read()
+    assert reader.still_valid(sequence)
+    # two slots, the third frame goes into the slot of the first one
+    bus.write(frame(2))
+    bus.write(frame(3))
+    assert not reader.still_valid(sequence)
+    assert reader.read(sequence) is None
+    assert int(image[0, 0, 0]) == 3
+
+
+def test_a_slot_being_written_is_not_read(bus, reader):
+    bus.write(frame(1))
+    bus._slot_header(1)["sequence"] = WRITING
+    assert reader.read() is None
+
+
+def test_metadata_over_the_capacity_is_refused(bus):
+    with pytest.raises(ValueError):
+        bus.write(frame(1), {"labels": ["x" * 100]})
+    assert bus.latest_sequence == 0
+
+
+def test_larger_frames_are_scaled_down_to_the_capacity(bus, reader):
+    bus.write(frame(5, width=64, height=48))
+    _, _, image, _ = reader.read()
+    assert image.shape == (24, 32, 3)
+
+
+def _read_in_another_process(name, results):
+    reader = FrameBus.attach(name)
+    sequence, _, image, meta = reader.read()
+    results.put((sequence, int(image.sum()), meta))
+    del image
+    reader.close()
+
+
+def test_another_process_reads_the_frames(bus):
+    bus.write(frame(7), {"camera": "door"})
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=_read_in_another_process, args=(bus.shm.name, results))
+    process.start()
+    assert results.get(timeout=30) == (1, 7 * 32 * 24 * 3, {"camera": "door"})
+    process.join(30)
+    assert process.exitcode == 0
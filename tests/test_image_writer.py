@@ -0,0 +1,46 @@
+import threading
+
+import numpy as np
+import pytest
+
+from conftest import wait_for
+from Library.ImageWriter import ImageWriter
+
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = ImageWriter(str(tmp_path), max_queue=1)
+    yield writer
+    writer.stop()
+
+
+def test_the_callback_runs_once_the_image_is_written(writer, tmp_path):
+    results = []
+    assert writer.submit("face.jpg", np.zeros((8, 8, 3), np.uint8),
+                         on_written=lambda written: results.append((written, tmp_path.joinpath("face.jpg").exists())))
+    wait_for(lambda: results)
+    assert results == [(True, True)]
+
+
+def test_the_callback_reports_a_failed_write(writer):
+    results = []
+    # OpenCV can't encode an empty image
+    writer.submit("empty.png", np.zeros((0, 0, 3), np.uint8), on_written=results.append)
+    wait_for(lambda: results)
+    assert results == [False]
+    assert writer.metrics()["failed"] == 1
+
+
+def test_a_dropped_image_never_calls_back(writer):
+    gate = threading.Event()
+    results = []
+    image = np.zeros((8, 8, 3), np.uint8)
+    # the first callback holds the writer thread, the second image fills the queue
+    assert writer.submit("first.jpg", image, on_written=lambda written: gate.wait(5))
+    wait_for(lambda: writer.metrics()["queue_depth"] == 0)
+    assert writer.submit("second.jpg", image, on_written=results.append)
+    assert not writer.submit("dropped.jpg", image, on_written=results.append)
+    gate.set()
+    writer.flush()
+    assert results == [True]
+    assert writer.metrics()["dropped"] == 1
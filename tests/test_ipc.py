@@ -0,0 +1,82 @@
+import threading
+import types
+
+import pytest
+
+from conftest import wait_for
+from Library.broadcast import Broadcaster
+from Library.errors import InvalidUsage
+from Library.ipc import RemoteCameraHandler, WorkerClient, WorkerServer, WorkerUnavailable, ipc_authkey
+
+AUTHKEY = b"test key"
+
+
+@pytest.fixture
+def worker():
+    """A worker server on a free port, the handlers record the calls"""
+    calls = []
+
+    def profile(seconds, mode, interval):
+        if mode == "broken":
+            raise InvalidUsage("Unknown profiling mode broken")
+        calls.append(("profile", seconds, mode, interval))
+        return "stacks"
+
+    app = types.SimpleNamespace(
+        ch=types.SimpleNamespace(cam_is_running=True, cam_is_processing=False, profile=profile,
+                                 camera_start_processing=lambda: calls.append("start"),
+                                 camera_stop_processing=None, force_rescan=None, available_cameras=lambda: 2),
+        fh=types.SimpleNamespace(running_since=None, tracking_snapshot=lambda: {"persons": []},
+                                 dedup_stored_images=None, frame_timings=None, reset_frame_timings=None,
+                                 metric_families=None),
+        eb=Broadcaster())
+    server = WorkerServer(app, ("127.0.0.1", 0), AUTHKEY)
+    # the listener is left open, the accepting thread dies with the test process
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return types.SimpleNamespace(app=app, calls=calls, address=server.listener.address)
+
+
+def test_commands_and_their_results_make_the_round_trip(worker):
+    client = WorkerClient(worker.address, AUTHKEY)
+    assert client.call("status")["cam_is_running"] is True
+    assert client.call("available_cameras") == 2
+    assert client.call("profile", 0.5, "sample", 0.01) == "stacks"
+    assert worker.calls == [("profile", 0.5, "sample", 0.01)]
+
+
+def test_the_remote_camera_handler_forwards_to_the_worker(worker):
+    handler = RemoteCameraHandler(types.SimpleNamespace(), WorkerClient(worker.address, AUTHKEY))
+    assert handler.cam_is_running and not handler.cam_is_processing
+    handler.camera_start_processing()
+    assert worker.calls == ["start"]
+    # a failed command comes back as the error of the web request
+    with pytest.raises(InvalidUsage) as error:
+        handler.profile(1, "broken")
+    assert error.value.status_code == 409
+    assert "Unknown profiling mode" in error.value.message
+
+
+def test_a_wrong_key_or_a_missing_worker_is_reported(worker):
+    with pytest.raises(WorkerUnavailable):
+        WorkerClient(worker.address, b"wrong key").call("status")
+    handler = RemoteCameraHandler(types.SimpleNamespace(), WorkerClient(("127.0.0.1", 1), AUTHKEY))
+    assert handler.cam_is_running is False
+    assert handler.available_cameras() == 0
+
+
+def test_the_events_of_the_worker_are_republished(worker):
+    local = Broadcaster()
+    subscription = local.subscribe()
+    WorkerClient(worker.address, AUTHKEY).forward_events(local)
+    wait_for(lambda: worker.app.eb.subscriber_count == 1)
+    worker.app.eb.publish("arrived", {"name": "Ann"})
+    assert subscription.queue.get(timeout=5) == Broadcaster.serialize("arrived", {"name": "Ann"})
+
+
+def test_the_key_comes_from_the_config_or_the_environment(monkeypatch):
+    monkeypatch.delenv("RECOGNEYEZ_IPC_KEY", raising=False)
+    assert ipc_authkey({"IPC_AUTHKEY": "secret"}) == b"secret"
+    with pytest.raises(RuntimeError):
+        ipc_authkey({})
+    monkeypatch.setenv("RECOGNEYEZ_IPC_KEY", "from env")
+    assert ipc_authkey({}) == b"from env"
@@ -0,0 +1,301 @@
+import base64
+import shutil
+import smtplib
+import socket
+import socketserver
+import ssl
+import subprocess
+import threading
+import time
+import types
+
+import pytest
+
+from conftest import wait_for
+from Library.Mailer import EmailNotifier, MailDispatcher, Mailer
+
+
+class FakeMailer:
+    """Stands in for the Mailer, records the emails instead of sending them"""
+
+    def __init__(self, failures: int = 0):
+        self.smtpserver = None
+        self.sent = []
+        self.failures = failures
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def send_email(self, to_email, subject, msg):
+        if self.smtpserver is None:
+            self.smtpserver = object()
+            self.connections += 1
+        if self.failures:
+            self.failures -= 1
+            raise smtplib.SMTPServerDisconnected("connection lost")
+        with self.lock:
+            self.sent.append((to_email, subject, msg, time.monotonic()))
+
+    def close(self):
+        self.smtpserver = None
+
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """An in-process SMTP server speaking just enough of the protocol for smtplib, counts the handshakes"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tls_context: ssl.SSLContext = None):
+        super().__init__(("127.0.0.1", 0), SmtpStubHandler)
+        self.tls_context = tls_context
+        self.counts = dict(connections=0, ehlo=0, starttls=0, logins=0, messages=0, quit=0)
+        self.messages = []
+        self.sockets = []
+        self.lock = threading.Lock()
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def drop(self):
+        """Close the open sessions without a reply, like a server timing out the idle connections"""
+        with self.lock:
+            sockets, self.sockets = self.sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class SmtpStubHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.server.count("connections")
+        with self.server.lock:
+            self.server.sockets.append(self.request)
+        self.reader = self.request.makefile("rb")
+        self.reply("220 stub ESMTP")
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.split(" ")[0].upper()
+            if verb in ("EHLO", "HELO"):
+                self.server.count("ehlo")
+                extensions = ["AUTH PLAIN"] + (["STARTTLS"] if self.server.tls_context else [])
+                self.reply("\r\n".join(["250-stub"] + ["250-" + ext for ext in extensions[:-1]] +
+                                        ["250 " + extensions[-1]]))
+            elif verb == "STARTTLS":
+                self.server.count("starttls")
+                self.reply("220 ready")
+                self.request = self.server.tls_context.wrap_socket(self.request, server_side=True)
+                with self.server.lock:
+                    self.server.sockets.append(self.request)
+                self.reader = self.request.makefile("rb")
+            elif verb == "AUTH":
+                _, user, password = base64.b64decode(command.split(" ")[2]).split(b"\0")
+                self.server.count("logins")
+                self.reply("235 ok" if password == b"secret" else "535 bad credentials")
+            elif verb == "DATA":
+                self.reply("354 go on")
+                body = []
+                for data in iter(self.reader.readline, b""):
+                    if data == b".\r\n":
+                        break
+                    body.append(data)
+                self.server.count("messages")
+                with self.server.lock:
+                    self.server.messages.append(b"".join(body).decode())
+                self.reply("250 queued")
+            elif verb == "QUIT":
+                self.server.count("quit")
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+    def reply(self, text: str):
+        self.request.sendall(text.encode() + b"\r\n")
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "starttls"])
+def smtp_stub(request, tmp_path):
+    context = None
+    if request.param:
+        if shutil.which("openssl") is None:
+            pytest.skip("openssl is needed to create the test certificate")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                        "-keyout", str(tmp_path / "key.pem"), "-out", str(tmp_path / "cert.pem")],
+                       check=True, capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(str(tmp_path / "cert.pem"), str(tmp_path / "key.pem"))
+    server = SmtpStub(context)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.drop()
+    server.server_close()
+
+
+def stub_mailer(server: SmtpStub) -> Mailer:
+    return Mailer("camera@example.com", "secret", host="127.0.0.1", port=server.server_address[1],
+                  use_tls=server.tls_context is not None, timeout=5)
+
+
+def test_the_mailer_reuses_its_connection(smtp_stub):
+    mailer = stub_mailer(smtp_stub)
+    for name in ("Ann", "Bob", "Eve"):
+        mailer.send_email("admin@example.com", "{} arrived".format(name), "{} arrived".format(name))
+    mailer.close()
+    tls = 1 if smtp_stub.tls_context else 0
+    wait_for(lambda: smtp_stub.counts["quit"] == 1)
+    assert smtp_stub.counts == dict(connections=1, ehlo=1 + tls, starttls=tls, logins=1, messages=3, quit=1)
+    assert ["Subject: {} arrived".format(name) in message
+            for message, name in zip(smtp_stub.messages, ("Ann", "Bob", "Eve"))] == [True] * 3
+
+
+def test_the_mailer_reconnects_after_a_dropped_session(smtp_stub):
+    mailer = stub_mailer(smtp_stub)
+    mailer.send_email("admin@example.com", "Ann arrived", "Ann arrived")
+    smtp_stub.drop()
+    mailer.send_email("admin@example.com", "Bob arrived", "Bob arrived")
+    mailer.send_email("admin@example.com", "Eve arrived", "Eve arrived")
+    mailer.close()
+    wait_for(lambda: smtp_stub.counts["quit"] == 1)
+    assert (smtp_stub.counts["connections"], smtp_stub.counts["logins"], smtp_stub.counts["messages"]) == (2, 2, 3)
+
+
+def test_a_failed_login_closes_the_connection(smtp_stub):
+    mailer = stub_mailer(smtp_stub)
+    mailer.from_password = "wrong"
+    with pytest.raises(smtplib.SMTPAuthenticationError):
+        mailer.send_email("admin@example.com", "Ann arrived", "Ann arrived")
+    assert mailer.smtpserver is None
+    assert smtp_stub.counts["messages"] == 0
+
+
+def test_the_dispatcher_sends_a_burst_over_one_session(smtp_stub, dispatchers):
+    dispatcher = dispatchers(stub_mailer(smtp_stub), digest_seconds=0.1, cooldown_seconds=0.1, idle_seconds=0.2)
+    for name in ("Ann", "Bob", "Eve"):
+        dispatcher.notify("admin@example.com", "{} arrived".format(name), "{} arrived".format(name))
+    wait_for(lambda: smtp_stub.counts["messages"] == 1)
+    dispatcher.notify("admin@example.com", "Joe arrived", "Joe arrived")
+    wait_for(lambda: smtp_stub.counts["quit"] == 1)
+    assert (smtp_stub.counts["connections"], smtp_stub.counts["logins"], smtp_stub.counts["messages"]) == (1, 1, 2)
+
+
+@pytest.fixture
+def dispatchers():
+    created = []
+
+    def create(mailer, **kwargs):
+        dispatcher = MailDispatcher(mailer, **kwargs)
+        created.append(dispatcher)
+        return dispatcher
+    yield create
+    for dispatcher in created:
+        dispatcher.stop()
+
+
+def test_a_burst_is_sent_as_one_digest(dispatchers):
+    mailer = FakeMailer()
+    dispatcher = dispatchers(mailer, digest_seconds=0.2, cooldown_seconds=60)
+    for index in range(20):
+        dispatcher.notify("admin@example.com", "Person {} arrived".format(index), "Person {} arrived".format(index))
+    wait_for(lambda: mailer.sent)
+    time.sleep(0.3)
+    assert len(mailer.sent) == 1
+    to_email, subject, body, _ = mailer.sent[0]
+    assert to_email == "admin@example.com"
+    assert subject == "[recognEYEz] 20 notifications"
+    assert body.splitlines() == ["Person {} arrived".format(index) for index in range(20)]
+    assert mailer.connections == 1
+    assert dispatcher.metrics()["notifications"] == 20
+
+
+def test_a_single_notification_keeps_its_subject(dispatchers):
+    mailer = FakeMailer()
+    dispatcher = dispatchers(mailer, digest_seconds=0.05)
+    dispatcher.notify("admin@example.com", "Ann arrived", "[12:00] Ann arrived")
+    wait_for(lambda: mailer.sent)
+    assert mailer.sent[0][1:3] == ("Ann arrived", "[12:00] Ann arrived")
+
+
+def test_the_cooldown_holds_the_next_email_back(dispatchers):
+    mailer = FakeMailer()
+    dispatcher = dispatchers(mailer, digest_seconds=0.0, cooldown_seconds=0.5)
+    dispatcher.notify("admin@example.com", "Ann arrived", "Ann arrived")
+    wait_for(lambda: len(mailer.sent) == 1)
+    dispatcher.notify("admin@example.com", "Bob arrived", "Bob arrived")
+    dispatcher.notify("admin@example.com", "Eve arrived", "Eve arrived")
+    time.sleep(0.2)
+    assert len(mailer.sent) == 1
+    wait_for(lambda: len(mailer.sent) == 2)
+    assert mailer.sent[1][3] - mailer.sent[0][3] >= 0.5
+    assert mailer.sent[1][2] == "Bob arrived\nEve arrived"
+
+
+def test_a_notification_may_carry_its_own_cooldown(dispatchers):
+    mailer = FakeMailer()
+    dispatcher = dispatchers(mailer, digest_seconds=0.0, cooldown_seconds=60)
+    dispatcher.notify("admin@example.com", "Ann arrived", "Ann arrived", cooldown_seconds=0.2)
+    wait_for(lambda: len(mailer.sent) == 1)
+    dispatcher.notify("admin@example.com", "Bob arrived", "Bob arrived", cooldown_seconds=0.2)
+    wait_for(lambda: len(mailer.sent) == 2)
+    assert 0.2 <= mailer.sent[1][3] - mailer.sent[0][3] < 5
+
+
+def test_other_recipients_are_not_held_back_by_the_cooldown(dispatchers):
+    mailer = FakeMailer()
+    dispatcher = dispatchers(mailer, digest_seconds=0.0, cooldown_seconds=60)
+    dispatcher.notify("first@example.com", "Ann arrived", "Ann arrived")
+    dispatcher.notify("second@example.com", "Ann arrived", "Ann arrived")
+    wait_for(lambda: len(mailer.sent) == 2)
+    assert {email[0] for email in mailer.sent} == {"first@example.com", "second@example.com"}
+
+
+def test_a_failed_digest_is_retried_without_starting_the_cooldown(dispatchers):
+    mailer = FakeMailer(failures=1)
+    dispatcher = dispatchers(mailer, digest_seconds=0.0, cooldown_seconds=60, retry_seconds=0.1)
+    dispatcher.notify("admin@example.com", "Ann arrived", "Ann arrived")
+    wait_for(lambda: mailer.sent, timeout=2)
+    assert mailer.sent[0][2] == "Ann arrived"
+    metrics = dispatcher.metrics()
+    assert (metrics["failed"], metrics["sent"], metrics["dropped"]) == (1, 1, 0)
+
+
+def test_a_digest_is_dropped_after_max_attempts(dispatchers):
+    mailer = FakeMailer(failures=3)
+    dispatcher = dispatchers(mailer, digest_seconds=0.0, retry_seconds=0.01, max_attempts=3)
+    dispatcher.notify("admin@example.com", "Ann arrived", "Ann arrived")
+    wait_for(lambda: dispatcher.metrics()["failed"] == 3)
+    wait_for(lambda: dispatcher.metrics()["pending_recipients"] == 0)
+    assert dispatcher.metrics()["dropped"] == 1
+    assert mailer.sent == []
+
+
+def test_stop_sends_the_pending_digests():
+    mailer = FakeMailer()
+    dispatcher = MailDispatcher(mailer, digest_seconds=60)
+    dispatcher.notify("admin@example.com", "Ann arrived", "Ann arrived")
+    wait_for(lambda: dispatcher.metrics()["pending_recipients"] == 1)
+    dispatcher.stop()
+    assert [email[2] for email in mailer.sent] == ["Ann arrived"]
+    assert mailer.smtpserver is None
+
+
+def test_the_notifier_takes_the_cooldown_from_the_settings():
+    settings = {"e-notif": True, "email": "admin@example.com", "e-notif-kno": True, "e-notif-cooldown": 5}
+    app = types.SimpleNamespace(config=dict(MAIL_USERNAME="camera@example.com"),
+                                sh=types.SimpleNamespace(get_notification_settings=lambda: settings))
+    notifier = EmailNotifier(app)
+    notifier.stop()
+    calls = []
+    notifier.dispatcher.notify = lambda *args, **kwargs: calls.append(kwargs["cooldown_seconds"])
+    person = types.SimpleNamespace(name="Ann", unknown=False)
+    notifier.notify_arrived(person, "12:00")
+    del settings["e-notif-cooldown"]
+    notifier.notify_arrived(person, "12:05")
+    assert calls == [300, None]
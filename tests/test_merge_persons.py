@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+from Library.DatabaseHandler import Encoding, Image, Person, Presence
+
+START = datetime(2026, 3, 2, 12, 0)
+
+
+def test_more_sources_than_a_chunk_are_merged(dh):
+    target = dh.add_person("Ann", unknown=False)
+    # more than the 500 ids of a chunk, so the updates run in several statements
+    Person.insert_many([{"name": "unknown {}".format(i), "unknown": True, "first_seen": START + timedelta(days=i),
+                         "last_seen": START + timedelta(days=i)} for i in range(1200)]).execute()
+    sources = list(Person.select().where(Person.unknown == True))  # noqa: E712
+    Encoding.insert_many([{"person": person, "encoding": b"x"} for person in sources]).execute()
+    Image.insert_many([{"person": person, "name": "{}.jpg".format(person.name)} for person in sources]).execute()
+    Presence.insert_many([{"person": person, "start": START} for person in sources[::100]]).execute()
+
+    assert dh.merge_persons(sources, target) == 1200
+    assert [person.name for person in Person.select()] == ["Ann"]
+    assert Encoding.select().where(Encoding.person == target).count() == 1200
+    assert Image.select().where(Image.person == target).count() == 1200
+    assert Presence.select().where(Presence.person == target).count() == 12
+    target = Person.get_by_id(target.id)
+    assert target.first_seen == START
+    assert target.last_seen > START + timedelta(days=1000)
+
+
+def test_the_target_adopts_a_thumbnail_and_is_never_removed(dh):
+    target = dh.add_person("Ann", unknown=False)
+    source = dh.add_person("unknown 1")
+    source.add_image("1.jpg", set_as_thumbnail=True)
+    assert dh.merge_persons([target], target) == 0
+    assert dh.merge_persons([source, target], target) == 1
+    target = Person.get_by_id(target.id)
+    assert target.thumbnail.name == "1.jpg"
+    assert [person.name for person in dh.get_persons()] == ["Ann"]
+
+
+def test_images_are_moved_by_name(dh):
+    ann = dh.add_person("Ann", unknown=False)
+    bob = dh.add_person("Bob", unknown=False)
+    for i in range(3):
+        ann.add_image("{}.jpg".format(i))
+    assert dh.reassign_images(["0.jpg", "2.jpg", "missing.jpg"], bob) == 2
+    assert sorted(image.name for image in Image.select().where(Image.person == bob)) == ["0.jpg", "2.jpg"]
@@ -0,0 +1,95 @@
+from Library.metrics import LatencyHistogram, StageTimer, StageTimers, format_prometheus, histogram_samples
+
+
+def buckets(samples):
+    return [(labels["le"], value) for suffix, labels, value in samples if suffix == "_bucket"]
+
+
+def test_histogram_buckets_are_cumulative_and_end_with_inf():
+    histogram = LatencyHistogram()
+    for seconds in (0.0001, 0.001, 0.001, 0.01, 0.1, 20.0):
+        histogram.record(seconds)
+    samples = histogram_samples(histogram, {"stage": "detection"})
+    counts = [value for _, value in buckets(samples)]
+    assert counts == sorted(counts)
+    assert buckets(samples)[-1] == ("+Inf", 6)
+    # 20 s is over the largest bound, 10 s
+    assert buckets(samples)[-2] == ("10", 5)
+    assert ("_count", {"stage": "detection"}, 6) in samples
+
+
+def test_every_histogram_exports_the_same_bounds():
+    empty, busy = LatencyHistogram(), LatencyHistogram()
+    for index in range(1000):
+        busy.record(index / 1000)
+    assert [le for le, _ in buckets(histogram_samples(empty, {}))] == \
+        [le for le, _ in buckets(histogram_samples(busy, {}))]
+
+
+def test_bucket_counts_are_exact_at_the_bounds():
+    histogram = LatencyHistogram()
+    le, _ = buckets(histogram_samples(histogram, {}))[0]
+    histogram.record(float(le) * 0.999)
+    histogram.record(float(le) * 1.5)
+    assert buckets(histogram_samples(histogram, {}))[0] == (le, 1)
+
+
+def test_format_prometheus_renders_a_histogram():
+    histogram = LatencyHistogram()
+    histogram.record(0.002)
+    text = format_prometheus([("recogneyez_stage_latency_seconds", "histogram", "Latency",
+                               histogram_samples(histogram, {"stage": "detection"}))])
+    assert "# TYPE recogneyez_stage_latency_seconds histogram" in text
+    assert 'recogneyez_stage_latency_seconds_bucket{stage="detection",le="+Inf"} 1.0' in text
+    assert 'recogneyez_stage_latency_seconds_count{stage="detection"} 1.0' in text
+
+
+def test_percentiles_are_estimated_to_the_bucket_width():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) == 0.0
+    for index in range(1, 101):
+        histogram.record(index / 1000)
+    assert 0.05 <= histogram.percentile(0.5) <= 0.05 * 1.2
+    assert 0.095 <= histogram.percentile(0.95) <= 0.095 * 1.2
+    # never above the largest recorded latency
+    assert histogram.percentile(1.0) == 0.1
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert abs(summary["mean_ms"] - 50.5) < 1e-9
+
+
+def test_merged_histograms_add_up():
+    first, second = LatencyHistogram(), LatencyHistogram()
+    first.record(0.001)
+    second.record(0.002)
+    second.record(5.0)
+    first.merge(second)
+    assert (first.count, first.max) == (3, 5.0)
+    assert sum(first.counts) == 3
+
+
+def test_laps_record_the_time_spent_in_each_stage():
+    timer = StageTimer()
+    start = timer.start()
+    lap = timer.lap("capture", start - 0.01)
+    assert lap >= start
+    timer.lap("detection", lap)
+    timer.record("detection", 0.02)
+    summary = timer.summary()
+    assert summary["capture"]["count"] == 1
+    assert summary["capture"]["max_ms"] >= 10
+    assert summary["detection"]["count"] == 2
+
+
+def test_every_camera_has_its_own_timer():
+    timers = StageTimers()
+    door = timers.get("door")
+    assert timers.get("door") is door
+    door.record("capture", 0.001)
+    timers.get("garden").record("detection", 0.002)
+    assert sorted((camera, stage) for camera, stage, _ in timers.histograms()) == [("door", "capture"),
+                                                                                   ("garden", "detection")]
+    assert timers.summary()["garden"]["detection"]["count"] == 1
+    timers.reset()
+    assert timers.summary() == {}
+    assert timers.get("door") is not door
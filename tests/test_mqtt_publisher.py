@@ -0,0 +1,157 @@
+import threading
+import time
+import types
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from conftest import wait_for
+from Library.MqttPublisher import MessageSpool, MqttPublisher
+
+
+class FakeClient:
+    """Stands in for the paho client, records the published messages"""
+
+    def __init__(self):
+        self.published = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+        # cleared to hold the publisher thread inside publish
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def publish(self, topic, payload, qos):
+        self.entered.set()
+        self.gate.wait()
+        if self.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.published.append((topic, payload, qos))
+        return types.SimpleNamespace(rc=self.rc)
+
+
+class DroppingClient(FakeClient):
+    """Loses the connection at the given publish calls, like paho when the broker goes away mid-batch"""
+
+    def __init__(self, drop_at):
+        super().__init__()
+        self.drop_at = set(drop_at)
+        self.calls = 0
+        self.publisher = None
+
+    def publish(self, topic, payload, qos):
+        self.calls += 1
+        if self.calls in self.drop_at:
+            self.publisher.set_connected(False)
+            return types.SimpleNamespace(rc=mqtt.MQTT_ERR_NO_CONN)
+        return super().publish(topic, payload, qos)
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return MessageSpool(tmp_path.joinpath("spool.jsonl"))
+
+
+@pytest.fixture
+def publisher(client, spool):
+    publisher = MqttPublisher(client, spool, qos=1, max_queue=4)
+    yield publisher
+    client.gate.set()
+    publisher.stop()
+
+
+def test_publishes_while_connected(publisher, client):
+    publisher.set_connected(True)
+    for index in range(3):
+        assert publisher.submit("recogneyez", "message {}".format(index))
+    wait_for(lambda: len(client.published) == 3)
+    assert client.published == [("recogneyez", "message {}".format(index), 1) for index in range(3)]
+    assert publisher.metrics()["published"] == 3
+
+
+def test_spools_while_disconnected_and_replays_in_order(publisher, client, spool):
+    for index in range(3):
+        publisher.submit("recogneyez", "offline {}".format(index))
+    wait_for(lambda: publisher.metrics()["spooled"] == 3)
+    assert client.published == []
+    assert spool.read() == [("recogneyez", "offline {}".format(index), 1) for index in range(3)]
+
+    publisher.set_connected(True)
+    publisher.submit("recogneyez", "online")
+    wait_for(lambda: len(client.published) == 4)
+    assert [payload for _, payload, _ in client.published] == ["offline 0", "offline 1", "offline 2", "online"]
+    assert len(spool) == 0
+    assert not spool.path.exists()
+
+
+def test_refused_messages_are_spooled_and_not_overtaken(publisher, client, spool):
+    publisher.set_connected(True)
+    client.rc = mqtt.MQTT_ERR_NO_CONN
+    publisher.submit("recogneyez", "refused")
+    wait_for(lambda: publisher.metrics()["spooled"] == 1)
+    client.rc = mqtt.MQTT_ERR_SUCCESS
+    publisher.submit("recogneyez", "next")
+    wait_for(lambda: len(client.published) == 2)
+    assert [payload for _, payload, _ in client.published] == ["refused", "next"]
+
+
+def test_a_disconnect_mid_batch_delivers_every_message_once_in_order(spool):
+    # the 3rd call fails in the middle of the batch, the 5th in the middle of replaying the spool
+    client = DroppingClient(drop_at=(3, 5))
+    publisher = MqttPublisher(client, spool, batch_ms=100, max_queue=16)
+    client.publisher = publisher
+    publisher.set_connected(True)
+    expected = []
+    for index in range(6):
+        topic = "recogneyez/{}".format("ab"[index % 2])
+        publisher.submit(topic, "message {}".format(index))
+        expected.append((topic, "message {}".format(index), 1))
+    wait_for(lambda: publisher.metrics()["spool_depth"] == 4)
+    assert client.published == expected[:2]
+    assert spool.read() == expected[2:]
+
+    publisher.set_connected(True)
+    wait_for(lambda: publisher.metrics()["spool_depth"] == 3)
+    assert client.published == expected[:3]
+
+    publisher.set_connected(True)
+    wait_for(lambda: len(client.published) == 6)
+    publisher.stop()
+    assert client.published == expected
+    assert publisher.metrics()["spool_depth"] == 0
+    assert not spool.path.exists()
+
+
+def test_spool_survives_a_restart(client, spool):
+    first = MqttPublisher(client, spool)
+    first.submit("recogneyez", "before restart")
+    first.stop()
+    assert len(MessageSpool(spool.path)) == 1
+
+    second = MqttPublisher(client, MessageSpool(spool.path))
+    second.set_connected(True)
+    wait_for(lambda: len(client.published) == 1)
+    second.stop()
+    assert client.published == [("recogneyez", "before restart", 1)]
+
+
+def test_drops_messages_when_the_queue_is_full(publisher, client):
+    publisher.set_connected(True)
+    client.gate.clear()
+    publisher.submit("recogneyez", "in flight")
+    # the publisher thread is now blocked in publish, the queue fills up
+    assert client.entered.wait(5)
+    assert all(publisher.submit("recogneyez", "queued {}".format(index)) for index in range(4))
+    assert not publisher.submit("recogneyez", "dropped")
+    assert publisher.metrics()["dropped"] == 1
+    client.gate.set()
+    wait_for(lambda: len(client.published) == 5)
+    assert "dropped" not in [payload for _, payload, _ in client.published]
+
+
+def test_batch_joins_consecutive_messages_of_a_topic():
+    messages = [("a", "1", 1), ("a", "2", 1), ("b", "3", 1), ("a", "4", 1)]
+    assert MqttPublisher.batch(messages) == [("a", "1\n2", 1), ("b", "3", 1), ("a", "4", 1)]
@@ -0,0 +1,37 @@
+import numpy as np
+
+from Library.perceptual_hash import dhash, hamming, is_near_duplicate
+
+
+def gradient(width=64, height=48):
+    return np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+
+
+def test_a_slightly_changed_crop_has_a_close_hash():
+    image = gradient()
+    noisy = np.clip(image.astype(int) + np.random.default_rng(1).integers(-3, 4, image.shape), 0, 255)
+    assert hamming(dhash(image), dhash(noisy.astype(np.uint8))) <= 4
+
+
+def test_a_different_crop_has_a_distant_hash():
+    image = gradient()
+    assert hamming(dhash(image), dhash(image[:, ::-1].copy())) > 32
+
+
+def test_colour_and_grayscale_images_hash_the_same():
+    image = gradient()
+    assert dhash(np.dstack([image] * 3)) == dhash(image)
+
+
+def test_the_hash_fits_a_signed_64_bit_column():
+    value = dhash(gradient())
+    assert -(1 << 63) <= value < (1 << 63)
+    # the signed mapping doesn't change the distances
+    assert hamming(value, value ^ 1) == 1
+
+
+def test_near_duplicates_are_found_among_the_recent_hashes():
+    value = dhash(gradient())
+    assert is_near_duplicate(value, [None, value ^ 0b11], max_distance=2)
+    assert not is_near_duplicate(value, [None, value ^ 0b111], max_distance=2)
+    assert not is_near_duplicate(value, [], max_distance=64)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from blueprints.persons_database.routes import persons_database
+from conftest import logged_in_client
+from Library.DatabaseHandler import Person
+
+START = datetime(2026, 3, 2, 12, 0)
+
+
+@pytest.fixture
+def persons(dh):
+    """Five known persons seen one after the other, Ann last, and an unknown one seen before them"""
+    for i, name in enumerate(["Eve", "Dan", "Cid", "Bob", "Ann"]):
+        person = dh.add_person(name, unknown=False)
+        person.last_seen = START + timedelta(hours=i)
+        person.save()
+        for j in range(i):
+            person.add_image("{}{}.jpg".format(name, j), set_as_thumbnail=j == 0)
+    unknown = dh.add_person("unknown 1")
+    unknown.last_seen = START - timedelta(hours=1)
+    unknown.save()
+    return dh
+
+
+def test_a_page_holds_the_persons_with_their_thumbnails_and_image_counts(persons):
+    first, total = persons.get_person_page(False, page=1, page_size=2)
+    second, _ = persons.get_person_page(False, page=2, page_size=2)
+    assert total == 5
+    assert [person.name for person in first + second] == ["Ann", "Bob", "Cid", "Dan"]
+    assert [person.image_count for person in first] == [4, 3]
+    assert first[0].thumbnail.name == "Ann0.jpg"
+    unknown, unknown_total = persons.get_person_page(True)
+    assert [person.name for person in unknown] == ["unknown 1"] and unknown_total == 1
+
+
+def test_a_page_is_searched_and_sorted(persons):
+    by_name, _ = persons.get_person_page(False, sort="name")
+    assert [person.name for person in by_name] == ["Ann", "Bob", "Cid", "Dan", "Eve"]
+    by_images, _ = persons.get_person_page(False, sort="images")
+    assert [person.image_count for person in by_images] == [4, 3, 2, 1, 0]
+    found, total = persons.get_person_page(False, search="n")
+    assert [person.name for person in found] == ["Ann", "Dan"] and total == 2
+    # an unknown sort falls back to the last seen order
+    assert persons.get_person_page(False, sort="nonsense")[0][0].name == "Ann"
+
+
+def test_the_names_are_searched_most_recently_seen_first(persons):
+    assert persons.search_person_names(limit=3) == ["Ann", "Bob", "Cid"]
+    assert persons.search_person_names("an", exclude="Ann") == ["Dan"]
+    # never seen persons come last
+    Person.update(last_seen=None).where(Person.name == "Ann").execute()
+    assert persons.search_person_names()[-1] == "Ann"
+
+
+def test_the_search_route_limits_the_names(web_app, persons):
+    web_app.register_blueprint(persons_database)
+    web_app.dh = persons
+    client = logged_in_client(web_app)
+    assert client.get("/_search_persons?q=b").get_json() == {"names": ["Bob"]}
+    assert client.get("/_search_persons?limit=0").get_json() == {"names": ["Ann"]}
+    assert len(client.get("/_search_persons?limit=1000").get_json()["names"]) == 6
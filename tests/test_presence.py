@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from Library.DatabaseHandler import DatabaseHandler, Person, Presence
+
+SINCE = datetime(2026, 3, 2, 12, 0)
+UNTIL = SINCE + timedelta(hours=1)
+
+
+def interval(person, start, end=None, camera="door"):
+    return Presence.create(person=person, camera=camera, start=start, end=end,
+                           seconds=(end - start).total_seconds() if end else None)
+
+
+def test_get_presence_finds_every_overlapping_interval(dh):
+    ann = dh.add_person("Ann", unknown=False)
+    bob = dh.add_person("Bob", unknown=False)
+    # a day long interval of Bob long ago, it must not widen the search of Ann's intervals
+    interval(bob, SINCE - timedelta(days=30), SINCE - timedelta(days=29))
+    spanning = interval(ann, SINCE - timedelta(minutes=20), SINCE + timedelta(minutes=10))
+    inside = interval(ann, SINCE + timedelta(minutes=20), SINCE + timedelta(minutes=30))
+    still_open = interval(bob, SINCE + timedelta(minutes=50))
+    # outside the range
+    interval(ann, SINCE - timedelta(minutes=40), SINCE - timedelta(minutes=30))
+    interval(ann, UNTIL, UNTIL + timedelta(minutes=5))
+
+    intervals = dh.get_presence(SINCE, UNTIL)
+    assert [found.id for found in intervals] == [spanning.id, inside.id, still_open.id]
+    assert [found.person.name for found in intervals] == ["Ann", "Ann", "Bob"]
+    assert [found.id for found in dh.get_presence(SINCE, UNTIL, "Bob")] == [still_open.id]
+
+
+def test_an_interval_as_long_as_the_longest_of_its_person_is_found(dh):
+    ann = dh.add_person("Ann", unknown=False)
+    longest = interval(ann, SINCE - timedelta(hours=5), SINCE + timedelta(seconds=1))
+    assert [found.id for found in dh.get_presence(SINCE, UNTIL)] == [longest.id]
+
+
+def test_occupancy_is_clipped_to_the_range():
+    ann = Person(name="Ann")
+    intervals = [Presence(start=SINCE - timedelta(minutes=20), end=SINCE + timedelta(minutes=10)),
+                 Presence(start=SINCE + timedelta(minutes=50), end=UNTIL + timedelta(minutes=30))]
+    for found in intervals:
+        found.person = ann
+    assert DatabaseHandler.occupancy(intervals, SINCE, UNTIL) == {"Ann": 20 * 60.0}
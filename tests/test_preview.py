@@ -0,0 +1,69 @@
+import os
+import types
+
+import numpy as np
+import pytest
+
+from Library.framebus import FrameBus
+from Library.PreviewHandler import PreviewHandler
+
+
+def frame(value: int):
+    return np.full((24, 32, 3), value, np.uint8)
+
+
+@pytest.fixture
+def bus_name():
+    return "recogneyez_test_{}".format(os.getpid())
+
+
+def test_a_recreated_bus_is_not_served_from_the_old_cache(bus_name):
+    first = FrameBus.create(bus_name, slots=2, max_resolution=(32, 24), meta_size=256)
+    reader = PreviewHandler(types.SimpleNamespace(), bus_name=bus_name)
+    reader.bus_check_seconds = 0
+    try:
+        first.write(frame(0))
+        assert reader.sequence == 1
+        _, old_jpeg = reader.get_jpeg()
+        old_etag = reader.etag(1)
+        old_bus = reader.bus
+        assert not reader.wait_for_frame(1, 0.05)
+
+        # the camera process restarts, its new bus starts counting from 1 again
+        first.close()
+        second = FrameBus.create(bus_name, slots=2, max_resolution=(32, 24), meta_size=256)
+        second.write(frame(255))
+        assert reader.wait_for_frame(1, 0.05)
+        assert reader.sequence == 1
+        sequence, new_jpeg = reader.get_jpeg()
+        assert sequence == 1
+        assert new_jpeg != old_jpeg
+        assert reader.etag(1) != old_etag
+        assert reader.bus is not old_bus
+        assert old_bus.control is None and old_bus.shm.buf is None
+    finally:
+        reader.bus.close()
+        second.close()
+
+
+
+def test_the_overlay_is_only_drawn_for_the_requested_frames():
+    preview = PreviewHandler(types.SimpleNamespace())
+    labels = [((4, 20, 20, 4), "Ann", True)]
+    for value in range(3):
+        preview.publish(frame(value), [(4, 20, 20, 4)], labels)
+    assert preview.annotation_stats()["annotated_frames"] == 0
+    first = preview.get_jpeg()
+    assert preview.get_jpeg() == first
+    stats = preview.annotation_stats()
+    assert (stats["annotated_frames"], stats["skipped_frames"]) == (1, 2)
+
+
+def test_headless_mode_never_draws_the_overlay():
+    preview = PreviewHandler(types.SimpleNamespace(), headless=True)
+    placeholder = preview.frame
+    for value in range(3):
+        preview.publish(frame(value), [(4, 20, 20, 4)], [((4, 20, 20, 4), "Ann", True)])
+    assert preview.frame is placeholder
+    stats = preview.annotation_stats()
+    assert (stats["annotated_frames"], stats["annotation_seconds"], stats["skipped_frames"]) == (0, 0.0, 3)
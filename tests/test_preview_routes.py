@@ -0,0 +1,76 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import logged_in_client
+from blueprints.actions.routes import actions
+from Library.PreviewHandler import PreviewHandler
+
+
+def frame(value: int, width: int = 320):
+    return np.full((width * 3 // 4, width, 3), value, np.uint8)
+
+
+@pytest.fixture
+def preview(web_app):
+    web_app.register_blueprint(actions)
+    web_app.ph = PreviewHandler(types.SimpleNamespace(), max_viewers=1)
+    web_app.ph.publish(frame(0))
+    return web_app.ph
+
+
+@pytest.fixture
+def client(web_app, preview):
+    return logged_in_client(web_app)
+
+
+def test_the_stream_sends_the_current_frame_as_a_multipart_part(client, preview):
+    response = client.get("/stream")
+    assert response.mimetype == "multipart/x-mixed-replace"
+    part = next(iter(response.response))
+    _, jpeg = preview.get_jpeg()
+    assert part.startswith(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode())
+    assert part.endswith(jpeg + b"\r\n")
+    response.close()
+
+
+def test_the_viewers_over_the_limit_are_turned_away(client, preview):
+    first = client.get("/stream")
+    assert client.get("/stream").status_code == 503
+    first.close()
+    assert preview.viewers == 0
+    second = client.get("/stream")
+    assert second.status_code == 200
+    second.close()
+
+
+def test_an_unchanged_frame_is_answered_with_304(client, preview):
+    encoded = []
+    encode = preview._encode
+    preview._encode = lambda *args: encoded.append(args[1]) or encode(*args)
+
+    first = client.get("/preview")
+    assert first.status_code == 200 and first.mimetype == "image/jpeg"
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+    cached = client.get("/preview", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert client.get("/preview").data == first.data
+    assert len(encoded) == 1
+
+    preview.publish(frame(255))
+    changed = client.get("/preview", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert len(encoded) == 2
+
+
+def test_the_thumbnail_has_its_own_etag_and_size(client, preview):
+    full = client.get("/preview")
+    thumb = client.get("/preview?size=thumb")
+    assert thumb.headers["ETag"] != full.headers["ETag"]
+    image = cv2.imdecode(np.frombuffer(thumb.data, np.uint8), cv2.IMREAD_COLOR)
+    assert image.shape[1] == PreviewHandler.thumbnail_width
+    assert client.get("/preview?size=thumb", headers={"If-None-Match": thumb.headers["ETag"]}).status_code == 304
@@ -0,0 +1,107 @@
+import marshal
+import threading
+import types
+
+import pytest
+
+from blueprints.actions.routes import actions
+from conftest import logged_in_client
+from Library.CameraHandler import CameraHandler
+from Library.errors import InvalidUsage
+from Library.profiling import ThreadProfile, sample_stacks
+
+
+def busy_loop(stop: threading.Event, tick=None):
+    while not stop.is_set():
+        if tick is not None:
+            tick()
+        sum(range(1000))
+
+
+@pytest.fixture
+def running():
+    """Starts a busy loop on a thread, stops it at the end of the test"""
+    stop = threading.Event()
+    threads = []
+
+    def start(tick=None):
+        thread = threading.Thread(target=busy_loop, args=(stop, tick), daemon=True)
+        thread.start()
+        threads.append(thread)
+        return thread
+
+    yield start
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+
+def test_the_stacks_of_a_thread_are_sampled_in_the_collapsed_format(running):
+    thread = running()
+    stacks = sample_stacks(thread.ident, 0.2, interval=0.005)
+    lines = stacks.splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "test_profiling.py:busy_loop" in stack.split(";")
+
+
+def test_sampling_a_finished_thread_stops_right_away():
+    thread = threading.Thread(target=lambda: None)
+    thread.start()
+    thread.join()
+    assert sample_stacks(thread.ident, 10) == ""
+
+
+def test_the_profiled_thread_runs_the_profiler_for_the_given_time(running):
+    profile = ThreadProfile(0.2)
+    running(profile.tick)
+    assert profile.wait(5)
+    # the calls made by the loop while the profiler was on
+    assert "builtins.sum" in profile.text()
+    assert any("builtins.sum" in name for _, _, name in marshal.loads(profile.pstats_dump()))
+
+
+def test_a_stopped_profile_finishes_on_the_next_tick(running):
+    profile = ThreadProfile(3600)
+    running(profile.tick)
+    profile.stop()
+    assert profile.wait(5)
+
+
+def camera_handler(thread=None):
+    settings = types.SimpleNamespace(camera_source="door")
+    app = types.SimpleNamespace(config=dict(), camera_thread=thread,
+                                sh=types.SimpleNamespace(get_face_recognition_snapshot=lambda: settings))
+    handler = CameraHandler(app)
+    handler.camera_source = "door"
+    return handler
+
+
+def test_the_camera_loop_is_profiled_from_another_thread(running):
+    handler = camera_handler()
+    handler.app.camera_thread = running(handler.prepare_next_frame)
+    assert "builtins.sum" in handler.profile(0.2, "cprofile-text")
+    assert "busy_loop" in handler.profile(0.2, "sample", 0.005)
+    assert handler.thread_profile is None
+
+
+def test_profiling_errors_are_reported(running):
+    with pytest.raises(InvalidUsage) as error:
+        camera_handler().profile(1)
+    assert error.value.status_code == 409
+    handler = camera_handler(running())
+    with pytest.raises(InvalidUsage):
+        handler.profile(1, "nonsense")
+    handler._profile_lock.acquire()
+    with pytest.raises(InvalidUsage) as error:
+        handler.profile(1)
+    assert error.value.status_code == 409
+
+
+def test_the_route_rejects_non_finite_arguments(web_app):
+    web_app.register_blueprint(actions)
+    client = logged_in_client(web_app)
+    assert client.get("/profile?seconds=nan").status_code == 400
+    assert client.get("/profile?interval_ms=inf").status_code == 400
+    assert client.get("/profile?seconds=ten").status_code == 400
@@ -0,0 +1,63 @@
+import types
+
+import pytest
+
+from Library.DatabaseHandler import DatabaseHandler
+
+# the index every hot query has to be answered from
+EXPECTED_INDEXES = {
+    "person by name": "person_name",
+    "unknown persons": "person_unknown",
+    "recently seen persons": "person_last_seen",
+    "images of a person": "image_person_id",
+    "image by name": "image_name",
+    "encodings of a person": "encoding_person_id",
+    "events in a time range": "userevent_datetime",
+    "presence of a person in a time range": "presence_person_id_start",
+    "open presence intervals": "presence_end",
+    "latest events of a kind": "userevent_kind",
+}
+
+
+@pytest.fixture(scope="module")
+def dh(tmp_path_factory):
+    handler = DatabaseHandler(types.SimpleNamespace(config=dict()),
+                              str(tmp_path_factory.mktemp("db").joinpath("recogneyez.db")))
+    yield handler
+    handler.writer.stop()
+    handler.database.close()
+
+
+def query_plan(dh, query):
+    sql, params = query.sql()
+    return [row[-1] for row in dh.database.execute_sql("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def test_every_hot_query_has_an_expected_index(dh):
+    assert set(dh.hot_queries()) == set(EXPECTED_INDEXES)
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED_INDEXES))
+def test_hot_query_uses_its_index(dh, name):
+    plan = query_plan(dh, dh.hot_queries()[name])
+    assert any("USING INDEX {} ".format(EXPECTED_INDEXES[name]) in step
+               or "USING COVERING INDEX {} ".format(EXPECTED_INDEXES[name]) in step for step in plan), plan
+    assert not any(step.startswith("SCAN") and "INDEX" not in step for step in plan), plan
+
+
+def reconnect(dh):
+    # the connection caches the prepared EXPLAIN statements with their plans
+    dh.database.close()
+    dh.database.connect()
+
+
+def test_check_query_plans_reports_a_missing_index(dh):
+    assert dh.check_query_plans() == []
+    dh.database.execute_sql("DROP INDEX image_name")
+    reconnect(dh)
+    try:
+        assert dh.check_query_plans() == ["image by name"]
+    finally:
+        dh.database.execute_sql('CREATE UNIQUE INDEX "image_name" ON "image" ("name")')
+        reconnect(dh)
+    assert dh.check_query_plans() == []
@@ -0,0 +1,108 @@
+import json
+import shutil
+import types
+from pathlib import Path
+
+import pytest
+
+from Library.SettingsHandler import FaceRecognitionSnapshot, SettingsHandler
+
+DATA_FOLDER = Path(__file__).resolve().parent.parent.joinpath("Data")
+
+
+@pytest.fixture
+def settings_folder(tmp_path, monkeypatch):
+    """A copy of the default setting files in the working directory of the test"""
+    shutil.copytree(str(DATA_FOLDER), str(tmp_path.joinpath("Data")))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path.joinpath("Data")
+
+
+def settings_handler() -> SettingsHandler:
+    # checks the files on every access
+    return SettingsHandler(types.SimpleNamespace(config={"SETTINGS_POLL_SECONDS": 0}))
+
+
+def test_the_snapshot_holds_the_typed_settings_of_the_selected_camera(settings_folder):
+    snapshot = settings_handler().get_face_recognition_snapshot()
+    assert snapshot.selected_setting == "Gabor presetje"
+    assert (snapshot.preferred_id, snapshot.url, snapshot.resolution, snapshot.flip_cam) == (
+        0, "http://asdad", "vga", False)
+    assert snapshot.dnn_threshold == 0.5 and isinstance(snapshot.dnn_threshold, float)
+    assert snapshot.dnn_scan_freq == 100
+    # the replay settings fall back to their defaults
+    assert (snapshot.replay_mode, snapshot.replay_step, snapshot.replay_loop) == ("realtime", 1, False)
+    with pytest.raises(AttributeError):
+        snapshot.dnn_threshold = 0.9
+
+
+def test_the_strings_of_the_form_are_parsed():
+    snapshot = FaceRecognitionSnapshot.from_settings(
+        {"selected-setting": "a", "dnn-tresh": "0.7", "dnn-scan-freq": "20"},
+        {"preferred-id": "-2", "flip-cam": "true", "replay-step": "5"})
+    assert (snapshot.dnn_threshold, snapshot.dnn_scan_freq) == (0.7, 20)
+    assert (snapshot.preferred_id, snapshot.replay_step) == (-2, 5)
+    # only a real bool turns the flip on
+    assert snapshot.flip_cam is False
+
+
+def test_a_save_replaces_the_snapshot_as_a_whole(settings_folder):
+    handler = settings_handler()
+    before = handler.get_face_recognition_snapshot()
+    handler.save_face_rec_configuration({"selected-setting-static": "Gabor presetje", "setting-name": "Gabor presetje",
+                                         "dnn-tresh-static": 0.8, "resolution": "qvga"})
+    after = handler.get_face_recognition_snapshot()
+    assert after is not before
+    assert (before.dnn_threshold, before.resolution) == (0.5, "vga")
+    assert (after.dnn_threshold, after.resolution) == (0.8, "qvga")
+    assert after.camera_source != before.camera_source
+    assert handler.get_face_recognition_snapshot() is after
+
+
+def test_a_save_atomically_replaces_the_file_and_bumps_its_version(settings_folder):
+    handler = settings_handler()
+    assert handler.get_face_recognition_version() == 0
+    handler.add_camera_setting()
+    handler.save_notification_configuration({"e-notif-cooldown": 5.0})
+    assert handler.get_face_recognition_version() == 1
+    saved = json.loads(settings_folder.joinpath("FaceRecSettings.json").read_text())
+    assert saved["version"] == 1 and saved["camera-settings"][-1]["setting-name"] == "Preset 0"
+    assert json.loads(settings_folder.joinpath("NotificationSettings.json").read_text())["e-notif-cooldown"] == 5.0
+    assert not list(settings_folder.glob("*.tmp"))
+
+
+def test_a_failed_save_leaves_the_file_alone(settings_folder):
+    handler = settings_handler()
+    original = settings_folder.joinpath("FaceRecSettings.json").read_text()
+    with pytest.raises(TypeError):
+        handler.save_face_rec_configuration({"selected-setting-static": "Gabor presetje",
+                                             "setting-name": "Gabor presetje", "URL": object()})
+    assert settings_folder.joinpath("FaceRecSettings.json").read_text() == original
+    assert not list(settings_folder.glob("*.tmp"))
+    assert handler.get_face_recognition_snapshot().url == "http://asdad"
+
+
+def test_the_saves_of_another_process_are_picked_up(settings_folder):
+    handler, other = settings_handler(), settings_handler()
+    snapshot = handler.get_face_recognition_snapshot()
+    notifications = handler.get_notification_settings()
+    other.save_face_rec_configuration({"selected-setting-static": "Gabor presetje", "setting-name": "Gabor presetje",
+                                       "dnn-tresh-static": 0.8})
+    other.save_notification_configuration({"e-notif-cooldown": 5.0})
+    # found by the dictionary getter, the snapshot is rebuilt on its next access too
+    assert handler.get_face_recognition_settings()["dnn-tresh"] == 0.8
+    assert handler.get_face_recognition_snapshot().dnn_threshold == 0.8
+    assert snapshot.dnn_threshold == 0.5
+    assert handler.get_notification_settings()["e-notif-cooldown"] == 5.0
+    assert "e-notif-cooldown" not in notifications
+
+
+def test_the_files_are_checked_once_per_poll_interval(settings_folder):
+    handler = SettingsHandler(types.SimpleNamespace(config={"SETTINGS_POLL_SECONDS": 3600}))
+    handler.get_face_recognition_settings()
+    settings_handler().add_camera_setting()
+    assert not handler.check_for_changes()
+    assert handler.get_face_recognition_version() == 0
+    assert handler.check_for_changes(force=True)
+    assert handler.get_face_recognition_version() == 1
+    assert not handler.check_for_changes(force=True)
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+import pytest
+
+from blueprints.actions.routes import actions
+from conftest import logged_in_client
+from Library import thumbnails
+from Library.DatabaseHandler import Image
+
+
+def picture(value: int, width: int = 640):
+    return np.full((width * 3 // 4, width, 3), value, np.uint8)
+
+
+@pytest.fixture(autouse=True)
+def folder(tmp_path, monkeypatch):
+    """The thumbnails and pictures go to a temporary Static/Images folder"""
+    monkeypatch.chdir(tmp_path)
+    images = tmp_path.joinpath("Static", "Images")
+    images.mkdir(parents=True)
+    return images
+
+
+def test_the_name_changes_with_the_content():
+    name = thumbnails.thumbnail_name("1.jpg", picture(10))
+    assert name.startswith("1_") and name.endswith(".jpg")
+    assert thumbnails.thumbnail_name("1.jpg", picture(10)) == name
+    assert thumbnails.thumbnail_name("1.jpg", picture(11)) != name
+
+
+def test_a_thumbnail_is_downscaled_to_the_size_of_its_longer_side():
+    assert thumbnails.make_thumbnail(picture(10)).shape == (120, 160, 3)
+    small = picture(10, width=100)
+    assert thumbnails.make_thumbnail(small) is small
+    assert thumbnails.write_thumbnail("1_abc.jpg", picture(10))
+    assert cv2.imread(str(thumbnails.thumbnail_folder_path.joinpath("1_abc.jpg"))).shape == (120, 160, 3)
+
+
+def test_the_missing_thumbnails_are_backfilled(dh, folder):
+    person = dh.add_person("Ann", unknown=False)
+    cv2.imwrite(str(folder.joinpath("1.jpg")), picture(10))
+    person.add_image("1.jpg")
+    person.add_image("gone.jpg")
+    person.add_image("2.jpg", thumb="2_done.jpg")
+    assert thumbnails.backfill_thumbnails(dh, folder) == {"created": 1, "missing": 1}
+    name = Image.get(Image.name == "1.jpg").thumb
+    assert name.startswith("1_")
+    assert thumbnails.thumbnail_folder_path.joinpath(name).exists()
+
+
+def test_a_thumbnail_is_served_with_a_long_cache_lifetime(web_app):
+    web_app.register_blueprint(actions)
+    client = logged_in_client(web_app)
+    thumbnails.write_thumbnail("1_abc.jpg", picture(10))
+    response = client.get("/thumbnail/1_abc.jpg")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "private, max-age=31536000, immutable"
+    assert client.get("/thumbnail/1_abc.jpg", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    with web_app.test_request_context():
+        assert thumbnails.thumbnail_url(Image(name="1.jpg", thumb="1_abc.jpg")) == "/thumbnail/1_abc.jpg"
+        assert thumbnails.thumbnail_url(Image(name="1.jpg")) == "/static/Images/1.jpg"
+        assert thumbnails.thumbnail_url(None) == "/static/empty_pic.png"
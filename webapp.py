@@ -1,132 +1,212 @@
-import datetime
-from flask import Flask
-from flask_admin import Admin
-from flask_simplelogin import SimpleLogin
-import logging
-import cv2
-from pathlib import Path
-from nacl.pwhash import InvalidkeyError
-
-from Library.FaceHandler import FaceHandler
-from Library.CameraHandler import CameraHandler
-from Library.SettingsHandler import SettingsHandler
-from Library.DatabaseHandler import DatabaseHandler
-from Library.MqttHandler import MqttHandler
-from config import Config
-
-
-class FHApp(Flask):
-    fh: FaceHandler = None
-    ch: CameraHandler = None
-    sh: SettingsHandler = None
-    dh: DatabaseHandler = None
-    mh: MqttHandler = None
-
-
-app: FHApp
-
-
-def validate_login(login_form):
-    """ Override simple_login's loginchecker, thus allowing the use of encrypted passwords """
-    try:
-        app.dh.get_user_by_name(login_form['username']).verify(login_form['password'])
-        return True
-    except InvalidkeyError:
-        logging.error("Invalid password given for the user {}".format(login_form['username']))
-        return False
-    except Exception:
-        return False
-
-
-def on_known_enters(trackings):
-    """ Custom behaviour for the facehandler's callback method of the same name """
-    for tracked in trackings:
-        logging.info("Entered: {}".format(tracked.person.name))
-        app.mh.publish(
-            app.fh.notification_settings["topic"],
-            "[recognEYEz][ARRIVED][date: {}]: {} - {}".format(datetime.datetime.now().strftime(app.config["TIME_FORMAT"]),
-                                                              tracked.person.name,
-                                                              tracked.person.preference)
-        )
-        app.dh.log_event("[ARRIVED]: {}".format(tracked.person.name))
-        logging.info("[ARRIVED]: {}".format(tracked.person.name))
-
-
-def on_known_leaves(trackings):
-    """ Custom behaviour for the facehandler's callback method of the same name """
-    for tracked in trackings:
-        app.mh.publish(
-            app.fh.notification_settings["topic"],
-            "[recognEYEz][LEFT][date: {}]: {}".format(datetime.datetime.now().strftime(app.config["TIME_FORMAT"]),
-                                                      tracked.person.name)
-        )
-        app.dh.log_event("[LEFT]: {}".format(tracked.person.name))
-        logging.info("[LEFT]: {}".format(tracked.person.name))
-
-
-def init_app(app: FHApp, db_loc="recogneyez.db"):
-    """ Initializes handlers instance """
-    if not app.dh:
-        app.dh = DatabaseHandler(app, db_loc)
-    if not app.sh:
-        app.sh = SettingsHandler(app)
-    if not app.mh:
-        app.mh = MqttHandler(app)
-        app.mh.subscribe(app.sh.get_notification_settings()["topic"])
-        logging.info("MQTT connected")
-    if not app.ch:
-        app.ch = CameraHandler(app)
-    if not app.fh:
-        app.fh = FaceHandler(app,
-                             db_loc,
-                             cascade_xml="haarcascade_frontalface_default.xml",
-                             img_root=Path("Static").joinpath("dnn")
-                             )
-        app.fh.running_since = datetime.datetime.now()
-        # override the callback methods
-        app.fh.on_known_face_enters = on_known_enters
-        app.fh.on_known_face_leaves = on_known_leaves
-
-# parameter is the config Class from config.py
-def create_app(config_class=Config):
-    global app
-    app = FHApp(__name__, static_url_path='', static_folder='./Static', template_folder='./Templates')
-    app.config.from_object(config_class)
-    # t = threading.Thread(target=init_fh, args=(app,))
-    # t.start()
-    init_app(app)
-
-    # import the blueprints
-    from blueprints.live_view.routes import live_view
-    app.register_blueprint(live_view)
-
-    from blueprints.config_page.routes import config_page
-    app.register_blueprint(config_page)
-
-    from blueprints.persons_database.routes import persons_database
-    app.register_blueprint(persons_database)
-
-    from blueprints.person_edit.routes import person_edit
-    app.register_blueprint(person_edit)
-
-    from blueprints.actions.routes import actions
-    app.register_blueprint(actions)
-
-    from blueprints.errors.handlers import errors
-    app.register_blueprint(errors)
-
-    app.dnn_iter = 0
-    app.present = []
-    app.admin = Admin(app, name='recogneyez', template_mode='bootstrap3')
-    app.ticker = 0
-
-    SimpleLogin(app, login_checker=validate_login)
-    # cache_buster.register_cache_buster(app)
-    app.force_rescan = False
-
-    app.preview_image = cv2.imread("Static/empty_pic.png")
-
-    app.camera_thread = None
-
-    # app.ch.camera_start_processing()
-    return app
+import atexit
+import datetime
+from flask import Flask
+from flask_admin import Admin
+from flask_simplelogin import SimpleLogin
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING
+from nacl.pwhash import InvalidkeyError
+
+from Library.CameraHandler import CameraHandler, OpencvCamera
+from Library.SettingsHandler import SettingsHandler
+from Library.DatabaseHandler import DatabaseHandler
+from Library.MqttHandler import MqttHandler
+from Library.Mailer import EmailNotifier
+from Library.PreviewHandler import PreviewHandler
+from Library.framebus import FrameBus
+from Library.broadcast import Broadcaster
+from config import Config
+
+if TYPE_CHECKING:
+    # the web processes of a production setup don't load the face recognition libraries
+    from Library.FaceHandler import FaceHandler
+
+
+class FHApp(Flask):
+    fh: 'FaceHandler' = None
+    ch: CameraHandler = None
+    sh: SettingsHandler = None
+    dh: DatabaseHandler = None
+    mh: MqttHandler = None
+    en: EmailNotifier = None
+    ph: PreviewHandler = None
+    eb: Broadcaster = None
+
+
+app: FHApp
+
+
+def validate_login(login_form):
+    """ Override simple_login's loginchecker, thus allowing the use of encrypted passwords """
+    try:
+        app.dh.get_user_by_name(login_form['username']).verify(login_form['password'])
+        return True
+    except InvalidkeyError:
+        logging.error("Invalid password given for the user {}".format(login_form['username']))
+        return False
+    except Exception:
+        return False
+
+
+def on_known_enters(trackings):
+    """ Custom behaviour for the facehandler's callback method of the same name """
+    for tracked in trackings:
+        logging.info("Entered: {}".format(tracked.person.name))
+        app.eb.publish("arrived", {"name": tracked.person.name,
+                                   "datetime": datetime.datetime.now().strftime(app.config["TIME_FORMAT"])})
+        app.mh.publish(
+            app.sh.get_notification_settings()["topic"],
+            "[recognEYEz][ARRIVED][date: {}]: {} - {}".format(datetime.datetime.now().strftime(app.config["TIME_FORMAT"]),
+                                                              tracked.person.name,
+                                                              tracked.person.preference)
+        )
+        app.en.notify_arrived(tracked.person, datetime.datetime.now().strftime(app.config["TIME_FORMAT"]))
+        app.dh.log_event("[ARRIVED]: {}".format(tracked.person.name), "arrived", tracked.person.name)
+        app.dh.presence_started(tracked.person, app.sh.get_face_recognition_snapshot().selected_setting,
+                                tracked.first_seen)
+        logging.info("[ARRIVED]: {}".format(tracked.person.name))
+
+
+def on_known_leaves(trackings):
+    """ Custom behaviour for the facehandler's callback method of the same name """
+    for tracked in trackings:
+        app.eb.publish("left", {"name": tracked.person.name,
+                                "datetime": datetime.datetime.now().strftime(app.config["TIME_FORMAT"])})
+        app.mh.publish(
+            app.sh.get_notification_settings()["topic"],
+            "[recognEYEz][LEFT][date: {}]: {}".format(datetime.datetime.now().strftime(app.config["TIME_FORMAT"]),
+                                                      tracked.person.name)
+        )
+        app.dh.log_event("[LEFT]: {}".format(tracked.person.name), "left", tracked.person.name)
+        app.dh.presence_ended(tracked.person, tracked.last_seen, tracked.frame_count)
+        logging.info("[LEFT]: {}".format(tracked.person.name))
+
+
+def frame_bus_arguments(app: FHApp) -> dict:
+    """ The PreviewHandler arguments for sharing the frames with other processes, if FRAME_BUS_NAME is set """
+    name = app.config.get("FRAME_BUS_NAME")
+    if not name:
+        return {}
+    if app.config.get("FRAME_BUS_ROLE") == "reader":
+        return {"bus_name": name}
+    bus = FrameBus.create(name,
+                          slots=app.config.get("FRAME_BUS_SLOTS", 4),
+                          max_resolution=OpencvCamera.resolutions[app.config.get("FRAME_BUS_MAX_RESOLUTION", "fhd")])
+    atexit.register(bus.close)
+    logging.info("Frame bus {} created".format(name))
+    return {"bus": bus}
+
+
+def init_app(app: FHApp, db_loc="recogneyez.db"):
+    """ Initializes handlers instance """
+    if not app.dh:
+        app.dh = DatabaseHandler(app, db_loc)
+        # only the process writing the events rolls them up, the web processes of a production setup don't
+        if app.config.get("EVENT_RETENTION_DAYS"):
+            app.dh.start_event_retention(app.config["EVENT_RETENTION_DAYS"],
+                                         app.config.get("EVENT_ROLLUP_INTERVAL_HOURS", 1.0))
+    if not app.sh:
+        app.sh = SettingsHandler(app)
+    if not app.mh:
+        app.mh = MqttHandler(app)
+        app.mh.subscribe(app.sh.get_notification_settings()["topic"])
+    if not app.en:
+        app.en = EmailNotifier(app)
+        atexit.register(app.en.stop)
+    if not app.eb:
+        app.eb = Broadcaster(queue_size=app.config.get("EVENT_STREAM_QUEUE_SIZE", 64),
+                             max_subscribers=app.config.get("EVENT_STREAM_MAX_CLIENTS", 32))
+    if not app.ph:
+        app.ph = PreviewHandler(app,
+                                max_viewers=app.config.get("PREVIEW_MAX_VIEWERS", 4),
+                                jpeg_quality=app.config.get("PREVIEW_JPEG_QUALITY", 80),
+                                headless=app.config.get("PREVIEW_HEADLESS", False),
+                                **frame_bus_arguments(app))
+    if not app.ch:
+        app.ch = CameraHandler(app)
+    if not app.fh:
+        from Library.FaceHandler import FaceHandler
+        app.fh = FaceHandler(app,
+                             db_loc,
+                             cascade_xml="haarcascade_frontalface_default.xml",
+                             img_root=Path("Static").joinpath("dnn")
+                             )
+        app.fh.running_since = datetime.datetime.now()
+        # override the callback methods
+        app.fh.on_known_face_enters = on_known_enters
+        app.fh.on_known_face_leaves = on_known_leaves
+
+
+def init_web_app(app: FHApp, db_loc="recogneyez.db"):
+    """ Initializes the handlers of a web process, the camera and the notifications run in the recognition worker """
+    from Library.ipc import WorkerClient, RemoteCameraHandler, RemoteFaceHandler, ipc_authkey
+    if not app.dh:
+        app.dh = DatabaseHandler(app, db_loc)
+    if not app.sh:
+        app.sh = SettingsHandler(app)
+    if not app.eb:
+        app.eb = Broadcaster(queue_size=app.config.get("EVENT_STREAM_QUEUE_SIZE", 64),
+                             max_subscribers=app.config.get("EVENT_STREAM_MAX_CLIENTS", 32))
+    if not app.ph:
+        app.ph = PreviewHandler(app,
+                                max_viewers=app.config.get("PREVIEW_MAX_VIEWERS", 4),
+                                jpeg_quality=app.config.get("PREVIEW_JPEG_QUALITY", 80),
+                                **frame_bus_arguments(app))
+    client = WorkerClient(app.config["IPC_ADDRESS"], ipc_authkey(app.config))
+    app.ch = RemoteCameraHandler(app, client)
+    app.fh = RemoteFaceHandler(app, client)
+    client.forward_events(app.eb)
+
+
+# parameter is the config Class from config.py
+def create_app(config_class=Config, role="all"):
+    """ Create the app
+    role is "all" to run everything in this process, "web" for a web process of a production setup,
+    where the camera runs in a separate recognition worker process, or "worker" for the recognition worker itself
+    """
+    global app
+    app = FHApp(__name__, static_url_path='', static_folder='./Static', template_folder='./Templates')
+    app.config.from_object(config_class)
+    app.config["PROCESS_ROLE"] = role
+    app.force_rescan = False
+    app.camera_thread = None
+    # t = threading.Thread(target=init_fh, args=(app,))
+    # t.start()
+    if role == "web":
+        app.config["FRAME_BUS_ROLE"] = "reader"
+        init_web_app(app)
+    else:
+        init_app(app)
+    if role == "worker":
+        return app
+
+    # import the blueprints
+    from blueprints.live_view.routes import live_view
+    app.register_blueprint(live_view)
+
+    from blueprints.config_page.routes import config_page
+    app.register_blueprint(config_page)
+
+    from blueprints.persons_database.routes import persons_database
+    app.register_blueprint(persons_database)
+
+    from blueprints.person_edit.routes import person_edit
+    app.register_blueprint(person_edit)
+
+    from blueprints.actions.routes import actions
+    app.register_blueprint(actions)
+
+    from blueprints.errors.handlers import errors
+    app.register_blueprint(errors)
+
+    app.dnn_iter = 0
+    app.present = []
+    app.admin = Admin(app, name='recogneyez', template_mode='bootstrap3')
+    app.ticker = 0
+
+    SimpleLogin(app, login_checker=validate_login)
+    # cache_buster.register_cache_buster(app)
+
+    # app.ch.camera_start_processing()
+    return app